@@ -6,7 +6,8 @@ reqs = ['numpy>=1.13.1',
         'munkres>=1.0.8',
         'scikit_image>=0.12.3',
         'pyilastik>=0.0.5',
-        'bigtiff>=0.1.2']
+        'bigtiff>=0.1.2',
+        'h5py>=2.7.0']
 
 
 def readme():
@@ -0,0 +1,236 @@
+import copy
+import logging
+import os
+import numpy as np
+import yapic_io.utils as ut
+import yapic_io.transformations as trafo
+from yapic_io.connector import Connector
+from yapic_io.tiff_connector import TiffConnector, \
+    _label_value_counts_for_channel
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class ArrayConnector(Connector):
+    '''
+    Implementation of Connector for images and labels held in memory as
+    numpy arrays (or memmaps).
+
+    Tiles are plain slices of the arrays, no file I/O is involved.
+    Lower resolution levels of images (see get_tile) are generated by
+    downsampling on first access and kept in memory.
+    Probabilities written with put_tile are stored in arrays of shape
+    (L, Z, X, Y) per image, one channel per (mapped) label value.
+
+    Parameters
+    ----------
+    images : list of numpy.ndarray
+        Images with dimension order (C, Z, X, Y).
+    labels : list of numpy.ndarray, optional
+        Label images with dimension order (C, Z, X, Y), one per image.
+        None for images without labels.
+    probability_maps : list of numpy.ndarray, optional
+        Preallocated arrays of shape (L, Z, X, Y) for the probabilities
+        of each image, where L is the number of label values.
+        Allocated on first write if not given.
+    probmap_dtype : str or numpy.dtype, optional
+        Data type of allocated probability maps.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.array_connector import ArrayConnector
+    >>> images = [np.zeros((3, 2, 40, 26)), np.zeros((3, 1, 6, 4))]
+    >>> labels = [np.zeros((1, 2, 40, 26), dtype='uint8'), None]
+    >>> labels[0][0, 0, 10:12, 5] = 7
+    >>> c = ArrayConnector(images, labels)
+    >>> c.image_count()
+    2
+    >>> c.labelvalue_mapping
+    [{7: 1}]
+    >>> c.label_count_for_image(0)
+    {1: 2}
+    >>> c.put_tile(np.ones((1, 2, 2)), (0, 1, 1), image_nr=1, label_value=1)
+    >>> c.probability_maps[1][0, 0].sum()
+    4.0
+
+    See Also
+    --------
+    yapic_io.tiff_connector.TiffConnector
+    '''
+
+    def __init__(self, images, labels=None, probability_maps=None,
+                 probmap_dtype='float32'):
+        self.images = list(images)
+        self.labels = list(labels) if labels is not None \
+            else [None] * len(self.images)
+        assert len(self.labels) == len(self.images), \
+            'number of label images does not match number of images'
+
+        if probability_maps is None:
+            probability_maps = [None] * len(self.images)
+        # one mutable slot per image, shared with subsets (see _subset),
+        # thus lazily allocated probability maps are visible to all views
+        self._probability_map_slots = [[p] for p in probability_maps]
+        self.probmap_dtype = np.dtype(probmap_dtype)
+        # downsampled images by (image_nr, level)
+        self._levels = {}
+
+        for img, lbl in zip(self.images, self.labels):
+            assert img.ndim == 4, 'images must have 4 dimensions (C, Z, X, Y)'
+            if lbl is not None:
+                np.testing.assert_array_equal(
+                    lbl.shape[1:], img.shape[1:],
+                    'label dimensions do not fit image dimensions')
+
+        self._original_label_counts = [
+            [_label_value_counts_for_channel(c) for c in lbl]
+            if lbl is not None else None
+            for lbl in self.labels]
+
+        original_labels = [set()] * max(
+            [len(c) for c in self._original_label_counts if c is not None],
+            default=0)
+        for counts in self._original_label_counts:
+            for i, c in enumerate(counts or []):
+                original_labels[i] = original_labels[i].union(c.keys())
+
+        self.labelvalue_mapping = TiffConnector.calc_label_values_mapping(
+            original_labels)
+
+    def __repr__(self):
+        return 'ArrayConnector object\nnr of images: {}'.format(
+            self.image_count())
+
+    def image_count(self):
+        return len(self.images)
+
+    def _image(self, image_nr, level=0):
+        if level == 0:
+            return self.images[image_nr]
+
+        key = (image_nr, level)
+        if key not in self._levels:
+            self._levels[key] = trafo.downsample_2d(
+                self._image(image_nr, level - 1))
+        return self._levels[key]
+
+    def image_dimensions(self, image_nr, level=0):
+        return np.array(self._image(image_nr, level).shape)
+
+    def pixel_dtype(self, image_nr):
+        return self.images[image_nr].dtype
+
+    def get_tile(self, image_nr, pos, size, out=None, level=0):
+        if out is None:
+            out = np.empty(size, dtype='float')
+        np.testing.assert_array_equal(out.shape, size)
+
+        image = self._image(image_nr, level)
+        out[...] = image[ut.region_to_slices(pos, size)]
+        return out
+
+    def _mapped_label_value_to_original(self, label_value):
+        for c, mapping in enumerate(self.labelvalue_mapping):
+            for original, mapped in mapping.items():
+                if mapped == label_value:
+                    return c, original
+
+        raise ValueError('Unknown label value {}'.format(label_value))
+
+    def label_tile(self, image_nr, pos_zxy, size_zxy, label_value):
+        return self.label_tiles(image_nr, pos_zxy, size_zxy, [label_value])[0]
+
+    def label_tiles(self, image_nr, pos_zxy, size_zxy, label_values):
+        tiles = np.zeros((len(label_values),) + tuple(size_zxy), dtype=bool)
+
+        lbl = self.labels[image_nr]
+        if lbl is None:
+            return tiles
+
+        region = ut.region_to_slices(pos_zxy, size_zxy)
+        for tile, label_value in zip(tiles, label_values):
+            c, original = self._mapped_label_value_to_original(label_value)
+            np.equal(lbl[c][region], original, out=tile)
+
+        return tiles
+
+    def label_count_for_image(self, image_nr):
+        counts = self._original_label_counts[image_nr]
+        if counts is None:
+            return None
+
+        return {self.labelvalue_mapping[c][l]: count
+                for c, orig in enumerate(counts)
+                for l, count in orig.items()}
+
+    @property
+    def probability_maps(self):
+        '''
+        Probability maps of all images (None if not written yet).
+        '''
+        return [slot[0] for slot in self._probability_map_slots]
+
+    def _probability_map(self, image_nr):
+        slot = self._probability_map_slots[image_nr]
+        if slot[0] is None:
+            n_labels = sum(len(m) for m in self.labelvalue_mapping)
+            shape = (max(n_labels, 1),) + self.images[image_nr].shape[1:]
+            slot[0] = np.zeros(shape, dtype=self.probmap_dtype)
+        return slot[0]
+
+    def put_tile(self, pixels, pos_zxy, image_nr, label_value):
+        np.testing.assert_equal(len(pos_zxy), 3)
+        np.testing.assert_equal(len(pixels.shape), 3)
+
+        probmap = self._probability_map(image_nr)
+        pixels = ut.quantize_probabilities(pixels, probmap.dtype)
+        region = ut.region_to_slices(pos_zxy, pixels.shape)
+        probmap[label_value - 1][region] = pixels
+
+    def _subset(self, image_nrs):
+        '''
+        Connector for a subset of the images (a view).
+
+        The subset shares image, label and probability map arrays (also
+        probability maps allocated later by either connector), label
+        counts and downsampled images with this connector, thus no labels
+        are counted again. The labelvalue mapping is kept.
+        '''
+        subset = copy.copy(self)
+        subset.images = [self.images[i] for i in image_nrs]
+        subset.labels = [self.labels[i] for i in image_nrs]
+        subset._probability_map_slots = [self._probability_map_slots[i]
+                                         for i in image_nrs]
+        subset._original_label_counts = [self._original_label_counts[i]
+                                         for i in image_nrs]
+        # downsampled images are keyed by image index
+        subset._levels = {(image_nrs.index(i), level): image
+                          for (i, level), image in self._levels.items()
+                          if i in image_nrs}
+        return subset
+
+    def split(self, fraction, random_seed=42):
+        '''
+        Split the images pseudo-randomly into two Connector subsets.
+
+        The first of size `(1-fraction)*N_images`, the other of size
+        `fraction*N_images`
+
+        Both connectors are views sharing arrays and label counts with
+        this connector. Both keep the labelvalue mapping of this
+        connector.
+
+        Parameters
+        ----------
+        fraction : float
+        random_seed : float, optional
+
+        Returns
+        -------
+        connector_1, connector_2
+        '''
+        image_nrs1, image_nrs2 = ut.split_image_nrs(
+            self.image_count(), fraction, random_seed=random_seed)
+
+        return self._subset(image_nrs1), self._subset(image_nrs2)
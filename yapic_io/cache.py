@@ -0,0 +1,281 @@
+import collections
+import logging
+import os
+import numpy as np
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class LRUCache(object):
+    '''
+    Least recently used cache with a budget on the number of entries and
+    on their total size in bytes.
+
+    If one of the budgets is exceeded, least recently used entries are
+    evicted until both budgets are met again. The most recently added
+    entry is never evicted, even if it exceeds the budget on its own.
+
+    Parameters
+    ----------
+    max_items : int, optional
+        Maximum number of entries. Unlimited if None.
+    max_bytes : int, optional
+        Maximum total size of all entries in bytes. Unlimited if None.
+    on_evict : callable, optional
+        Function called with each value evicted from the cache or
+        removed by ``clear()``, e.g. for closing files.
+
+    Examples
+    --------
+    >>> from yapic_io.cache import LRUCache
+    >>> cache = LRUCache(max_items=2)
+    >>> cache.get('a', lambda: 1)
+    1
+    >>> cache.get('b', lambda: 2)
+    2
+    >>> cache.get('a', lambda: 3)  # 'a' is cached
+    1
+    >>> cache.get('c', lambda: 4)  # 'b' is evicted
+    4
+    >>> sorted(cache.keys())
+    ['a', 'c']
+    >>> cache.hits, cache.misses, cache.evictions
+    (1, 3, 1)
+    '''
+
+    def __init__(self, max_items=None, max_bytes=None, on_evict=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+
+        self._entries = collections.OrderedDict()
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return ('LRUCache ({} entries, {} bytes, hits: {}, misses: {}, '
+                'evictions: {})').format(len(self), self.nbytes, self.hits,
+                                         self.misses, self.evictions)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def keys(self):
+        return self._entries.keys()
+
+    def get(self, key, load, nbytes=None):
+        '''
+        Get a cached value. If the value is not cached, it is loaded and
+        added to the cache.
+
+        Parameters
+        ----------
+        key : hashable
+            Key of the entry.
+        load : callable
+            Function without arguments returning the value for `key`.
+        nbytes : callable, optional
+            Function returning the size in bytes of a loaded value.
+            If not given, values are assumed to have no size.
+
+        Returns
+        -------
+        object
+            The cached or loaded value.
+        '''
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+        self.misses += 1
+        value = load()
+        self.put(key, value, nbytes=nbytes(value) if nbytes else 0)
+        return value
+
+    def put(self, key, value, nbytes=0):
+        '''
+        Add a value to the cache (replacing a value with the same key).
+        '''
+        self.pop(key)
+        self._entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        self._evict()
+
+    def pop(self, key):
+        '''
+        Remove an entry from the cache.
+
+        Returns
+        -------
+        object
+            The removed value or None if key is not cached.
+        '''
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self.nbytes -= entry[1]
+        return entry[0]
+
+    def clear(self):
+        entries = list(self._entries.values())
+        self._entries.clear()
+        self.nbytes = 0
+        if self.on_evict is not None:
+            for value, _ in entries:
+                self.on_evict(value)
+
+    def _is_over_budget(self):
+        if self.max_items is not None and len(self) > self.max_items:
+            return True
+        if self.max_bytes is not None and self.nbytes > self.max_bytes:
+            return True
+        return False
+
+    def _evict(self):
+        while len(self) > 1 and self._is_over_budget():
+            key, (value, nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+            logger.debug('Evicted %s from cache', key)
+            if self.on_evict is not None:
+                self.on_evict(value)
+
+
+class WriteBackBuffer(object):
+    '''
+    Write-back buffer accumulating writes to 2d planes in memory.
+
+    Each plane is assembled in RAM together with a mask and a count of
+    the pixels written so far. Completely written planes are passed to
+    the write function immediately, as one contiguous write. Partially
+    written planes are passed together with their mask if the memory
+    budget is exceeded (least recently written planes first) or on
+    ``flush()``. Planes larger than the budget are split into bands of
+    rows (see band_rows), which are buffered like separate planes.
+
+    Parameters
+    ----------
+    write : callable
+        Function ``write(key, plane, mask)`` storing the buffered values
+        of a plane. `mask` is None for completely written planes, else a
+        boolean array indicating the written pixels.
+    max_bytes : int, optional
+        Maximum total size of all buffered planes including masks.
+        Unlimited if None.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from yapic_io.cache import WriteBackBuffer
+    >>> target = np.zeros((2, 4))
+    >>> def write(key, plane, mask):
+    ...     np.copyto(target, plane, where=True if mask is None else mask)
+    >>> buf = WriteBackBuffer(write)
+    >>> buf.put('a', (2, 4), (slice(0, 2), slice(0, 2)), np.ones((2, 2)))
+    >>> target.sum()  # nothing written yet
+    0.0
+    >>> buf.put('a', (2, 4), (slice(0, 2), slice(2, 4)), np.ones((2, 2)))
+    >>> target.sum()  # plane complete
+    8.0
+    '''
+
+    def __init__(self, write, max_bytes=None):
+        self.write = write
+        self.max_bytes = max_bytes
+
+        self._planes = collections.OrderedDict()
+        self.nbytes = 0
+
+    def __repr__(self):
+        return 'WriteBackBuffer ({} planes, {} bytes)'.format(len(self),
+                                                              self.nbytes)
+
+    def __len__(self):
+        return len(self._planes)
+
+    @staticmethod
+    def _plane_nbytes(shape, dtype):
+        # buffered values and mask
+        return int(np.prod(shape)) * (np.dtype(dtype).itemsize + 1)
+
+    def accepts(self, shape, dtype=np.float32):
+        '''
+        Check if a plane of given shape and dtype fits into the memory
+        budget, i.e. if writes to it can be buffered.
+        '''
+        return self.max_bytes is None or \
+            self._plane_nbytes(shape, dtype) <= self.max_bytes
+
+    def band_rows(self, shape, dtype=np.float32):
+        '''
+        Number of rows per band for buffering a plane of given shape and
+        dtype.
+
+        All rows if the plane fits into the memory budget. Otherwise the
+        plane is split into bands using at most half of the budget each,
+        such that writes spanning two adjacent bands are buffered
+        without evicting one of them. 0 if a single row does not fit,
+        i.e. writes to the plane cannot be buffered.
+        '''
+        if self.accepts(shape, dtype):
+            return shape[0]
+        row_nbytes = self._plane_nbytes(shape[1:], dtype)
+        return self.max_bytes // (2 * row_nbytes)
+
+    def put(self, key, shape, index, values, dtype=np.float32):
+        '''
+        Buffer values written to a subsection of a plane.
+
+        Parameters
+        ----------
+        key : hashable
+            Identifier of the plane.
+        shape : tuple
+            Shape of the complete plane.
+        index : tuple of slices
+            Subsection of the plane.
+        values : numpy.ndarray
+            Values of the subsection.
+        dtype : numpy.dtype, optional
+            Data type of the buffered plane.
+        '''
+        entry = self._planes.get(key)
+        if entry is None:
+            entry = [np.empty(shape, dtype=dtype),
+                     np.zeros(shape, dtype=bool), 0]
+            self._planes[key] = entry
+            self.nbytes += self._plane_nbytes(shape, dtype)
+        else:
+            self._planes.move_to_end(key)
+
+        plane, mask, _ = entry
+        written = mask[index]
+        entry[2] += written.size - np.count_nonzero(written)
+        plane[index] = values
+        mask[index] = True
+
+        if entry[2] == plane.size:
+            self._write(key, complete=True)
+
+        while self.max_bytes is not None and self.nbytes > self.max_bytes:
+            self._write(next(iter(self._planes)))
+
+    def flush(self):
+        '''
+        Write all buffered planes.
+        '''
+        for key in list(self._planes.keys()):
+            self._write(key)
+
+    def _write(self, key, complete=False):
+        plane, mask, _ = self._planes.pop(key)
+        self.nbytes -= plane.nbytes + mask.nbytes
+        self.write(key, plane, None if complete else mask)
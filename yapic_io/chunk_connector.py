@@ -0,0 +1,160 @@
+import logging
+import os
+from pathlib import Path
+import numpy as np
+from yapic_io.chunk_store import ChunkStore, is_chunk_store
+from yapic_io.tiff_connector import TiffConnector
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class ChunkConnector(TiffConnector):
+    '''
+    Implementation of Connector for images and labels stored as chunked
+    directory stores (see yapic_io.chunk_store.ChunkStore).
+
+    Each image and each label image is a directory ``<name>.chunks``
+    holding a 4D array with dimension order (C, Z, Y, X), one zlib
+    compressed file per chunk and a json metadata file. Tiles are read
+    from the intersecting chunks only. Probability maps are written
+    as chunk stores as well, thus prediction results of different
+    chunks can be written concurrently.
+
+    Use ``convert_tiff_connector`` to convert tiff datasets.
+
+    Parameters
+    ----------
+    img_filepath : str or list of str
+        Path to image stores (use wildcards for filtering)
+        or a list of store paths.
+    label_filepath : str or list of str
+        Path to label stores (use wildcards for filtering)
+        or a list of store paths.
+    savepath : str, optional
+        Directory to save pixel classifiaction results as probability
+        map stores.
+    chunks : tuple, optional
+        Chunk shape (C, Z, Y, X) of probability map stores.
+    **kwargs
+        Further options of TiffConnector.
+
+    Examples
+    --------
+    >>> import tempfile
+    >>> from yapic_io.tiff_connector import TiffConnector
+    >>> from yapic_io.chunk_connector import convert_tiff_connector
+    >>> pixel_image_dir = 'yapic_io/test_data/tiffconnector_1/im/*.tif'
+    >>> label_image_dir = 'yapic_io/test_data/tiffconnector_1/labels/*.tif'
+    >>> t = TiffConnector(pixel_image_dir, label_image_dir)
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> c = convert_tiff_connector(t, tmp.name)
+    >>> c.image_count()
+    3
+    >>> c.labelvalue_mapping
+    [{91: 1, 109: 2, 150: 3}]
+
+    See Also
+    --------
+    yapic_io.tiff_connector.TiffConnector
+    '''
+    filemask = '*.chunks'
+    probmap_extension = '.chunks'
+
+    def __init__(self, img_filepath, label_filepath, savepath=None,
+                 chunks=None, **kwargs):
+        self.chunks = chunks
+        super().__init__(img_filepath, label_filepath, savepath=savepath,
+                         **kwargs)
+
+    def __repr__(self):
+        return super().__repr__().replace(
+            'TiffConnector', 'ChunkConnector', 1)
+
+    @classmethod
+    def _open_tcz(cls, path, tile_cache=None, writable=False):
+        if not is_chunk_store(path):
+            # e.g. generated resolution levels
+            return super()._open_tcz(path, tile_cache=tile_cache)
+        return ChunkStore(path, cache=tile_cache).planes()
+
+    @classmethod
+    def _open_level_tcz(cls, path, level, tile_cache=None):
+        # chunk stores hold no pyramid levels
+        return None
+
+    @classmethod
+    def _read_header(cls, path):
+        store = ChunkStore(path)
+        return store.shape, store.dtype
+
+    def _create_probability_map_file(self, path, image_nr, n_channels):
+        _, Z, X, Y = self.image_dimensions(image_nr)
+        ChunkStore.create(path, (n_channels, Z, Y, X), self.probmap_dtype,
+                          chunks=self.chunks)
+
+
+def _convert_tiff(planes, path, chunks=None, compression_level=1):
+    '''
+    Write tcz planes of a tiff file (T=1) to a new chunk store.
+    '''
+    _, C, Z = planes.shape
+    Y, X = planes[0, 0, 0].shape
+
+    store = ChunkStore.create(path, (C, Z, Y, X), planes[0, 0, 0].dtype,
+                              chunks=chunks,
+                              compression_level=compression_level)
+    for c in range(C):
+        for z in range(Z):
+            plane = np.asarray(planes[0, c, z])
+            store.write((c, z, 0, 0), plane[np.newaxis, np.newaxis])
+    return store
+
+
+def convert_tiff_connector(connector, path, chunks=None,
+                           compression_level=1, **kwargs):
+    '''
+    Convert images and labels of a TiffConnector to chunk stores.
+
+    Images are written to ``<path>/images/<name>.chunks`` and labels to
+    ``<path>/labels/<name>.chunks``, where `name` is the file name of
+    the image without extension.
+
+    Parameters
+    ----------
+    connector : yapic_io.tiff_connector.TiffConnector
+        Connector to convert.
+    path : str or pathlib.Path
+        Target directory.
+    chunks : tuple, optional
+        Chunk shape (C, Z, Y, X) of converted images, labels and of
+        probability maps. By default chunks are single 256x256 planes.
+    compression_level : int, optional
+        zlib compression level from 0 (no compression) to 9.
+    **kwargs
+        Further options of ChunkConnector.
+
+    Returns
+    -------
+    ChunkConnector
+        Connector for the converted dataset.
+    '''
+    path = Path(path)
+    img_path = path / 'images'
+    lbl_path = path / 'labels'
+    img_path.mkdir(parents=True, exist_ok=True)
+    lbl_path.mkdir(parents=True, exist_ok=True)
+
+    for image_nr, (img, lbl) in enumerate(connector.filenames):
+        name = '{}.chunks'.format(img.stem)
+        logger.info('Converting %s', img)
+
+        _convert_tiff(connector._open_image_file(image_nr), img_path / name,
+                      chunks=chunks, compression_level=compression_level)
+
+        if lbl is not None:
+            _convert_tiff(connector._open_label_file(image_nr),
+                          lbl_path / name, chunks=chunks,
+                          compression_level=compression_level)
+
+    return ChunkConnector(str(img_path), str(lbl_path), chunks=chunks,
+                          **kwargs)
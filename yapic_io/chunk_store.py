@@ -0,0 +1,282 @@
+import json
+import logging
+import os
+import zlib
+from pathlib import Path
+import numpy as np
+import yapic_io.utils as ut
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+META_FILENAME = 'meta.json'
+
+
+def is_chunk_store(path):
+    '''
+    Check if a path is a directory holding a ChunkStore.
+    '''
+    return (Path(path) / META_FILENAME).is_file()
+
+
+class ChunkStore(object):
+    '''
+    N-dimensional array stored in a directory as one zlib compressed
+    file per chunk, described by a json metadata file.
+
+    Chunks are named by their index, e.g. ``0.2.1.0``, and are written
+    atomically. Chunks that were never written are not stored and read
+    as `fill_value`, thus stores are created instantly regardless of
+    their size. Several processes can write to the same store
+    concurrently, as long as they write to different chunks.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Directory of the store.
+    cache : yapic_io.cache.LRUCache, optional
+        Cache for decoded chunks.
+
+    Examples
+    --------
+    >>> import tempfile, os
+    >>> import numpy as np
+    >>> from yapic_io.chunk_store import ChunkStore
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> path = os.path.join(tmp.name, 'store')
+    >>> s = ChunkStore.create(path, (4, 6), 'uint8', chunks=(2, 4))
+    >>> s.write((1, 2), np.ones((2, 3)))
+    >>> s.read((0, 0), (4, 6))
+    array([[0, 0, 0, 0, 0, 0],
+           [0, 0, 1, 1, 1, 0],
+           [0, 0, 1, 1, 1, 0],
+           [0, 0, 0, 0, 0, 0]], dtype=uint8)
+    >>> sorted(os.listdir(path))
+    ['0.0', '0.1', '1.0', '1.1', 'meta.json']
+    '''
+
+    def __init__(self, path, cache=None):
+        self.path = Path(path)
+        self.cache = cache
+
+        with (self.path / META_FILENAME).open() as f:
+            meta = json.load(f)
+
+        self.shape = tuple(meta['shape'])
+        self.chunks = tuple(meta['chunks'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.fill_value = meta.get('fill_value', 0)
+        self.compression_level = meta.get('compression_level', 1)
+
+    def __repr__(self):
+        return 'ChunkStore (shape {}, chunks {}, {}): {}'.format(
+            self.shape, self.chunks, self.dtype, self.path)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @classmethod
+    def create(cls, path, shape, dtype, chunks=None, fill_value=0,
+               compression_level=1, cache=None):
+        '''
+        Create an empty store.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            Directory of the store (created if it does not exist).
+        shape : tuple
+            Shape of the array.
+        dtype : numpy.dtype
+            Data type of the array.
+        chunks : tuple, optional
+            Shape of one chunk. By default, chunks span 256 elements
+            in the last two dimensions and 1 element in all others.
+        fill_value : scalar, optional
+            Value of elements that were not written.
+        compression_level : int, optional
+            zlib compression level from 0 (no compression) to 9.
+        cache : yapic_io.cache.LRUCache, optional
+            Cache for decoded chunks.
+
+        Returns
+        -------
+        ChunkStore
+        '''
+        if chunks is None:
+            chunks = (1,) * (len(shape) - 2) + (256, 256)
+        chunks = tuple(int(min(c, max(s, 1))) for c, s in zip(chunks, shape))
+
+        meta = {'shape': [int(s) for s in shape],
+                'chunks': list(chunks),
+                'dtype': np.dtype(dtype).str,
+                'fill_value': fill_value,
+                'compression': 'zlib',
+                'compression_level': compression_level}
+
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with (path / META_FILENAME).open('w') as f:
+            json.dump(meta, f)
+
+        return cls(path, cache=cache)
+
+    def _chunk_path(self, chunk_idx):
+        return self.path / '.'.join(str(i) for i in chunk_idx)
+
+    def _cache_key(self, chunk_idx):
+        return (self.path, chunk_idx)
+
+    def _load_chunk(self, chunk_idx):
+        path = self._chunk_path(chunk_idx)
+        if not path.exists():
+            return np.full(self.chunks, self.fill_value, dtype=self.dtype)
+
+        with path.open('rb') as f:
+            buf = zlib.decompress(f.read())
+        return np.frombuffer(buf, dtype=self.dtype).reshape(self.chunks)
+
+    def chunk(self, chunk_idx):
+        '''
+        Get a decoded chunk (read-only).
+        '''
+        if self.cache is None:
+            return self._load_chunk(chunk_idx)
+
+        return self.cache.get(self._cache_key(chunk_idx),
+                              lambda: self._load_chunk(chunk_idx),
+                              lambda chunk: chunk.nbytes)
+
+    def _store_chunk(self, chunk_idx, chunk):
+        path = self._chunk_path(chunk_idx)
+        buf = zlib.compress(np.ascontiguousarray(chunk, dtype=self.dtype),
+                            self.compression_level)
+
+        # write to a temporary file first to never leave a broken chunk
+        tmp_path = path.with_name('{}.{}.tmp'.format(path.name, os.getpid()))
+        with tmp_path.open('wb') as f:
+            f.write(buf)
+        os.replace(str(tmp_path), str(path))
+
+        if self.cache is not None:
+            self.cache.put(self._cache_key(chunk_idx), chunk,
+                           nbytes=chunk.nbytes)
+
+    def read(self, pos, size, out=None):
+        '''
+        Read a subset of the array. Only intersecting chunks are read.
+
+        Parameters
+        ----------
+        pos : tuple
+            Upper left position of the subset.
+        size : tuple
+            Size of the subset.
+        out : numpy.ndarray, optional
+            Buffer of shape `size` the subset is written to.
+
+        Returns
+        -------
+        numpy.ndarray
+            The subset (`out` if given).
+        '''
+        ut.assert_valid_image_subset(self.shape, pos, size)
+        if out is None:
+            out = np.empty(size, dtype=self.dtype)
+
+        for chunk_idx, in_chunk, in_out in ut.intersecting_chunks(
+                pos, size, self.chunks):
+            out[in_out] = self.chunk(chunk_idx)[in_chunk]
+
+        return out
+
+    def write(self, pos, values):
+        '''
+        Write a subset of the array. Only intersecting chunks are
+        modified, partially covered chunks are read, updated and
+        written again.
+
+        Parameters
+        ----------
+        pos : tuple
+            Upper left position of the subset.
+        values : numpy.ndarray
+            Values of the subset.
+        '''
+        values = np.asarray(values)
+        ut.assert_valid_image_subset(self.shape, pos, values.shape)
+
+        for chunk_idx, in_chunk, in_out in ut.intersecting_chunks(
+                pos, values.shape, self.chunks):
+            complete = all(s.stop - s.start == c
+                           for s, c in zip(in_chunk, self.chunks))
+            if complete:
+                chunk = np.empty(self.chunks, dtype=self.dtype)
+            else:
+                chunk = self.chunk(chunk_idx).copy()
+            chunk[in_chunk] = values[in_out]
+            self._store_chunk(chunk_idx, chunk)
+
+    def planes(self):
+        '''
+        Get the last two dimensions of a 4D store of shape (C, Z, Y, X)
+        as lazy 2d planes, arranged like bigtiff.Tiff.memmap_tcz.
+
+        Returns
+        -------
+        numpy.ndarray
+            Object array of shape (T, C, Z) holding ChunkPlane objects
+            (T is always 1).
+        '''
+        assert self.ndim == 4, 'expected 4 dimensions (C, Z, Y, X)'
+
+        C, Z = self.shape[:2]
+        slices = np.empty((1, C, Z), dtype=object)
+        for c in range(C):
+            for z in range(Z):
+                slices[0, c, z] = ChunkPlane(self, c, z)
+        return slices
+
+
+class ChunkPlane(object):
+    '''
+    Lazy 2d plane (Y, X) of a 4D ChunkStore of shape (C, Z, Y, X).
+
+    Behaves like a numpy array for reading and writing ranges,
+    e.g. ``plane[Y:YY, X:XX]``.
+    '''
+    ndim = 2
+
+    def __init__(self, store, c, z):
+        self.store = store
+        self.c = c
+        self.z = z
+        self.shape = store.shape[2:]
+        self.dtype = store.dtype
+
+    def __repr__(self):
+        return 'ChunkPlane {} (c={}, z={}) of {}'.format(
+            self.shape, self.c, self.z, self.store.path)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    @property
+    def T(self):
+        return np.asarray(self).T
+
+    def __array__(self, dtype=None):
+        plane = self[...]
+        return plane if dtype is None else plane.astype(dtype)
+
+    def __getitem__(self, key):
+        pos, size = ut.slices_to_region(key, self.shape)
+        out = self.store.read((self.c, self.z) + pos, (1, 1) + size)
+        return out[0, 0]
+
+    def __setitem__(self, key, values):
+        pos, size = ut.slices_to_region(key, self.shape)
+        values = np.broadcast_to(values, size)
+        self.store.write((self.c, self.z) + pos, values[np.newaxis,
+                                                        np.newaxis])
@@ -1,6 +1,7 @@
 from abc import ABCMeta, abstractmethod
 import logging
 import os
+import numpy as np
 logger = logging.getLogger(os.path.basename(__file__))
 
 
@@ -62,6 +63,9 @@ class Connector(metaclass=ABCMeta):
     The Connector methods are used by the Dataset class.
     '''
 
+    # data type of probability maps written with put_tile
+    probmap_dtype = np.dtype('float32')
+
     def __init__(self):
         '''
         In polling mode, the dataset will repeatedly fetch
@@ -106,8 +110,27 @@ class Connector(metaclass=ABCMeta):
         '''
         pass
 
+    def label_count_for_all_images(self, workers=None):
+        '''
+        Returns for each image the number of labels per label value.
+
+        Parameters
+        ----------
+        workers : int, optional
+            Number of worker processes for scanning labels. Connectors
+            that do not support parallel scanning ignore this.
+
+        Returns
+        -------
+        list
+            Label counts per image (as returned by label_count_for_image).
+        '''
+        return [self.label_count_for_image(i)
+                for i in range(self.image_count())]
+
     @abstractmethod
-    def get_tile(self, image_nr=None, pos=None, size=None):
+    def get_tile(self, image_nr=None, pos=None, size=None, out=None,
+                 level=0):
         '''
         Get 4D subsection of an image.
 
@@ -117,14 +140,39 @@ class Connector(metaclass=ABCMeta):
             Index of image.
         pos : (channel, zslice, x, y)
             Upper left position of subsection
+        size : (nr_channels, nr_zslices, nr_x, nr_y)
+            Size of subsection.
+        out : numpy.ndarray, optional
+            Buffer of shape `size` the subsection is written to. Pixel
+            values are converted to the dtype of the buffer.
+        level : int, optional
+            Resolution level of the image. Level `k` is downsampled by
+            a factor of ``2**k`` in x and y, `pos` and `size` are given
+            in pixels of that level.
 
         Returns
         -------
         numpy.ndarray
-            4D subsection of image as numpy array
+            4D subsection of image as numpy array (`out` if given)
         '''
         pass
 
+    def pixel_dtype(self, image_nr):
+        '''
+        Get the native data type of the pixels of an image.
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+
+        Returns
+        -------
+        numpy.dtype
+            Data type of pixel values.
+        '''
+        return self.get_tile(image_nr, (0, 0, 0, 0), (1, 1, 1, 1)).dtype
+
     @abstractmethod
     def label_tile(self, image_nr, pos_zxy, size_zxy, label_value):
         '''
@@ -153,6 +201,40 @@ class Connector(metaclass=ABCMeta):
 
         pass
 
+    def label_tiles(self, image_nr, pos_zxy, size_zxy, label_values):
+        '''
+        Get 4d boolean matrix where positions of the requested labels
+        are indicated with True, stacked along the first dimension.
+        Only mapped labelvalues can be requested.
+
+        dimension order: (label, z, x, y)
+
+        Connectors should overload this method to read the label data
+        only once for all requested labels.
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        pos_zxy : (zslice, x, y)
+            Upper left position of subsection.
+        size_zxy : (nr_zslices, nr_x, nr_y)
+            Size of subsection.
+        label_values : array_like
+            Ids of the labels.
+
+        Returns
+        -------
+        numpy.ndarray
+            3D subsections of labelmatrix as boolean masks in dimension
+            order (label, z, x, y)
+        '''
+        tiles = np.zeros((len(label_values),) + tuple(size_zxy), dtype=bool)
+        for i, label_value in enumerate(label_values):
+            tiles[i] = self.label_tile(image_nr, pos_zxy, size_zxy,
+                                       label_value)
+        return tiles
+
     @abstractmethod
     def put_tile(self, pixels, pos_zxy, image_nr, label_value):
         '''
@@ -178,8 +260,53 @@ class Connector(metaclass=ABCMeta):
             True in case of successful write.
         '''
 
+    def put_tiles(self, pixels, pos_zxy, image_nr, label_values):
+        '''
+        Puts probabilities (pixels) for several labels to the data storage.
+
+        Connectors should overload this method if probabilities of
+        several labels can be written at once.
+
+        Parameters
+        ----------
+        pixels : numpy.ndarray
+            4D matrix of probability values with shape (label, z, x, y)
+        pos_zxy : (z, x, y)
+            Upper left position of pixels in source image_nr.
+        image_nr : int
+            Index of image.
+        label_values : array_like
+            Ids of the labels, one for each channel of `pixels`.
+        '''
+        for label_pixels, label_value in zip(pixels, label_values):
+            self.put_tile(label_pixels, pos_zxy, image_nr, label_value)
+
+    def flush(self):
+        '''
+        Write all buffered probability map data to the data storage.
+
+        Connectors that buffer data written with ``put_tile`` must
+        overload this method.
+        '''
+        pass
+
+    def close(self):
+        '''
+        Write all buffered data and release open files.
+
+        Connectors can also be used as context manager, which closes
+        them on exit.
+        '''
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     @abstractmethod
-    def image_dimensions(self, image_nr):
+    def image_dimensions(self, image_nr, level=0):
         '''
         Get dimensions of the dataset.
 
@@ -188,6 +315,8 @@ class Connector(metaclass=ABCMeta):
         ----------
         image_nr : int
             index of image
+        level : int, optional
+            Resolution level (see get_tile).
 
         Returns
         -------
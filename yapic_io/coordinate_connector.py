@@ -19,6 +19,18 @@ class CoordinateConnector(Connector, metaclass=ABCMeta):
     - sparse labelling where labels are stored as coordinates
     '''
 
+    def has_label_coordinates(self):
+        '''
+        Check if label coordinates are available. Connectors that index
+        label coordinates optionally overload this method, the dataset
+        object falls back to random polling if False.
+
+        Returns
+        -------
+        bool
+        '''
+        return True
+
     @abstractmethod
     def label_index_to_coordinate(self, image_nr, label_value, label_index):
         '''
@@ -3,7 +3,7 @@ from numpy.random import choice, randint
 import random
 import collections
 import yapic_io.utils as ut
-from functools import lru_cache
+from functools import lru_cache, reduce
 import logging
 import os
 import yapic_io.transformations as trafo
@@ -31,6 +31,14 @@ class Dataset(object):
     pixel_connector : yapic_io.connector.Connector
         Connector object (e.g. TiffConnector or IlastikConnector) for binding
         of pixel and label data, as well as prediction result data.
+    workers : int, optional
+        Number of worker processes for scanning label counts of all images.
+        By default labels are scanned sequentially.
+    native_dtype : bool, optional
+        If True, pixel tiles keep the native data type of the images
+        (e.g. uint8) through padding and augmentation, instead of being
+        converted to float64. Conversion to float is then left to
+        normalization in the Minibatch classes.
 
     Notes
     -----
@@ -38,11 +46,17 @@ class Dataset(object):
     Pixel data is cached in memory for repeated requests.
     '''
 
-    def __init__(self, pixel_connector):
+    def __init__(self, pixel_connector, workers=None, native_dtype=False):
 
         self.pixel_connector = pixel_connector
         self.n_images = pixel_connector.image_count()
+        self.workers = workers
+        self.native_dtype = native_dtype
+        # common dtype of all images in native dtype mode
+        self._pixel_dtype = None
         self.label_counts = self.load_label_counts()
+        # cumulative label counts for label coordinate lookup
+        self._label_count_cumsums = {}
 
         # self.label_weights dict is complementary to self.label_counts
         self.label_weights = {label: 1 for label in self.label_counts.keys()}
@@ -54,7 +68,7 @@ class Dataset(object):
         return 'Dataset ({} images)'.format(self.n_images)
 
     @lru_cache(maxsize=1000)
-    def image_dimensions(self, image_nr):
+    def image_dimensions(self, image_nr, level=0):
         '''
         Returns dimensions of the dataset.
         dims is a 4-element-tuple:
@@ -63,12 +77,35 @@ class Dataset(object):
         ----------
         image_nr : int
             index of image
+        level : int, optional
+            Resolution level, downsampled by ``2**level`` in x and y.
 
         Returns
         -------
         (nr_channels, nr_zslices, nr_x, nr_y)
         '''
-        return self.pixel_connector.image_dimensions(image_nr)
+        if level == 0:
+            return self.pixel_connector.image_dimensions(image_nr)
+        return self.pixel_connector.image_dimensions(image_nr, level=level)
+
+    def pixel_dtype(self):
+        '''
+        Data type of pixel tiles.
+
+        Returns
+        -------
+        numpy.dtype
+            float64 by default. In native dtype mode, the smallest type
+            the pixels of all images can be safely cast to.
+        '''
+        if not self.native_dtype:
+            return np.dtype('float')
+
+        if self._pixel_dtype is None:
+            dtypes = [self.pixel_connector.pixel_dtype(i)
+                      for i in range(self.n_images)]
+            self._pixel_dtype = reduce(np.promote_types, dtypes)
+        return self._pixel_dtype
 
     def label_values(self):
         '''
@@ -126,7 +163,7 @@ class Dataset(object):
         if labels == 'all':
             labels = self.label_values()
 
-        if hasattr(self.pixel_connector, 'label_index_to_coordinate'):
+        if _has_label_coordinates(self.pixel_connector):
             # fetch by label index
             return self._random_training_tile_by_coordinate(
                 size_zxy,
@@ -254,7 +291,7 @@ class Dataset(object):
         if ensure_labelvalue is None:
             ensure_labelvalue = self._random_label_value(equalized=equalized)
 
-        total_count = self.label_counts[ensure_labelvalue].sum()
+        total_count = self._cumulative_label_counts(ensure_labelvalue)[-1]
         img_nr, _, *pos_zxy = self.label_coordinate(ensure_labelvalue,
                                                     randint(total_count))
         np.testing.assert_array_equal(len(pos_zxy), len(size_zxy))
@@ -277,6 +314,53 @@ class Dataset(object):
 
         return tile_data
 
+    def _cumulative_label_counts(self, label_value):
+        '''
+        Cumulative counts of a label value over all images. Recomputed
+        only if the label counts of the label value were replaced.
+        '''
+        counts = self.label_counts[label_value]
+        cached = self._label_count_cumsums.get(label_value)
+        if cached is None or cached[0] is not counts:
+            cached = (counts, np.cumsum(counts))
+            self._label_count_cumsums[label_value] = cached
+        return cached[1]
+
+    def label_coordinate(self, label_value, label_index):
+        '''
+        Get the coordinate of a label by its index among all labels of
+        a label value in the dataset.
+
+        The image is looked up by bisection of the cumulative label
+        counts of all images, the coordinate within the image is
+        provided by the connector (see
+        yapic_io.coordinate_connector.CoordinateConnector).
+
+        Parameters
+        ----------
+        label_value : int
+            Label value (mapped label value).
+        label_index : int
+            Value between 0 and the total count of the label value.
+
+        Returns
+        -------
+        numpy.ndarray
+            (image_nr, c, z, x, y) coordinate of the label.
+        '''
+        cumsum = self._cumulative_label_counts(label_value)
+        if not 0 <= label_index < cumsum[-1]:
+            raise IndexError('label index {} out of range for {} labels '
+                             'of value {}'.format(label_index, cumsum[-1],
+                                                  label_value))
+
+        image_nr = int(np.searchsorted(cumsum, label_index, side='right'))
+        offset = cumsum[image_nr - 1] if image_nr > 0 else 0
+
+        czxy = self.pixel_connector.label_index_to_coordinate(
+            image_nr, label_value, label_index - offset)
+        return np.hstack([[image_nr], czxy])
+
     def training_tile(self,
                       image_nr,
                       pos_zxy,
@@ -284,7 +368,8 @@ class Dataset(object):
                       channels,
                       labels,
                       pixel_padding=(0, 0, 0),
-                      augment_params=None):
+                      augment_params=None,
+                      out=None):
         '''
         Returns a training tile including weights.
 
@@ -309,6 +394,8 @@ class Dataset(object):
             rot90 : int, number of 90 degree rotations;
             rotate : float, rotation in degrees;
             shear : float, shear in degrees.
+        out : numpy.ndarray, optional
+            Buffer for the pixel tile (see multichannel_pixel_tile).
 
         Returns
         -------
@@ -320,17 +407,19 @@ class Dataset(object):
         pixel_tile = self.multichannel_pixel_tile(
                         image_nr, pos_zxy, size_zxy, channels,
                         pixel_padding=pixel_padding,
-                        augment_params=augment_params)
+                        augment_params=augment_params,
+                        out=out)
 
-        # 4d label tile with selected labels in 1st dimension
+        # 4d label tile with selected labels in 1st dimension,
+        # all labels are fetched and augmented in a single pass
         shape_zxy = self.image_dimensions(image_nr)[1:]
-        label_tile = [_augment_tile(shape_zxy, pos_zxy, size_zxy,
-                                    self._get_weights_tile,
-                                    augment_params=augment_params,
-                                    image_nr=image_nr,
-                                    label_value=l)
-                      for l in labels]
-        label_tile = np.array(label_tile)
+        label_tile = _augment_tile(np.hstack([[len(labels)], shape_zxy]),
+                                   np.hstack([[0], pos_zxy]),
+                                   np.hstack([[len(labels)], size_zxy]),
+                                   self._get_weights_tiles,
+                                   augment_params=augment_params,
+                                   image_nr=image_nr,
+                                   label_values=list(labels))
 
         msg = 'pixel tile dim={} label tile dim={} labels={}'.format(
                     pixel_tile.shape, label_tile.shape, len(labels))
@@ -345,7 +434,42 @@ class Dataset(object):
                                 size_zxy,
                                 channels,
                                 pixel_padding=(0, 0, 0),
-                                augment_params=None):
+                                augment_params=None,
+                                out=None,
+                                level=0):
+        '''
+        Returns a 4d pixel tile with selected channels in 1st dimension.
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        pos_zxy : (z, x, y)
+            Upper left position of pixels in source image_nr.
+        size_zxy : (nr_zslices, nr_x, nr_y)
+            Tile size.
+        channels : array_like
+            List of pixel channels to be fetched.
+        pixel_padding : (pad_z, pad_x, pad_y)
+            Amount of padding to increase tile size in zxy.
+        augment_params : dict
+            Image augmentation settings (see training_tile).
+        out : numpy.ndarray, optional
+            Buffer of shape (nr_channels, z, x, y) including padding
+            the tile is written to. Allows assembling batches without
+            intermediate copies.
+        level : int, optional
+            Resolution level of the tile. The tile has the same size
+            at all levels and is centered at the center of the level 0
+            tile given by `pos_zxy` and `size_zxy`, thus it covers a
+            ``2**level`` times larger region in x and y. Regions
+            exceeding the image are padded by mirroring.
+
+        Returns
+        -------
+        numpy.ndarray
+            Pixel tile with dimension order (channel, z, x, y).
+        '''
         augment_params = augment_params or {}
         np.testing.assert_equal(len(pos_zxy), 3,
                                 'Expected 3 dimensions (Z, X, Y)')
@@ -355,19 +479,72 @@ class Dataset(object):
         image_shape_zxy = self.image_dimensions(image_nr)
         ut.assert_valid_image_subset(image_shape_zxy[1:], pos_zxy, size_zxy)
 
+        get_tile_kwargs = {'image_nr': image_nr}
+        if level > 0:
+            pos_zxy = level_pos_zxy(pos_zxy, size_zxy, level)
+            image_shape_zxy = self.image_dimensions(image_nr, level=level)
+            get_tile_kwargs['level'] = level
+
         pixel_padding = np.array(pixel_padding)
         size_padded = size_zxy + 2 * pixel_padding
         pos_padded = pos_zxy - pixel_padding
 
-        tile = [_augment_tile(image_shape_zxy,
-                              np.hstack([[c], pos_padded]),
-                              np.hstack([[1], size_padded]),
-                              self.pixel_connector.get_tile,
-                              augment_params=augment_params,
-                              image_nr=image_nr)
-                for c in channels]
+        if out is None:
+            out = np.empty(np.hstack([len(channels), size_padded]),
+                           dtype=self.pixel_dtype())
+
+        for i, c in enumerate(channels):
+            _augment_tile(image_shape_zxy,
+                          np.hstack([[c], pos_padded]),
+                          np.hstack([[1], size_padded]),
+                          self.pixel_connector.get_tile,
+                          augment_params=augment_params,
+                          out=out[i:i + 1],
+                          **get_tile_kwargs)
+
+        return out
+
+    def multiscale_pixel_tiles(self,
+                               image_nr,
+                               pos_zxy,
+                               size_zxy,
+                               channels,
+                               levels,
+                               pixel_padding=(0, 0, 0),
+                               augment_params=None):
+        '''
+        Returns pixel tiles of several resolution levels for the same
+        location (see multichannel_pixel_tile).
 
-        return np.vstack(tile)
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        pos_zxy : (z, x, y)
+            Upper left position of the level 0 tile.
+        size_zxy : (nr_zslices, nr_x, nr_y)
+            Tile size (identical for all levels).
+        channels : array_like
+            List of pixel channels to be fetched.
+        levels : array_like
+            Resolution levels, e.g. ``(0, 1, 2)``.
+        pixel_padding : (pad_z, pad_x, pad_y)
+            Amount of padding to increase tile size in zxy.
+        augment_params : dict
+            Image augmentation settings (see training_tile).
+
+        Returns
+        -------
+        list of numpy.ndarray
+            One pixel tile with dimension order (channel, z, x, y) per
+            level.
+        '''
+        return [self.multichannel_pixel_tile(image_nr, pos_zxy, size_zxy,
+                                             channels,
+                                             pixel_padding=pixel_padding,
+                                             augment_params=augment_params,
+                                             level=level)
+                for level in levels]
 
     def _get_weights_tile(self, image_nr=None, pos=None, size=None,
                           label_value=None):
@@ -385,6 +562,24 @@ class Dataset(object):
 
         return weight_mat
 
+    def _get_weights_tiles(self, image_nr=None, pos=None, size=None,
+                           label_values=None):
+        '''
+        Returns a 4d weight matrix tile for several labels with
+        dimensions (label, z, x, y). The first dimension of pos and size
+        selects a range of label_values.
+        '''
+        label_values = label_values[pos[0]:pos[0] + size[0]]
+        assert set(label_values) <= set(self.label_values())
+
+        boolmat = self.pixel_connector.label_tiles(image_nr, pos[1:],
+                                                   size[1:], label_values)
+
+        weights = np.array([self.label_weights[l] for l in label_values],
+                           dtype=float)
+
+        return boolmat * weights[:, np.newaxis, np.newaxis, np.newaxis]
+
     def equalize_label_weights(self):
         '''
         equalizes labels according to their amount.
@@ -427,9 +622,11 @@ class Dataset(object):
 
         label_counts = collections.defaultdict(lambda: np.zeros(self.n_images,
                                                                 dtype='int64'))
-        for i in range(self.n_images):
-            img_label_counts = \
-                self.pixel_connector.label_count_for_image(i) or {}
+        all_label_counts = self.pixel_connector.label_count_for_all_images(
+                                workers=self.workers)
+
+        for i, img_label_counts in enumerate(all_label_counts):
+            img_label_counts = img_label_counts or {}
 
             for label_value in img_label_counts.keys():
                 label_counts[label_value][i] = img_label_counts[label_value]
@@ -522,6 +719,35 @@ class Dataset(object):
         return np.random.choice(self.label_values(), p=total_counts_norm)
 
 
+def _has_label_coordinates(connector):
+    '''
+    Check if a connector provides label coordinates (see
+    yapic_io.coordinate_connector.CoordinateConnector).
+    '''
+    if not hasattr(connector, 'label_index_to_coordinate'):
+        return False
+    return getattr(connector, 'has_label_coordinates', lambda: True)()
+
+
+def level_pos_zxy(pos_zxy, size_zxy, level):
+    '''
+    Upper left position of a tile at resolution level `level` that is
+    centered at the center of a level 0 tile. Only x and y are scaled.
+
+    Examples
+    --------
+    >>> from yapic_io.dataset import level_pos_zxy
+    >>> level_pos_zxy((2, 20, 8), (1, 4, 4), 1)
+    array([2, 9, 3])
+    '''
+    pos_zxy = np.array(pos_zxy)
+    size_zxy = np.array(size_zxy)
+    scale = np.array([1, 2**level, 2**level])
+
+    center = pos_zxy + size_zxy / 2.
+    return np.floor(center / scale - size_zxy / 2.).astype(int)
+
+
 def inner_tile_size(image_shape, pos, tile_shape):
     '''
     If a requested tile is out of bounds, this function calculates a transient
@@ -570,12 +796,15 @@ def _augment_tile(img_shape,
                   tile_shape,
                   get_tile_func,
                   augment_params=None,
+                  out=None,
                   **kwargs):
     '''
     fetch tile and augment it
     if rotation and shear is activated, a 3 times larger tile
     is fetched and the final tile is cut out from that after
     rotation/shear.
+    if out is given, the tile is written to out. If no padding and no
+    rotation/shear is needed, get_tile_func reads directly into out.
     '''
     augment_params = augment_params or {}
     rotation_angle = augment_params.get('rotation_angle', 0)
@@ -585,6 +814,9 @@ def _augment_tile(img_shape,
     orig_tile_shape = np.array(tile_shape)
     tile_shape = np.array(tile_shape)
 
+    # if the requested tile is only of size 1 in x and y,
+    # augmentation can be omitted, since rotation and flipping always
+    # occurs around the center axis.
     augment_fast = (tile_shape[-2:] > 1).any()
     augment_slow = augment_fast and (rotation_angle > 0 or shear_angle > 0)
 
@@ -595,27 +827,48 @@ def _augment_tile(img_shape,
     res = inner_tile_size(img_shape, pos, tile_shape)
     pos_transient, size_transient, pos_inside_transient, pad_size = res
 
-    tile = get_tile_func(pos=pos_transient, size=size_transient, **kwargs)
+    rot90 = augment_params.get('rot90', 0)
+    flipud = augment_params.get('flipud', False)
+    fliplr = augment_params.get('fliplr', False)
+
+    if out is not None and not augment_slow and not np.any(pad_size):
+        # read directly into the (inversely flipped) output buffer
+        out_view = out
+        if augment_fast:
+            out_view = trafo.flip_image_2d_stack(out, fliplr=fliplr,
+                                                 flipud=flipud, rot90=rot90,
+                                                 inverse=True)
+        get_tile_func(pos=pos_transient, size=size_transient, out=out_view,
+                      **kwargs)
+        return out
+
+    if out is not None:
+        # transient tile has the dtype of the output buffer
+        tile = np.empty(size_transient, dtype=out.dtype)
+        get_tile_func(pos=pos_transient, size=size_transient, out=tile,
+                      **kwargs)
+    else:
+        tile = get_tile_func(pos=pos_transient, size=size_transient,
+                             **kwargs)
 
     tile = np.pad(tile, pad_size, mode='symmetric')
     mesh = ut.get_tile_meshgrid(tile.shape, pos_inside_transient, tile_shape)
     tile = tile[mesh]
 
     if augment_fast:
-        # if the requested tile is only of size 1 in x and y,
-        # augmentation can be omitted, since rotation and flipping always
-        # occurs around the center axis.
-        rot90 = augment_params.get('rot90', 0)
-        flipud = augment_params.get('flipud', False)
-        fliplr = augment_params.get('fliplr', False)
-
         tile = trafo.flip_image_2d_stack(tile, fliplr=fliplr,
                                          flipud=flipud, rot90=rot90)
 
     if augment_slow:
+        # warping uses nearest neighbour interpolation, thus the result can
+        # be cast back to the original dtype without loss
         tile = trafo.warp_image_2d_stack(tile, rotation_angle, shear_angle)
         mesh = ut.get_tile_meshgrid(tile.shape, orig_tile_shape,
                                     orig_tile_shape)
         tile = tile[mesh]
 
+    if out is not None:
+        out[...] = tile
+        return out
+
     return tile
@@ -0,0 +1,100 @@
+import logging
+import os
+import yapic_io.hdf5_file as hdf5_file
+from yapic_io.tiff_connector import TiffConnector
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class HDF5Connector(TiffConnector):
+    '''
+    Implementation of Connector for images and labels stored as chunked
+    datasets in hdf5 files.
+
+    Each image and each label image is a hdf5 file holding a dataset
+    named ``data`` (or a single dataset with arbitrary name) with
+    dimension order (C, Z, Y, X), (Z, Y, X) or (Y, X). Tiles are read in
+    chunk-aligned windows, read chunks are kept in the tile cache.
+    Probability maps are written as chunked hdf5 files with
+    configurable compression.
+
+    Parameters
+    ----------
+    img_filepath : str or list of str
+        Path to image files (use wildcards for filtering)
+        or a list of filepaths.
+    label_filepath : str or list of str
+        Path to label files (use wildcards for filtering)
+        or a list of filepaths.
+    savepath : str, optional
+        Directory to save pixel classifiaction results as probability
+        map files.
+    chunks : tuple, optional
+        Chunk shape (C, Z, Y, X) of probability map datasets. By default
+        chunks are single 256x256 planes.
+    compression : str, optional
+        hdf5 compression filter of probability map datasets (e.g. 'gzip'
+        or 'lzf'), None for no compression.
+    compression_opts : optional
+        Options of the compression filter (e.g. gzip level).
+    **kwargs
+        Further options of TiffConnector.
+
+    Examples
+    --------
+    >>> from yapic_io.hdf5_connector import HDF5Connector
+    >>> pixel_image_dir = 'yapic_io/test_data/hdf5connector/im/*.h5'
+    >>> label_image_dir = 'yapic_io/test_data/hdf5connector/labels/*.h5'
+    >>> c = HDF5Connector(pixel_image_dir, label_image_dir)
+    >>> c.image_count()
+    3
+    >>> c.labelvalue_mapping
+    [{91: 1, 109: 2, 150: 3}]
+
+    See Also
+    --------
+    yapic_io.tiff_connector.TiffConnector
+    '''
+    filemask = '*.h5'
+    probmap_extension = '.h5'
+
+    def __init__(self, img_filepath, label_filepath, savepath=None,
+                 chunks=None, compression='gzip', compression_opts=None,
+                 **kwargs):
+        self.chunks = chunks
+        self.compression = compression
+        self.compression_opts = compression_opts
+        super().__init__(img_filepath, label_filepath, savepath=savepath,
+                         **kwargs)
+
+    def __repr__(self):
+        return super().__repr__().replace(
+            'TiffConnector', 'HDF5Connector', 1)
+
+    @classmethod
+    def _open_tcz(cls, path, tile_cache=None, writable=False):
+        if not hdf5_file.is_hdf5(path):
+            # e.g. generated resolution levels
+            return super()._open_tcz(path, tile_cache=tile_cache)
+        return hdf5_file.open_tcz(path, cache=tile_cache, writable=writable)
+
+    @classmethod
+    def _open_level_tcz(cls, path, level, tile_cache=None):
+        # hdf5 files hold no pyramid levels
+        return None
+
+    @classmethod
+    def _read_header(cls, path):
+        return hdf5_file.read_header(path)
+
+    @classmethod
+    def _close_tcz(cls, slices):
+        # hdf5 files stay open as long as their planes are in the pool
+        if isinstance(slices.flat[0], hdf5_file.HDF5Plane):
+            hdf5_file.close_tcz(slices)
+
+    def _create_probability_map_file(self, path, image_nr, n_channels):
+        _, Z, X, Y = self.image_dimensions(image_nr)
+        hdf5_file.create(path, (n_channels, Z, Y, X), self.probmap_dtype,
+                         chunks=self.chunks, compression=self.compression,
+                         compression_opts=self.compression_opts)
@@ -0,0 +1,200 @@
+import logging
+import os
+import h5py
+import numpy as np
+import yapic_io.utils as ut
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+# name of the dataset holding the image in hdf5 files
+DATASET = 'data'
+
+HDF5_EXTENSIONS = ('.h5', '.hdf5', '.hdf')
+
+
+def is_hdf5(path):
+    '''
+    Check if a path is a hdf5 file.
+    '''
+    return str(path).lower().endswith(HDF5_EXTENSIONS) and \
+        h5py.is_hdf5(str(path))
+
+
+def image_dataset(f):
+    '''
+    Get the image dataset of an opened hdf5 file: the dataset named
+    ``data`` or the only dataset in the file.
+    '''
+    if DATASET in f:
+        return f[DATASET]
+
+    datasets = []
+    f.visititems(lambda name, obj: datasets.append(obj)
+                 if isinstance(obj, h5py.Dataset) else None)
+    if len(datasets) != 1:
+        raise ValueError(
+            'Expected a dataset named "{}" or a single dataset in {}'.format(
+                DATASET, f.filename))
+    return datasets[0]
+
+
+def create(path, shape, dtype, chunks=None, compression='gzip',
+           compression_opts=None):
+    '''
+    Create a hdf5 file holding an empty chunked dataset named ``data``.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path of the hdf5 file.
+    shape : tuple
+        Shape (C, Z, Y, X) of the dataset.
+    dtype : numpy.dtype
+        Data type of the dataset.
+    chunks : tuple, optional
+        Chunk shape. By default, chunks are single 256x256 planes.
+    compression : str, optional
+        hdf5 compression filter (e.g. 'gzip' or 'lzf'), None for no
+        compression.
+    compression_opts : optional
+        Options of the compression filter (e.g. gzip level).
+    '''
+    if chunks is None:
+        chunks = (1,) * (len(shape) - 2) + (256, 256)
+    chunks = tuple(int(min(c, max(s, 1))) for c, s in zip(chunks, shape))
+
+    with h5py.File(str(path), 'w') as f:
+        f.create_dataset(DATASET, shape=shape, dtype=dtype, chunks=chunks,
+                         compression=compression,
+                         compression_opts=compression_opts, fillvalue=0)
+
+
+def read_header(path):
+    '''
+    Read shape (padded to 4 dimensions (C, Z, Y, X)) and data type of
+    the image dataset of a hdf5 file.
+    '''
+    with h5py.File(str(path), 'r') as f:
+        dataset = image_dataset(f)
+        shape, dtype = dataset.shape, dataset.dtype
+    return (1,) * (4 - len(shape)) + shape, dtype
+
+
+def open_tcz(path, cache=None, writable=False):
+    '''
+    Open a hdf5 file as (T, C, Z) array of lazy 2d (Y, X) planes,
+    analogous to bigtiff.Tiff.memmap_tcz for tiff files.
+
+    The image dataset has dimension order (C, Z, Y, X), (Z, Y, X) or
+    (Y, X).
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to hdf5 file.
+    cache : yapic_io.cache.LRUCache, optional
+        Cache for chunks read from the dataset. Only used for files
+        opened read-only.
+    writable : bool, optional
+        Open the file for writing.
+
+    Returns
+    -------
+    numpy.ndarray
+        Object array of shape (T, C, Z) holding HDF5Plane objects. The
+        file stays open until it is closed with close_tcz.
+    '''
+    f = h5py.File(str(path), 'r+' if writable else 'r')
+    dataset = image_dataset(f)
+    if not 2 <= dataset.ndim <= 4:
+        raise ValueError('Expected 2 to 4 dimensions in {}, got {}'.format(
+            path, dataset.ndim))
+
+    lead = (1,) * (4 - dataset.ndim) + dataset.shape[:-2]
+    C, Z = lead
+    slices = np.empty((1, C, Z), dtype=object)
+    for c in range(C):
+        for z in range(Z):
+            index = (c, z)[4 - dataset.ndim:]
+            slices[0, c, z] = HDF5Plane(dataset, index,
+                                        cache=None if writable else cache)
+    return slices
+
+
+def close_tcz(slices):
+    '''
+    Close the hdf5 file of a (T, C, Z) array of planes opened with
+    open_tcz.
+    '''
+    slices.flat[0].dataset.file.close()
+
+
+class HDF5Plane(object):
+    '''
+    Lazy 2d plane (Y, X) of a hdf5 dataset.
+
+    Behaves like a numpy array for reading and writing ranges,
+    e.g. ``plane[Y:YY, X:XX]``. Reads are aligned to the chunks of the
+    dataset: whole chunks are read and kept in the cache (if given), so
+    overlapping tiles do not read and decompress chunks repeatedly.
+    '''
+    ndim = 2
+
+    def __init__(self, dataset, index, cache=None):
+        self.dataset = dataset
+        self.index = index
+        self.cache = cache
+        self.shape = dataset.shape[-2:]
+        self.dtype = dataset.dtype
+        self.chunks = dataset.chunks[-2:] if dataset.chunks else None
+
+    def __repr__(self):
+        return 'HDF5Plane {} {} of {}'.format(self.shape, self.index,
+                                              self.dataset.file.filename)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    @property
+    def T(self):
+        return np.asarray(self).T
+
+    def __array__(self, dtype=None):
+        plane = self[...]
+        return plane if dtype is None else plane.astype(dtype)
+
+    def _read_chunk(self, chunk_idx):
+        region = tuple(slice(i * c, min((i + 1) * c, s))
+                       for i, c, s in zip(chunk_idx, self.chunks,
+                                          self.shape))
+        return self.dataset[self.index + region]
+
+    def chunk(self, chunk_idx):
+        '''
+        Get a chunk of the plane (cached if a cache was given).
+        '''
+        if self.cache is None:
+            return self._read_chunk(chunk_idx)
+
+        key = (self.dataset.file.filename, self.dataset.name, self.index,
+               chunk_idx)
+        return self.cache.get(key, lambda: self._read_chunk(chunk_idx),
+                              lambda chunk: chunk.nbytes)
+
+    def __getitem__(self, key):
+        pos, size = ut.slices_to_region(key, self.shape)
+        if self.chunks is None:
+            region = ut.region_to_slices(pos, size)
+            return self.dataset[self.index + region]
+
+        out = np.empty(size, dtype=self.dtype)
+        for chunk_idx, in_chunk, in_out in ut.intersecting_chunks(
+                pos, size, self.chunks):
+            out[in_out] = self.chunk(chunk_idx)[in_chunk]
+        return out
+
+    def __setitem__(self, key, values):
+        pos, size = ut.slices_to_region(key, self.shape)
+        region = ut.region_to_slices(pos, size)
+        self.dataset[self.index + region] = np.broadcast_to(values, size)
@@ -1,7 +1,7 @@
-from itertools import zip_longest
+import collections
+import multiprocessing
 import os
 import logging
-from functools import lru_cache
 import numpy as np
 import pyilastik
 from yapic_io.tiff_connector import TiffConnector
@@ -9,6 +9,133 @@ from yapic_io.tiff_connector import TiffConnector
 logger = logging.getLogger(os.path.basename(__file__))
 
 
+def _project_label_blocks(ilp, item):
+    '''
+    Get the sparse label blocks of one image of an ilastik project.
+
+    pyilastik has no public API for label blocks, thus its private
+    methods ``_get_block_slices`` and ``_get_blocks`` are used. If they
+    are not available, the labels are read with the public ``ilp.tile``
+    instead, as one dense block covering all labels of the image.
+
+    Returns
+    -------
+    slices : numpy.ndarray
+        `[start, stop]` of each block per dimension with shape
+        (n_blocks, n_dims, 2), in the original dimension order of the
+        project (see ``ilp.original_dimension_order()``).
+    blocks : list
+        Hdf5 datasets or arrays holding the label values of the blocks,
+        in the same dimension order.
+    '''
+    try:
+        return ilp._get_block_slices(item), list(ilp._get_blocks(item))
+    except AttributeError:
+        logger.debug('Label blocks not available, reading dense labels')
+
+    # ilp.tile works in dimension order zyxc or yxc
+    order = ilp.original_dimension_order()
+    shape = np.asarray(ilp.shape_of_labelmatrix(item))
+    if not shape.all():
+        return np.zeros((0, len(order), 2), dtype=int), []
+
+    tile_slice = np.stack([np.zeros_like(shape), shape], axis=1)
+    data = ilp.tile(item, tile_slice)
+    if not data.any():
+        return np.zeros((0, len(order), 2), dtype=int), []
+
+    axes = ['zyxc'.index(d) if len(order) == 4 else 'yxc'.index(d)
+            for d in order]
+    data = np.transpose(data, axes).astype(
+        np.min_scalar_type(int(data.max())))
+    return tile_slice[axes][np.newaxis], [data]
+
+
+def _label_value_counts(ilp, item):
+    '''
+    Count label values of one image (with index `item` in the project)
+    of an ilastik project per label channel. Unlabeled pixels (value 0)
+    are not counted.
+
+    Labels are counted directly in the sparse label blocks stored in the
+    project, thus memory and time scale with the size of the annotated
+    regions rather than with the image size.
+    '''
+    counts = collections.Counter()
+    n_blocks = 0
+    for block in _project_label_blocks(ilp, item)[1]:
+        values, n = np.unique(block[()], return_counts=True)
+        counts.update(dict(zip(values.tolist(), n.tolist())))
+        n_blocks += 1
+
+    if n_blocks == 0:
+        # no labels in image
+        return []
+
+    # ilastik projects have one label channel
+    return [{int(l): int(count) for l, count in counts.items() if l > 0}]
+
+
+def _label_block_index(ilp, item):
+    '''
+    Index of the sparse label blocks of one image of an ilastik project.
+
+    Returns
+    -------
+    boxes : numpy.ndarray
+        Bounding boxes of the blocks with shape (n_blocks, 3, 2), holding
+        `[start, stop]` per dimension in order (z, x, y).
+    blocks : list
+        The hdf5 datasets (or arrays) of the blocks.
+    '''
+    slices, blocks = _project_label_blocks(ilp, item)
+    if len(blocks) == 0:
+        return np.zeros((0, 3, 2), dtype=int), []
+
+    # dimension order of blocks, e.g. zyxc, zcyx, yxc or cyx
+    order = ilp.original_dimension_order()
+    if 'z' not in order:
+        order = 'z' + order
+        slices = np.concatenate(
+            [np.tile([0, 1], (len(slices), 1, 1)), slices], axis=1)
+
+    boxes = slices[:, [order.index(d) for d in 'zxy'], :]
+    return boxes, blocks
+
+
+def _block_to_zxy(data, order):
+    '''
+    Transpose label block data from dimension order `order` (e.g. zyxc,
+    zcyx, yxc or cyx) to (z, x, y).
+    '''
+    data = np.squeeze(data, axis=order.index('c'))
+    order = order.replace('c', '')
+    if 'z' not in order:
+        data = data[np.newaxis, ...]
+        order = 'z' + order
+    return np.transpose(data, [order.index(d) for d in 'zxy'])
+
+
+# project file opened once by each worker process
+_worker_ilp = None
+
+
+def _open_worker_project(ilp_path):
+    '''
+    Open the ilastik project in a worker process (pool initializer).
+    '''
+    global _worker_ilp
+    _worker_ilp = pyilastik.read_project(ilp_path, skip_image=True)
+
+
+def _scan_label_item(item):
+    '''
+    Count label values of one image of the project opened by
+    _open_worker_project (used by worker processes).
+    '''
+    return _label_value_counts(_worker_ilp, item)
+
+
 class IlastikConnector(TiffConnector):
     '''
     Implementation of Connector for tiff images up to 4 dimensions and
@@ -29,6 +156,10 @@ class IlastikConnector(TiffConnector):
     savepath : str, optional
         Directory to save pixel classifiaction results as probability
         images.
+    label_index_path : str, optional
+        Path to a json file for persisting label statistics (see
+        yapic_io.label_stats.LabelStatsIndex). Statistics are stored per
+        image and are valid as long as the project file is unchanged.
 
     Notes
     -----
@@ -42,6 +173,11 @@ class IlastikConnector(TiffConnector):
 
     Files from Ilastik v1.2 and v1.3 are supported (storage version 0.1).
 
+    Labels are stored sparsely as blocks in the project file. Label
+    coordinates are looked up in these blocks (see
+    label_index_to_coordinate), thus training tiles are drawn around
+    actual labels instead of by random polling.
+
     Examples
     --------
     >>> from yapic_io.ilastik_connector import IlastikConnector
@@ -65,6 +201,11 @@ class IlastikConnector(TiffConnector):
         label_path = label_filepath
         self.ilp = pyilastik.read_project(label_filepath, skip_image=True)
         lbl_filenames = self.ilp.image_path_list()
+        # index of each image in the project file
+        self._ilp_items = {fname: i for i, fname in enumerate(lbl_filenames)}
+        # label block index and label counts per block by project item
+        self._block_index = {}
+        self._block_counts = {}
 
         return label_path, lbl_filenames
 
@@ -84,52 +225,17 @@ class IlastikConnector(TiffConnector):
         '''
         Removes images without labels.
 
+        The returned connector is a view sharing the project file,
+        label statistics and caches with this connector.
+
         Returns
         -------
         IlastikConnector
             Connector object containing only images with labels.
         '''
-        pairs = [self.filenames[i]for i in range(
-            self.image_count()) if self.label_count_for_image(i)]
-
-        tiff_sel = [self.img_path / pair.img for pair in pairs]
-
-        return IlastikConnector(tiff_sel, self.label_path,
-                                savepath=self.savepath)
-
-    def split(self, fraction, random_seed=42):
-        '''
-        Split the images pseudo-randomly into two Connector subsets.
-
-        The first of size `(1-fraction)*N_images`, the other of size
-        `fraction*N_images`
-
-        Parameters
-        ----------
-        fraction : float
-        random_seed : float, optional
-
-        Returns
-        -------
-        connector_1, connector_2
-        '''
-
-        img_fnames1, img_fnames2, mask = self._split_img_fnames(
-            fraction, random_seed=random_seed)
-
-        conn1 = IlastikConnector(img_fnames1, self.label_path,
-                                 savepath=self.savepath)
-        conn2 = IlastikConnector(img_fnames2, self.label_path,
-                                 savepath=self.savepath)
-
-        # ensures that both resulting connectors have the same
-        # labelvalue mapping (issue #1)
-        conn1.labelvalue_mapping = self.labelvalue_mapping
-        conn2.labelvalue_mapping = self.labelvalue_mapping
+        return self._subset([i for i in range(self.image_count())
+                             if self.label_count_for_image(i)])
 
-        return conn1, conn2
-
-    @lru_cache(maxsize=20)
     def label_tile(self, image_nr, pos_zxy, size_zxy, label_value):
         '''
         Get 3d zxy boolean matrix where positions of the requested label
@@ -152,108 +258,250 @@ class IlastikConnector(TiffConnector):
             3D subsection of labelmatrix as boolean mask in dimension order
             (z, x, y)
         '''
+        return self.label_tiles(image_nr, pos_zxy, size_zxy, [label_value])[0]
 
-        slices = np.array([[pos_zxy[0], pos_zxy[0] + size_zxy[0]],  # z
-                           [pos_zxy[2], pos_zxy[2] + size_zxy[2]],  # y
-                           [pos_zxy[1], pos_zxy[1] + size_zxy[1]],  # x
-                           [0, 1]])  # c
+    def label_tiles(self, image_nr, pos_zxy, size_zxy, label_values):
+        '''
+        Get boolean masks of several labels. The label data is read
+        only once, regardless of the number of requested labels.
 
-        if self.ilp.n_dims(image_nr) == 0:  # no labels in image
-            return np.zeros(size_zxy) > 0
+        dimension order: (label, z, x, y)
+        '''
+        if self.label_cache is not None:
+            return self._cached_label_tiles(image_nr, pos_zxy, size_zxy,
+                                            label_values)
 
-        elif self.ilp.n_dims(image_nr) == 4:  # z-stacks
-            lbl = self.ilp.tile(image_nr, slices)
+        tiles = np.zeros((len(label_values),) + tuple(size_zxy), dtype=bool)
 
-        elif self.ilp.n_dims(image_nr) == 3:  # 2d images
-            lbl = self.ilp.tile(image_nr, slices[1:, :])
-            lbl = np.expand_dims(lbl, axis=0)  # add z axis
+        lbl = self._read_label_tile(image_nr, pos_zxy, size_zxy)
+        if lbl is None:  # no labels in tile
+            return tiles
 
-        # zyxc to czxy
-        lbl = np.transpose(lbl, (3, 0, 2, 1)).astype(int)
+        for tile_out, label_value in zip(tiles, label_values):
+            C, original_label_value = self._mapped_label_value_to_original(
+                                             label_value)
+            np.equal(lbl, original_label_value, out=tile_out)
 
-        C, original_label_value = self._mapped_label_value_to_original(
-                                         label_value)
-        lbl = (lbl == original_label_value)
+        return tiles
 
-        return lbl[0, :, :, :]
+    def _label_channels(self, image_nr):
+        '''
+        Read the full label image as list of (Z, X, Y) arrays, one per
+        label channel.
+        '''
+        size_zxy = self.image_dimensions(image_nr)[1:]
+        lbl = self._read_label_tile(image_nr, (0, 0, 0), size_zxy)
+        if lbl is None:
+            lbl = np.zeros(size_zxy, dtype=np.uint8)
+        return [lbl]
 
-    def check_label_matrix_dimensions(self):
+    def _ilp_item(self, image_nr):
         '''
-        Notes
-        -----
-        Overloads method from tiff connector.
-        Method does nothing since it is expected that labelmatrix dimensions
-        are correct for Ilastik Projects.
+        Index of an image in the project file.
         '''
-        return True
+        return self._ilp_items[str(self.filenames[image_nr].lbl)]
 
-    @lru_cache(maxsize=1)
-    def original_label_values_for_all_images(self):
+    def _label_blocks(self, image_nr):
         '''
-        Get all unique label values per image.
+        Get the label block index of an image (see _label_block_index).
+        The index is built once per image and shared with subsets of
+        this connector.
+        '''
+        item = self._ilp_item(image_nr)
+        index = self._block_index.get(item)
+        if index is None:
+            index = _label_block_index(self.ilp, item)
+            self._block_index[item] = index
+        return index
+
+    def _label_block(self, image_nr, block_nr):
+        '''
+        Get the data of a label block in dimension order (z, x, y).
+        Blocks are kept in the tile cache.
+        '''
+        _, blocks = self._label_blocks(image_nr)
+
+        def load():
+            return _block_to_zxy(blocks[block_nr][()],
+                                 self.ilp.original_dimension_order())
+
+        key = ('ilastik_block', self.label_path, self._ilp_item(image_nr),
+               block_nr)
+        return self.tile_cache.get(key, load, lambda data: data.nbytes)
+
+    def _read_label_tile(self, image_nr, pos_zxy, size_zxy):
+        '''
+        Get 3d zxy matrix of original label values. Only label blocks
+        intersecting the tile are read.
 
         Returns
         -------
-        list
-            List of sets. Each set corresponds to 1 label channel.
-            each set contains the label values of that channel.
-            E.g. `[{91, 109, 150}, {90, 100}]` for two label channels
+        numpy.ndarray or None
+            Label values in the data type of the label blocks (usually
+            uint8), None if no label block intersects the tile.
         '''
-        labels_per_channel = []
+        boxes, blocks = self._label_blocks(image_nr)
 
-        for image_nr in range(self.image_count()):
-            label_filename = str(self.filenames[image_nr].lbl)
+        lower = np.asarray(pos_zxy)
+        upper = lower + size_zxy
+        hits = np.flatnonzero(np.all((boxes[:, :, 0] < upper) &
+                                     (boxes[:, :, 1] > lower), axis=1))
+        if len(hits) == 0:
+            return None
 
-            if label_filename is None:
-                msg = 'No label matrix file found for image file #{}.'
-                logger.warning(msg.format(image_nr))
-                return None
+        dtype = np.result_type(*[blocks[block_nr].dtype
+                                 for block_nr in hits])
+        lbl = np.zeros(size_zxy, dtype=dtype)
+        for block_nr in hits:
+            start = np.maximum(boxes[block_nr, :, 0], lower)
+            stop = np.minimum(boxes[block_nr, :, 1], upper)
+            in_block = tuple(slice(a, b) for a, b in
+                             zip(start - boxes[block_nr, :, 0],
+                                 stop - boxes[block_nr, :, 0]))
+            in_tile = tuple(slice(a, b) for a, b in
+                            zip(start - lower, stop - lower))
+            lbl[in_tile] = self._label_block(image_nr, block_nr)[in_block]
+
+        return lbl
 
-            _, (img, lbl, _) = self.ilp[label_filename]
-            lbl = np.transpose(lbl, (3, 0, 2, 1)).astype(int)
+    def check_label_matrix_dimensions(self):
+        '''
+        Notes
+        -----
+        Overloads method from tiff connector.
+        Method does nothing since it is expected that labelmatrix dimensions
+        are correct for Ilastik Projects.
+        '''
+        return True
 
-            C = lbl.shape[0]
-            labels = [np.unique(lbl[c, ...]) for c in range(C)]
-            labels = [set(labels) - {0} for labels in labels]
+    def _check_label_matrix_dimensions(self, image_nr):
+        pass
 
-            labels_per_channel = [l1.union(l2)
-                                  for l1, l2 in zip_longest(labels_per_channel,
-                                                            labels,
-                                                            fillvalue=set())]
+    def has_label_coordinates(self):
+        # labels of ilastik projects are stored sparsely in label blocks
+        return True
 
-        return labels_per_channel
+    def _block_label_counts(self, image_nr):
+        '''
+        Get cumulative counts of original label values over the label
+        blocks of an image.
 
-    @lru_cache(maxsize=1500)
-    def label_count_for_image(self, image_nr):
+        Returns
+        -------
+        dict
+            Maps original label values to tuples `(block_nrs, cumsum)`,
+            the numbers of the blocks holding the label value and the
+            cumulative label counts of these blocks.
         '''
-        Get number of labels per labelvalue for an image.
+        item = self._ilp_item(image_nr)
+        counts = self._block_counts.get(item)
+        if counts is not None:
+            return counts
+
+        _, blocks = self._label_blocks(image_nr)
+        per_value = collections.defaultdict(lambda: ([], []))
+        for block_nr in range(len(blocks)):
+            values, n = np.unique(self._label_block(image_nr, block_nr),
+                                  return_counts=True)
+            for value, count in zip(values.tolist(), n.tolist()):
+                if value > 0:
+                    per_value[value][0].append(block_nr)
+                    per_value[value][1].append(count)
+
+        counts = {value: (np.array(block_nrs), np.cumsum(n))
+                  for value, (block_nrs, n) in per_value.items()}
+        self._block_counts[item] = counts
+        return counts
+
+    def label_index_to_coordinate(self, image_nr, label_value, label_index):
+        '''
+        Get image coordinate for specific label. The coordinate is looked
+        up in the label blocks of the image, only one block is read.
 
         Parameters
         ----------
         image_nr : int
-            index of image
+            Index of image.
+        label_value : int
+            Id of the label (mapped label value).
+        label_index: int
+            Value between 0 and count[label_value] (see
+            label_count_for_image).
 
         Returns
         -------
-        dict
+        numpy.ndarray
+            czxy coordinate of the label, c is the label channel.
+        '''
+        if self.filenames[image_nr].lbl is None:
+            raise ValueError('Image {} has no labels'.format(image_nr))
+
+        c, original_label_value = self._mapped_label_value_to_original(
+                                                    label_value)
+        counts = self._block_label_counts(image_nr).get(original_label_value)
+        if counts is None:
+            raise ValueError('Label {} not found in image {}'.format(
+                label_value, image_nr))
+
+        block_nrs, cumsum = counts
+        i = np.searchsorted(cumsum, label_index, side='right')
+        if i == len(cumsum):
+            raise IndexError('Label index {} out of range for label {} '
+                             'in image {}'.format(label_index, label_value,
+                                                  image_nr))
+        index_in_block = label_index - (cumsum[i - 1] if i > 0 else 0)
+
+        block = self._label_block(image_nr, block_nrs[i])
+        offsets = np.flatnonzero(block == original_label_value)
+        boxes, _ = self._label_blocks(image_nr)
+        zxy = np.unravel_index(offsets[index_in_block], block.shape) + \
+            boxes[block_nrs[i], :, 0]
+        return np.array((c,) + tuple(zxy))
+
+    def _original_label_count(self, image_nr):
         '''
-        label_filename = str(self.filenames[image_nr].lbl)
+        Get counts of original label values per label channel, counted
+        in the sparse label blocks of the project. Counts are taken from
+        the label stats index if the project file is unchanged.
 
+        Returns
+        -------
+        list or None
+            List of dicts, one per label channel, mapping original label
+            values to counts. None if the image has no labels.
+        '''
+        label_filename = self.filenames[image_nr].lbl
         if label_filename is None:
-            msg = 'No label matrix file found for image file #{}.'
-            logger.warning(msg.format(image_nr))
             return None
 
-        _, (img, lbl, _) = self.ilp[label_filename]
-        lbl = np.transpose(lbl, (3, 0, 2, 1)).astype(int)
+        item = str(label_filename)
+        counts = self._known_label_count(self.label_path, item=item)
+        if counts is None:
+            logger.debug('Scanning label values of %s', item)
+            counts = _label_value_counts(self.ilp, self._ilp_items[item])
+            self._store_label_count(self.label_path, counts, item=item)
 
-        C = lbl.shape[0]
-        labels = [np.unique(lbl[c, ...]) for c in range(C)]
+        return counts
 
-        original_label_count = [{l: np.count_nonzero(lbl[c, ...] == l)
-                                 for l in labels[c] if l > 0}
-                                for c in range(C)]
-        label_count = {self.labelvalue_mapping[c][l]: count
-                       for c, orig in enumerate(original_label_count)
-                       for l, count in orig.items()}
-        return label_count
+    def _scan_label_files(self, workers):
+        '''
+        Scan label images of all images that are not known yet with a
+        pool of worker processes.
+        '''
+        items = [str(lbl) for _, lbl in self.filenames if lbl is not None]
+        items = [item for item in items
+                 if self._known_label_count(self.label_path,
+                                            item=item) is None]
+        if len(items) == 0:
+            return
+
+        logger.info('Scanning labels of %s images with %s workers',
+                    len(items), workers)
+        # the project is opened once per worker, tasks only get the
+        # index of the image in the project
+        with multiprocessing.Pool(workers, initializer=_open_worker_project,
+                                  initargs=(str(self.label_path),)) as pool:
+            counts = pool.map(_scan_label_item,
+                              [self._ilp_items[item] for item in items])
+        for item, c in zip(items, counts):
+            self._store_label_count(self.label_path, c, item=item)
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+class LabelStatsIndex(object):
+    '''
+    Persistent sidecar index of label statistics.
+
+    Stores for each label file the counts of all original label values,
+    separately for each label channel. Entries are keyed by the absolute
+    path of the label file and are only valid as long as size and
+    modification time of the file do not change. Modified files are
+    thus rescanned automatically.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the json file holding the index. The file is created on
+        the first call of ``save()`` if it does not exist.
+
+    Examples
+    --------
+    >>> import tempfile, os
+    >>> from yapic_io.label_stats import LabelStatsIndex
+    >>> tmp = tempfile.TemporaryDirectory()
+    >>> index_path = os.path.join(tmp.name, 'label_stats.json')
+    >>> lbl_path = 'yapic_io/test_data/tiffconnector_1/labels/' + \\
+    ...            '6width4height3slices_rgb.tif'
+    >>> index = LabelStatsIndex(index_path)
+    >>> index.get(lbl_path) is None
+    True
+    >>> index.put(lbl_path, [{109: 11, 150: 3}])
+    >>> index.save()
+    >>> LabelStatsIndex(index_path).get(lbl_path)
+    [{109: 11, 150: 3}]
+    '''
+    version = 1
+
+    def __init__(self, path):
+        self.path = Path(path).expanduser()
+        self._entries = {}
+        self._modified = False
+
+        if self.path.exists():
+            self._load()
+
+    def __repr__(self):
+        return 'LabelStatsIndex ({} entries): {}'.format(len(self._entries),
+                                                         self.path)
+
+    def _load(self):
+        try:
+            with self.path.open() as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            msg = 'Could not read label stats index {}, starting a new one.'
+            logger.warning(msg.format(self.path))
+            return
+
+        if data.get('version') != self.version:
+            msg = 'Label stats index {} has unknown version {}, ignored.'
+            logger.warning(msg.format(self.path, data.get('version')))
+            return
+
+        self._entries = data.get('entries', {})
+
+    @staticmethod
+    def _file_key(path, item=None):
+        key = os.path.abspath(str(path))
+        if item is not None:
+            key = '{}::{}'.format(key, item)
+        return key
+
+    @staticmethod
+    def _file_stamp(path):
+        stat = os.stat(str(path))
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def get(self, path, item=None):
+        '''
+        Get label value counts of a label file.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            Path to label file.
+        item : str, optional
+            Identifier of a label image inside the label file, for files
+            holding labels of several images (e.g. ilastik projects).
+
+        Returns
+        -------
+        list or None
+            List of dicts, one per label channel, mapping original label
+            values to label counts. None if the file is not indexed or
+            has changed since indexing.
+        '''
+        entry = self._entries.get(self._file_key(path, item))
+        if entry is None:
+            return None
+
+        if entry['stamp'] != self._file_stamp(path):
+            logger.debug('Label file %s changed, index entry is stale', path)
+            return None
+
+        return [{int(value): int(count) for value, count in channel}
+                for channel in entry['counts']]
+
+    def put(self, path, counts, item=None):
+        '''
+        Store label value counts of a label file.
+
+        Parameters
+        ----------
+        path : str or pathlib.Path
+            Path to label file.
+        counts : list
+            List of dicts, one per label channel, mapping original label
+            values to label counts.
+        item : str, optional
+            Identifier of a label image inside the label file.
+        '''
+        self._entries[self._file_key(path, item)] = {
+            'stamp': self._file_stamp(path),
+            'counts': [sorted([int(value), int(count)]
+                              for value, count in channel.items())
+                       for channel in counts]}
+        self._modified = True
+
+    def save(self):
+        '''
+        Write the index to disk, if it was modified.
+        '''
+        if not self._modified:
+            return
+
+        data = {'version': self.version, 'entries': self._entries}
+
+        # write to a temporary file first to never leave a broken index
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with tmp_path.open('w') as f:
+            json.dump(data, f)
+        os.replace(str(tmp_path), str(self.path))
+
+        self._modified = False
+        logger.info('Label stats index saved to %s', self.path)
@@ -49,6 +49,8 @@ class Minibatch(object):
 
         self.tile_size_zxy = size_zxy
         self.padding_zxy = padding_zxy
+        # additional resolution levels of pixel tiles
+        self.pixel_levels = ()
 
         # imports all available channels by default
         nr_channels = self.dataset.image_dimensions(0)[0]
@@ -86,6 +88,21 @@ class Minibatch(object):
     def set_tile_size(self, size_zxy):
         self.tile_size_zxy = size_zxy
 
+    def set_pixel_levels(self, levels):
+        '''
+        Parameters
+        ----------
+        levels : array_like
+            Additional resolution levels of pixel tiles, e.g. ``(1, 2)``.
+            Tiles of level `k` are downsampled by ``2**k`` in x and y.
+            They have the same size and are centered at the same
+            location as the full resolution tiles, thus provide more
+            context. Returned by ``self.multiscale_pixels()``.
+        '''
+        assert all(level > 0 for level in levels), \
+            'levels must be larger than 0'
+        self.pixel_levels = tuple(levels)
+
     def set_normalize_mode(self, mode_str, minmax=None):
         '''
         Parameters
@@ -117,7 +134,13 @@ class Minibatch(object):
     def _normalize(self, pixels):
         '''
         To be called by the ``self.pixels()`` function
+
+        Pixels of integer type (see native_dtype of Dataset) are
+        converted to ``self.float_data_type`` here.
         '''
+        if pixels.dtype.kind != 'f':
+            pixels = pixels.astype(self.float_data_type)
+
         if self.normalize_mode in ('off', None):
             return pixels
 
@@ -89,20 +89,42 @@ class PredictionBatch(Minibatch):
         super().set_tile_size(size_zxy)
         self._all_tile_positions = self._compute_pos_zxy()
 
-    def pixels(self):
+    def pixels(self, level=0):
+        '''
+        Pixels of the current batch at a resolution level (see
+        ``set_pixel_levels``).
+        '''
         load_img = self.dataset.multichannel_pixel_tile
+        tile_positions = self.current_tile_positions
+
+        # the whole batch is assembled in one preallocated array
+        size_padded = np.array(self.tile_size_zxy) + \
+            2 * np.array(self.padding_zxy)
+        pixels = np.empty(np.hstack([len(tile_positions),
+                                     len(self.channels),
+                                     size_padded]),
+                          dtype=self.dataset.pixel_dtype())
+
+        for tile, (im_nr, pos_zxy) in zip(pixels, tile_positions):
+            load_img(im_nr, pos_zxy,
+                     self.tile_size_zxy,
+                     self.channels,
+                     self.padding_zxy,
+                     out=tile,
+                     level=level)
 
-        pixels = [load_img(im_nr, pos_zxy,
-                           self.tile_size_zxy,
-                           self.channels,
-                           self.padding_zxy)
-                  for im_nr, pos_zxy in self.current_tile_positions]
-        pixels = np.array(pixels)
         pixels = np.moveaxis(pixels, [0, 1, 2, 3, 4],
                              self.pixel_dimension_order)
 
         return self._normalize(pixels).astype(self.float_data_type)
 
+    def multiscale_pixels(self):
+        '''
+        Pixels of all resolution levels: ``self.pixels()`` followed by
+        the pixels of each level set with ``set_pixel_levels``.
+        '''
+        return [self.pixels(level) for level in (0,) + self.pixel_levels]
+
     def __len__(self):
         '''
         Return the number of batches.
@@ -120,6 +142,29 @@ class PredictionBatch(Minibatch):
         self.current_batch_pos = position
         return self
 
+    def __iter__(self):
+        try:
+            for position in range(len(self)):
+                yield self[position]
+        finally:
+            # also reached if the loop is left early
+            self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+    def __del__(self):
+        self.flush()
+
+    def flush(self):
+        '''
+        Write probability map data buffered by the connector.
+        '''
+        self.dataset.pixel_connector.flush()
+
     @property
     def current_tile_positions(self):
         total = len(self._all_tile_positions)
@@ -168,13 +213,21 @@ class PredictionBatch(Minibatch):
         assert_equal(L, len(self.labels))
         assert_equal(ZXY, self.tile_size_zxy)
 
+        # convert the whole batch to the output data type at once
+        probmap_batch = ut.quantize_probabilities(
+            probmap_batch, self.dataset.pixel_connector.probmap_dtype)
+
+        labels = list(self.labels)
         for probmap, (image_nr, pos_zxy) in zip(probmap_batch,
                                                 self.current_tile_positions):
-            for label_ch, label in zip(probmap, self.labels):
-                self.dataset.pixel_connector.put_tile(label_ch,
-                                                      pos_zxy,
-                                                      image_nr,
-                                                      label)
+            self.dataset.pixel_connector.put_tiles(probmap,
+                                                   pos_zxy,
+                                                   image_nr,
+                                                   labels)
+
+        if self.current_batch_pos == len(self) - 1:
+            # all batches are done, write data buffered by the connector
+            self.flush()
 
     def _compute_pos_zxy(self):
         '''
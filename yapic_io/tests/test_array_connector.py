@@ -0,0 +1,121 @@
+from unittest import TestCase, mock
+import os
+import numpy as np
+from numpy.testing import assert_array_equal
+from yapic_io.tiff_connector import TiffConnector
+from yapic_io.array_connector import ArrayConnector
+import yapic_io.transformations as tf
+from yapic_io.dataset import Dataset
+from yapic_io.training_batch import TrainingBatch
+from yapic_io.prediction_batch import PredictionBatch
+
+base_path = os.path.dirname(__file__)
+
+
+def _arrays(connector):
+    '''
+    Load images and labels of a TiffConnector as (C, Z, X, Y) arrays.
+    '''
+    images = []
+    labels = []
+    for image_nr in range(connector.image_count()):
+        shape = connector.image_dimensions(image_nr)
+        images.append(connector.get_tile(image_nr, (0, 0, 0, 0), shape))
+
+        lbl = connector._open_label_file(image_nr)
+        if lbl is None:
+            labels.append(None)
+        else:
+            labels.append(np.array([[np.asarray(s).T for s in c]
+                                    for c in lbl[0]]))
+    return images, labels
+
+
+class TestArrayConnector(TestCase):
+
+    def setUp(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+        self.tiff = TiffConnector(img_path, label_path)
+        self.c = ArrayConnector(*_arrays(self.tiff))
+
+    def test_init(self):
+        self.assertEqual(self.c.image_count(), 3)
+        self.assertEqual(self.c.labelvalue_mapping,
+                         self.tiff.labelvalue_mapping)
+        for image_nr in range(3):
+            assert_array_equal(self.c.image_dimensions(image_nr),
+                               self.tiff.image_dimensions(image_nr))
+            self.assertEqual(self.c.label_count_for_image(image_nr),
+                             self.tiff.label_count_for_image(image_nr))
+
+    def test_get_tile(self):
+        for image_nr, pos, size in [(0, (0, 1, 2, 3), (3, 1, 20, 10)),
+                                    (2, (0, 0, 0, 0), (3, 3, 6, 4))]:
+            assert_array_equal(self.c.get_tile(image_nr, pos, size),
+                               self.tiff.get_tile(image_nr, pos, size))
+
+    def test_get_tile_level(self):
+        level_2 = tf.downsample_2d(tf.downsample_2d(self.c.images[0]))
+        assert_array_equal(self.c.image_dimensions(0, level=2),
+                           level_2.shape)
+        assert_array_equal(
+            self.c.get_tile(0, (0, 1, 2, 1), (3, 1, 3, 2), level=2),
+            level_2[:, 1:2, 2:5, 1:3])
+
+    def test_label_tiles(self):
+        assert_array_equal(
+            self.c.label_tiles(0, (1, 10, 2), (2, 20, 20), [1, 2, 3]),
+            self.tiff.label_tiles(0, (1, 10, 2), (2, 20, 20), [1, 2, 3]))
+        self.assertFalse(self.c.label_tile(1, (0, 0, 0), (1, 2, 2), 1).any())
+
+    def test_put_tile(self):
+        probmaps = [np.zeros((3,) + tuple(self.c.image_dimensions(i)[1:]),
+                             dtype=np.float32) for i in range(3)]
+        c = ArrayConnector(self.c.images, self.c.labels, probmaps)
+
+        pixels = np.random.rand(2, 3, 4).astype(np.float32)
+        c.put_tile(pixels, pos_zxy=(1, 2, 3), image_nr=0, label_value=2)
+
+        assert_array_equal(probmaps[0][1, 1:3, 2:5, 3:7], pixels)
+        self.assertEqual(np.count_nonzero(probmaps[0]), pixels.size)
+
+    def test_split(self):
+        with mock.patch(
+                'yapic_io.array_connector._label_value_counts_for_channel') \
+                as m:
+            c1, c2 = self.c.split(0.5)
+        m.assert_not_called()
+
+        t1, t2 = self.tiff.split(0.5)
+        for c, t in ((c1, t1), (c2, t2)):
+            self.assertEqual(c.image_count(), t.image_count())
+            self.assertEqual(c.labelvalue_mapping, self.c.labelvalue_mapping)
+            for image_nr in range(c.image_count()):
+                assert_array_equal(c.image_dimensions(image_nr),
+                                   t.image_dimensions(image_nr))
+                self.assertEqual(c.label_count_for_image(image_nr),
+                                 t.label_count_for_image(image_nr))
+
+    def test_split_shares_probability_maps(self):
+        c1, c2 = self.c.split(0.5)
+        image_nr, = [i for i, img in enumerate(self.c.images)
+                     if img is c2.images[0]]
+
+        c2.put_tile(np.ones((1, 2, 2)), (0, 1, 1), image_nr=0,
+                    label_value=1)
+        self.assertEqual(self.c.probability_maps[image_nr][0].sum(), 4)
+        self.assertIs(c2.probability_maps[0],
+                      self.c.probability_maps[image_nr])
+
+    def test_training_and_prediction(self):
+        d = Dataset(self.c)
+        t = TrainingBatch(d, (1, 4, 4), padding_zxy=(0, 1, 1))
+        self.assertEqual(next(t).pixels().shape, (3, 3, 1, 6, 6))
+
+        p = PredictionBatch(Dataset(self.c), 2, (1, 4, 4))
+        for mb in p:
+            mb.put_probmap_data(np.full((2, 3, 1, 4, 4), .5)[:len(mb)])
+        assert_array_equal(self.c.probability_maps[2], .5)
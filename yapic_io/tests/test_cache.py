@@ -0,0 +1,113 @@
+from unittest import TestCase
+import numpy as np
+from numpy.testing import assert_array_equal
+from yapic_io.cache import LRUCache, WriteBackBuffer
+
+
+class TestCache(TestCase):
+
+    def test_max_items(self):
+        cache = LRUCache(max_items=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a', lambda: None), 1)
+        cache.put('c', 3)
+
+        self.assertEqual(sorted(cache.keys()), ['a', 'c'])
+        self.assertEqual(cache.evictions, 1)
+
+    def test_max_bytes(self):
+        cache = LRUCache(max_bytes=100)
+
+        def nbytes(x):
+            return x.nbytes
+
+        cache.get('a', lambda: np.zeros(5), nbytes)  # 40 bytes
+        cache.get('b', lambda: np.zeros(5), nbytes)
+        self.assertEqual(cache.nbytes, 80)
+
+        cache.get('c', lambda: np.zeros(5), nbytes)
+        self.assertEqual(sorted(cache.keys()), ['b', 'c'])
+        self.assertEqual(cache.nbytes, 80)
+
+        # an entry exceeding the budget on its own is kept
+        cache.get('d', lambda: np.zeros(20), nbytes)
+        self.assertEqual(list(cache.keys()), ['d'])
+        self.assertEqual(cache.nbytes, 160)
+
+    def test_pop(self):
+        cache = LRUCache()
+        cache.put('a', 1, nbytes=10)
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertIsNone(cache.pop('a'))
+        self.assertEqual(cache.nbytes, 0)
+        self.assertEqual(len(cache), 0)
+
+    def test_write_back_buffer(self):
+        target = np.zeros((3, 2, 4))
+        writes = []
+
+        def write(key, plane, mask):
+            writes.append((key, mask is None))
+            np.copyto(target[key], plane,
+                      where=True if mask is None else mask)
+
+        buf = WriteBackBuffer(write, max_bytes=2 * (8 * 4 + 8))
+        buf.put(0, (2, 4), (slice(0, 2), slice(0, 2)), 1)
+        buf.put(1, (2, 4), (slice(0, 1), slice(0, 4)), 2)
+        self.assertEqual(writes, [])
+        self.assertEqual(len(buf), 2)
+
+        # the least recently written plane is written partially
+        buf.put(2, (2, 4), (slice(1, 2), slice(0, 4)), 3)
+        self.assertEqual(writes, [(0, False)])
+
+        buf.put(1, (2, 4), (slice(1, 2), slice(0, 4)), 4)
+        self.assertEqual(writes[-1], (1, True))
+
+        buf.flush()
+        self.assertEqual(len(buf), 0)
+        self.assertEqual(buf.nbytes, 0)
+
+        val = np.zeros((3, 2, 4))
+        val[0, :, :2] = 1
+        val[1, 0] = 2
+        val[1, 1] = 4
+        val[2, 1] = 3
+        assert_array_equal(target, val)
+
+    def test_write_back_buffer_overlapping_writes(self):
+        writes = []
+        buf = WriteBackBuffer(lambda key, plane, mask: writes.append(
+            (key, mask is None)))
+
+        # overlapping pixels are counted once
+        buf.put(0, (2, 4), (slice(0, 2), slice(0, 3)), 1)
+        buf.put(0, (2, 4), (slice(0, 2), slice(1, 3)), 2)
+        self.assertEqual(writes, [])
+        buf.put(0, (2, 4), (slice(0, 2), slice(2, 4)), 3)
+        self.assertEqual(writes, [(0, True)])
+
+    def test_lru_cache_on_evict(self):
+        evicted = []
+        cache = LRUCache(max_items=2, on_evict=evicted.append)
+        for key in 'abc':
+            cache.get(key, lambda: key.upper())
+        self.assertEqual(evicted, ['A'])
+
+        cache.clear()
+        self.assertEqual(evicted, ['A', 'B', 'C'])
+
+    def test_write_back_buffer_accepts(self):
+        buf = WriteBackBuffer(None, max_bytes=2 * 4 * 5)
+        self.assertTrue(buf.accepts((2, 4), np.float32))
+        self.assertFalse(buf.accepts((2, 5), np.float32))
+        self.assertTrue(WriteBackBuffer(None).accepts((10**5, 10**5)))
+
+    def test_write_back_buffer_band_rows(self):
+        buf = WriteBackBuffer(None, max_bytes=100 * 4 * 5)
+        self.assertEqual(buf.band_rows((100, 4), np.float32), 100)
+        # half of the budget per band
+        self.assertEqual(buf.band_rows((200, 8), np.float32), 25)
+        self.assertEqual(buf.band_rows((2, 400), np.float32), 0)
+        self.assertEqual(WriteBackBuffer(None).band_rows((10**5, 3)), 10**5)
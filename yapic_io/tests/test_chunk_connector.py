@@ -0,0 +1,77 @@
+from unittest import TestCase
+import os
+import tempfile
+import numpy as np
+from numpy.testing import assert_array_equal
+from yapic_io.tiff_connector import TiffConnector
+from yapic_io.chunk_connector import ChunkConnector, convert_tiff_connector
+from yapic_io.chunk_store import ChunkStore
+
+base_path = os.path.dirname(__file__)
+
+
+class TestChunkConnector(TestCase):
+
+    def setUp(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+        self.tiff = TiffConnector(img_path, label_path)
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.savepath = tempfile.TemporaryDirectory()
+        self.c = convert_tiff_connector(self.tiff, self.tmp.name,
+                                        chunks=(1, 1, 16, 16),
+                                        savepath=self.savepath.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        self.savepath.cleanup()
+
+    def test_convert(self):
+        self.assertIsInstance(self.c, ChunkConnector)
+        self.assertEqual(self.c.image_count(), self.tiff.image_count())
+        self.assertEqual(self.c.labelvalue_mapping,
+                         self.tiff.labelvalue_mapping)
+        self.assertEqual([(i.name, l is None) for i, l in self.c.filenames],
+                         [(i.stem + '.chunks', l is None)
+                          for i, l in self.tiff.filenames])
+
+        for image_nr in range(self.c.image_count()):
+            assert_array_equal(self.c.image_dimensions(image_nr),
+                               self.tiff.image_dimensions(image_nr))
+
+    def test_get_tile(self):
+        for image_nr, pos, size in [(0, (0, 1, 2, 3), (3, 1, 20, 10)),
+                                    (2, (0, 0, 0, 0), (3, 3, 6, 4))]:
+            assert_array_equal(self.c.get_tile(image_nr, pos, size),
+                               self.tiff.get_tile(image_nr, pos, size))
+
+    def test_label_tile(self):
+        self.assertEqual(self.c.label_count_for_image(0),
+                         self.tiff.label_count_for_image(0))
+        for label_value in (1, 2, 3):
+            assert_array_equal(
+                self.c.label_tile(0, (1, 10, 2), (2, 20, 20), label_value),
+                self.tiff.label_tile(0, (1, 10, 2), (2, 20, 20),
+                                     label_value))
+
+    def test_put_tile(self):
+        pixels = np.random.rand(2, 20, 10).astype(np.float32)
+        self.c.put_tile(pixels, pos_zxy=(1, 3, 15), image_nr=0,
+                        label_value=2)
+
+        path = os.path.join(self.savepath.name,
+                            '40width26height3slices_rgb_class_2.chunks')
+        s = ChunkStore(path)
+        self.assertEqual(s.shape, (1, 3, 26, 40))
+
+        # only chunks intersecting with the tile are written
+        self.assertEqual(sorted(os.listdir(path)),
+                         ['0.1.0.0', '0.1.0.1', '0.1.1.0', '0.1.1.1',
+                          '0.2.0.0', '0.2.0.1', '0.2.1.0', '0.2.1.1',
+                          'meta.json'])
+
+        tile = s.read((0, 1, 15, 3), (1, 2, 10, 20))[0]
+        assert_array_equal(np.swapaxes(tile, 1, 2), pixels)
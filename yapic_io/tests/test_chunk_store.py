@@ -0,0 +1,80 @@
+from unittest import TestCase
+import os
+import tempfile
+import numpy as np
+from numpy.testing import assert_array_equal
+from yapic_io.cache import LRUCache
+from yapic_io.chunk_store import ChunkStore, is_chunk_store
+
+
+class TestChunkStore(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'store.chunks')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_create(self):
+        self.assertFalse(is_chunk_store(self.path))
+        s = ChunkStore.create(self.path, (2, 3, 300, 10), np.float32)
+
+        self.assertTrue(is_chunk_store(self.path))
+        self.assertEqual(s.chunks, (1, 1, 256, 10))
+        self.assertEqual(os.listdir(self.path), ['meta.json'])
+
+        s = ChunkStore(self.path)
+        self.assertEqual(s.shape, (2, 3, 300, 10))
+        self.assertEqual(s.dtype, np.float32)
+        assert_array_equal(s.read((1, 1, 250, 0), (1, 2, 50, 10)), 0)
+
+    def test_write_read(self):
+        s = ChunkStore.create(self.path, (2, 5, 7), np.uint16,
+                              chunks=(1, 2, 3))
+        data = np.arange(2 * 5 * 7, dtype=np.uint16).reshape((2, 5, 7))
+
+        s.write((0, 0, 0), data)
+        assert_array_equal(s.read((0, 0, 0), (2, 5, 7)), data)
+        assert_array_equal(s.read((1, 1, 2), (1, 3, 4)), data[1:, 1:4, 2:6])
+
+        # partial writes keep the rest of the chunk
+        s.write((0, 1, 1), np.zeros((1, 2, 2)))
+        data[0, 1:3, 1:3] = 0
+        assert_array_equal(ChunkStore(self.path).read((0, 0, 0), (2, 5, 7)),
+                           data)
+
+    def test_write_touches_intersecting_chunks_only(self):
+        s = ChunkStore.create(self.path, (1, 1, 8, 8), np.uint8,
+                              chunks=(1, 1, 4, 4))
+        s.write((0, 0, 3, 3), np.ones((1, 1, 2, 2)))
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['0.0.0.0', '0.0.0.1', '0.0.1.0', '0.0.1.1',
+                          'meta.json'])
+
+        s.write((0, 0, 4, 4), np.ones((1, 1, 4, 4)))
+        self.assertEqual(len(os.listdir(self.path)), 5)
+
+    def test_cache(self):
+        cache = LRUCache(max_items=10)
+        s = ChunkStore.create(self.path, (1, 1, 8, 8), np.uint8,
+                              chunks=(1, 1, 4, 4), cache=cache)
+        s.read((0, 0, 0, 0), (1, 1, 2, 2))
+        s.read((0, 0, 1, 1), (1, 1, 2, 2))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # writes update the cache
+        s.write((0, 0, 0, 0), np.full((1, 1, 1, 1), 3))
+        self.assertEqual(s.read((0, 0, 0, 0), (1, 1, 1, 1)).item(), 3)
+
+    def test_planes(self):
+        s = ChunkStore.create(self.path, (2, 3, 4, 5), np.float32)
+        planes = s.planes()
+        self.assertEqual(planes.shape, (1, 2, 3))
+
+        plane = planes[0, 1, 2]
+        self.assertEqual(plane.shape, (4, 5))
+        plane[1:3, 2:4] = 0.5
+        assert_array_equal(plane[1:3, 2:4], 0.5)
+        self.assertEqual(np.asarray(plane).sum(), 2)
+        self.assertEqual(np.asarray(planes[0, 0, 2]).sum(), 0)
@@ -1,4 +1,4 @@
-from unittest import TestCase
+from unittest import TestCase, mock
 import os
 import numpy as np
 from yapic_io.tiff_connector import TiffConnector
@@ -28,6 +28,62 @@ class TestDataset(TestCase):
 
         np.testing.assert_array_equal(d.n_images, 3)
 
+    def test_has_label_coordinates(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+
+        c = TiffConnector(img_path, label_path)
+        self.assertFalse(ds._has_label_coordinates(c))
+        c = TiffConnector(img_path, label_path, label_coordinates=True)
+        self.assertTrue(ds._has_label_coordinates(c))
+
+    def test_label_coordinate(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path, label_coordinates=True)
+        d = Dataset(c)
+
+        # label counts of label 2: [3, 0, 11]
+        coordinates = [d.label_coordinate(2, i) for i in range(14)]
+        self.assertEqual([image_nr for image_nr, *_ in coordinates],
+                         [0] * 3 + [2] * 11)
+        assert_array_equal(coordinates[4][1:],
+                           c.label_index_to_coordinate(2, 2, 1))
+
+        with self.assertRaises(IndexError):
+            d.label_coordinate(2, 14)
+
+    def test_random_training_tile_by_coordinate(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path, label_coordinates=True)
+        d = Dataset(c)
+
+        for label_value in (1, 2, 3):
+            for _ in range(5):
+                tile = d.random_training_tile((1, 3, 3), [0, 1, 2],
+                                              ensure_labelvalue=label_value)
+                i = list(tile.labels).index(label_value)
+                self.assertTrue(tile.weights[i].any())
+
+    def test_random_training_tile_by_coordinate_ilastik(self):
+        p = os.path.join(base_path, '../test_data/ilastik/purkinjetest')
+        img_path = os.path.join(p, 'images')
+        lbl_path = os.path.join(p, 'ilastik-1.2.2post1mac.ilp')
+        c = IlastikConnector(img_path, lbl_path)
+        self.assertTrue(ds._has_label_coordinates(c))
+        d = Dataset(c)
+
+        for label_value in (1, 2):
+            for _ in range(5):
+                tile = d.random_training_tile((1, 5, 5), [0],
+                                              ensure_labelvalue=label_value)
+                i = list(tile.labels).index(label_value)
+                self.assertTrue(tile.weights[i].any())
+
     def test_get_padding_size_1(self):
 
         shape = c(7, 11)
@@ -368,6 +424,17 @@ class TestDataset(TestCase):
         assert_array_equal(expected_3, t[3])
         self.assertTrue(sorted(list(t.keys())), [1, 2, 3])
 
+    def test_load_label_counts_workers(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        d = Dataset(TiffConnector(img_path, label_path, workers=2),
+                    workers=2)
+
+        assert_array_equal(d.label_counts[1], np.array([4, 0, 0]))
+        assert_array_equal(d.label_counts[2], np.array([3, 0, 11]))
+        assert_array_equal(d.label_counts[3], np.array([3, 0, 3]))
+
     def test_sync_label_counts(self):
         img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
         label_path = os.path.join(
@@ -612,6 +679,137 @@ class TestDataset(TestCase):
                     augment_params={'flipud': True}, **{'img': im})
         assert_array_equal(tile_ud, val_ud)
 
+    def test_augment_tile_out(self):
+        def get_tile_func(pos=None, size=None, img=None, out=None):
+            tile = img[tuple(get_tile_meshgrid(img.shape, pos, size))]
+            if out is None:
+                return tile
+            out[...] = tile
+            return out
+
+        im = np.arange(2 * 15 * 15).reshape((1, 2, 15, 15))
+        pos = np.array((0, 0, 3, 3))
+
+        for size, params in [((1, 2, 9, 9), {}),
+                             ((1, 2, 9, 9), {'fliplr': True, 'rot90': 1}),
+                             ((1, 2, 9, 5), {'flipud': True}),
+                             ((1, 2, 13, 9), {'fliplr': True}),
+                             ((1, 2, 9, 9), {'rotation_angle': 45})]:
+            size = np.array(size)
+            val = ds._augment_tile(im.shape, pos, size, get_tile_func,
+                                   augment_params=params, img=im)
+
+            out = np.zeros(size, dtype=np.float32)
+            tile = ds._augment_tile(im.shape, pos, size, get_tile_func,
+                                    augment_params=params, img=im, out=out)
+            self.assertIs(tile, out)
+            assert_array_equal(out, val)
+
+    def test_training_tile_labels(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+        d.label_weights[3] = 1.2
+
+        pos_zxy = (0, 1, 0)
+        size_zxy = (2, 4, 4)
+        labels = [1, 2, 3]
+        shape_zxy = d.image_dimensions(2)[1:]
+
+        for params in [{}, {'fliplr': True, 'rot90': 1},
+                       {'rotation_angle': 45, 'flipud': True}]:
+            tile = d.training_tile(2, pos_zxy, size_zxy, [0], labels,
+                                   augment_params=params)
+
+            # same result as augmenting each label separately
+            val = [ds._augment_tile(shape_zxy, pos_zxy, size_zxy,
+                                    d._get_weights_tile,
+                                    augment_params=params,
+                                    image_nr=2, label_value=l)
+                   for l in labels]
+            assert_array_equal(tile.weights, val)
+
+    def test_multichannel_pixel_tile_out(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        c = TiffConnector(img_path, 'path/to/nowhere/')
+        d = Dataset(c)
+
+        pos_zxy = (0, 0, 0)
+        size_zxy = (1, 4, 3)
+        channels = [1, 2]
+        params = {'fliplr': True}
+
+        val = d.multichannel_pixel_tile(2, pos_zxy, size_zxy, channels,
+                                        pixel_padding=(0, 2, 3),
+                                        augment_params=params)
+
+        out = np.zeros((3, 2, 1, 8, 9))
+        tile = d.multichannel_pixel_tile(2, pos_zxy, size_zxy, channels,
+                                         pixel_padding=(0, 2, 3),
+                                         augment_params=params,
+                                         out=out[1])
+        assert_array_equal(tile, val)
+        assert_array_equal(out[1], val)
+        self.assertEqual(out[0].sum() + out[2].sum(), 0)
+
+    def test_multichannel_pixel_tile_level(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        c = TiffConnector(img_path, 'path/to/nowhere/')
+        d = Dataset(c)
+        img = 1
+        assert_array_equal(d.image_dimensions(img), (3, 6, 40, 26))
+
+        # same center: (14, 9) at level 0, (7, 4.5) at level 1
+        tile = d.multichannel_pixel_tile(img, (1, 10, 6), (1, 8, 6), [0, 2],
+                                         level=1)
+        val = c.get_tile(img, (0, 1, 3, 1), (3, 1, 8, 6), level=1)[[0, 2]]
+        assert_array_equal(tile, val)
+
+        # tiles exceeding the downsampled image are padded
+        tile = d.multichannel_pixel_tile(img, (0, 0, 0), (1, 8, 6), [1],
+                                         level=2)
+        self.assertEqual(tile.shape, (1, 1, 8, 6))
+        val = c.get_tile(img, (1, 0, 0, 0), (1, 1, 5, 3), level=2)
+        assert_array_equal(tile[:, :, 3:, 3:], val)
+
+        tiles = d.multiscale_pixel_tiles(img, (1, 10, 6), (1, 8, 6), [0, 2],
+                                         (0, 1), pixel_padding=(0, 1, 1))
+        self.assertEqual(len(tiles), 2)
+        assert_array_equal(
+            tiles[0], d.multichannel_pixel_tile(img, (1, 10, 6), (1, 8, 6),
+                                                [0, 2],
+                                                pixel_padding=(0, 1, 1)))
+        assert_array_equal(
+            tiles[1], d.multichannel_pixel_tile(img, (1, 10, 6), (1, 8, 6),
+                                                [0, 2],
+                                                pixel_padding=(0, 1, 1),
+                                                level=1))
+
+    def test_multichannel_pixel_tile_native_dtype(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        c = TiffConnector(img_path, 'path/to/nowhere/')
+        d = Dataset(c)
+        d_native = Dataset(c, native_dtype=True)
+
+        self.assertEqual(d.pixel_dtype(), np.float64)
+        # dtypes are read from file headers, no image is opened
+        with mock.patch.object(c, '_open_image_file') as m:
+            self.assertEqual(d_native.pixel_dtype(), np.uint8)
+        m.assert_not_called()
+
+        for params in ({}, {'flipud': True}, {'rotation_angle': 30}):
+            val = d.multichannel_pixel_tile(2, (0, 0, 0), (1, 4, 3), [0, 2],
+                                            pixel_padding=(0, 2, 3),
+                                            augment_params=params)
+            tile = d_native.multichannel_pixel_tile(2, (0, 0, 0), (1, 4, 3),
+                                                    [0, 2],
+                                                    pixel_padding=(0, 2, 3),
+                                                    augment_params=params)
+            self.assertEqual(tile.dtype, np.uint8)
+            assert_array_equal(tile, val)
+
     def test_multichannel_pixel_tile_1(self):
         img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
         label_path = os.path.join(
@@ -0,0 +1,121 @@
+from unittest import TestCase
+import os
+import tempfile
+import h5py
+import numpy as np
+from numpy.testing import assert_array_equal
+from yapic_io.tiff_connector import TiffConnector
+from yapic_io.hdf5_connector import HDF5Connector
+import yapic_io.hdf5_file as hdf5_file
+
+base_path = os.path.dirname(__file__)
+
+
+class TestHDF5Connector(TestCase):
+
+    def setUp(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+        self.tiff = TiffConnector(img_path, label_path)
+
+        img_path = os.path.join(
+            base_path, '../test_data/hdf5connector/im/*.h5')
+        label_path = os.path.join(
+            base_path, '../test_data/hdf5connector/labels/*.h5')
+        self.savepath = tempfile.TemporaryDirectory()
+        self.c = HDF5Connector(img_path, label_path,
+                               savepath=self.savepath.name,
+                               chunks=(1, 1, 16, 16), compression='lzf')
+
+    def tearDown(self):
+        self.savepath.cleanup()
+
+    def test_init(self):
+        self.assertEqual(self.c.image_count(), 3)
+        self.assertEqual(self.c.labelvalue_mapping,
+                         self.tiff.labelvalue_mapping)
+        for image_nr in range(3):
+            assert_array_equal(self.c.image_dimensions(image_nr),
+                               self.tiff.image_dimensions(image_nr))
+
+    def test_get_tile(self):
+        for image_nr, pos, size in [(0, (0, 1, 2, 3), (3, 1, 20, 10)),
+                                    (1, (1, 2, 0, 5), (2, 4, 40, 21)),
+                                    (2, (0, 0, 0, 0), (3, 3, 6, 4))]:
+            assert_array_equal(self.c.get_tile(image_nr, pos, size),
+                               self.tiff.get_tile(image_nr, pos, size))
+
+    def test_get_tile_reads_chunks_once(self):
+        cache = self.c.tile_cache
+        cache.clear()
+        cache.hits = cache.misses = 0
+
+        self.c.get_tile(0, (0, 0, 0, 0), (1, 1, 10, 10))
+        self.assertEqual(cache.misses, 1)
+
+        self.c.get_tile(0, (0, 0, 5, 5), (1, 1, 15, 15))
+        self.assertEqual(cache.misses, 4)
+        self.assertEqual(cache.hits, 1)
+
+    def test_label_tile(self):
+        self.assertEqual(self.c.label_count_for_image(0),
+                         self.tiff.label_count_for_image(0))
+        for label_value in (1, 2, 3):
+            assert_array_equal(
+                self.c.label_tile(0, (1, 10, 2), (2, 20, 20), label_value),
+                self.tiff.label_tile(0, (1, 10, 2), (2, 20, 20),
+                                     label_value))
+
+    def test_put_tile(self):
+        pixels = np.random.rand(2, 20, 10).astype(np.float32)
+        self.c.put_tile(pixels, pos_zxy=(1, 3, 15), image_nr=0,
+                        label_value=2)
+        self.c.handle_pool.clear()
+
+        path = os.path.join(self.savepath.name,
+                            '40width26height3slices_rgb_class_2.h5')
+        with h5py.File(path, 'r') as f:
+            data = f['data']
+            self.assertEqual(data.shape, (1, 3, 26, 40))
+            self.assertEqual(data.chunks, (1, 1, 16, 16))
+            self.assertEqual(data.compression, 'lzf')
+
+            tile = data[0, 1:3, 15:25, 3:23]
+            assert_array_equal(np.swapaxes(tile, 1, 2), pixels)
+            self.assertEqual(data[0, 0].sum(), 0)
+
+    def test_read_header(self):
+        path = os.path.join(base_path, '../test_data/hdf5connector/labels/'
+                            '6width4height3slices_rgb.h5')
+        self.assertEqual(HDF5Connector._read_header(path)[0], (1, 3, 4, 6))
+
+    def test_evicted_files_are_closed(self):
+        img_path = os.path.join(
+            base_path, '../test_data/hdf5connector/im/*.h5')
+        c = HDF5Connector(img_path, 'path/to/nowhere/', max_open_files=1)
+        slices = c._open_image_file(0)
+        self.assertTrue(slices[0, 0, 0].dataset.id.valid)
+
+        c._open_image_file(1)
+        self.assertFalse(slices[0, 0, 0].dataset.id.valid)
+
+        c.close()
+        self.assertEqual(len(c.handle_pool), 0)
+
+
+class TestHDF5File(TestCase):
+
+    def test_open_tcz(self):
+        tmp = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp.name, 'zyx.h5')
+        data = np.arange(2 * 5 * 7).reshape((2, 5, 7))
+        with h5py.File(path, 'w') as f:
+            f.create_dataset('volume', data=data, chunks=(1, 2, 3))
+
+        self.assertTrue(hdf5_file.is_hdf5(path))
+        planes = hdf5_file.open_tcz(path)
+        self.assertEqual(planes.shape, (1, 1, 2))
+        assert_array_equal(planes[0, 0, 1][1:4, 2:7], data[1, 1:4, 2:7])
+        assert_array_equal(np.asarray(planes[0, 0, 0]), data[0])
@@ -1,7 +1,10 @@
 import os
 import logging
-from unittest import TestCase
-from yapic_io.ilastik_connector import IlastikConnector
+import tempfile
+from unittest import TestCase, mock
+import pyilastik
+import yapic_io.ilastik_connector as ilastik_connector
+from yapic_io.ilastik_connector import IlastikConnector, _block_to_zxy
 from numpy.testing import assert_array_equal
 import numpy as np
 from pprint import pprint
@@ -67,6 +70,92 @@ class TestIlastikConnector(TestCase):
 
         self.assertEqual(actual_counts, expected_counts)
 
+    def test_label_count_from_sparse_blocks(self):
+        img_path = os.path.join(
+            base_path, '../test_data/ilastik/pixels_ilastik-multiim-1.2')
+        lbl_path = os.path.join(
+            base_path, '../test_data/ilastik/ilastik-multiim-1.2.ilp')
+        c = IlastikConnector(img_path, lbl_path)
+
+        for image_nr in range(c.image_count()):
+            label_filename = str(c.filenames[image_nr].lbl)
+            _, (_, lbl, _) = c.ilp[label_filename]
+            values, counts = np.unique(lbl, return_counts=True)
+            expected = {int(v): n for v, n in zip(values, counts) if v > 0}
+
+            counts = c._original_label_count(image_nr)
+            if len(expected) == 0:
+                self.assertIn(counts, ([], [{}]))
+            else:
+                self.assertEqual(counts, [expected])
+
+    def test_label_count_scanned_once(self):
+        c = self.setup_storage_version_12()
+
+        # values and counts of labels are taken from the same scan
+        with mock.patch('yapic_io.ilastik_connector._label_value_counts') \
+                as m:
+            self.assertEqual(c.label_count_for_image(0), {1: 1, 2: 1, 3: 1})
+        m.assert_not_called()
+
+    def test_label_index(self):
+        img_path = os.path.join(
+            base_path, '../test_data/ilastik/pixels_ilastik-multiim-1.2')
+        lbl_path = os.path.join(
+            base_path, '../test_data/ilastik/ilastik-multiim-1.2.ilp')
+        tmpdir = tempfile.TemporaryDirectory()
+        index_path = os.path.join(tmpdir.name, 'label_stats.json')
+
+        c = IlastikConnector(img_path, lbl_path, label_index_path=index_path)
+        self.assertTrue(os.path.exists(index_path))
+
+        # the project is not scanned again if the index is up to date
+        with mock.patch('yapic_io.ilastik_connector._label_value_counts') \
+                as m:
+            c2 = IlastikConnector(img_path, lbl_path,
+                                  label_index_path=index_path)
+            self.assertEqual(c2.labelvalue_mapping, c.labelvalue_mapping)
+            self.assertEqual(c2.label_count_for_all_images(),
+                             c.label_count_for_all_images())
+        m.assert_not_called()
+
+        # a modified project file invalidates the index
+        item = str(c.filenames[0].lbl)
+        self.assertIsNotNone(c.label_index.get(lbl_path, item=item))
+        stat = os.stat(lbl_path)
+        try:
+            os.utime(lbl_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+            self.assertIsNone(c.label_index.get(lbl_path, item=item))
+        finally:
+            os.utime(lbl_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    def test_label_count_for_all_images_workers(self):
+        img_path = os.path.join(
+            base_path, '../test_data/ilastik/pixels_ilastik-multiim-1.2')
+        lbl_path = os.path.join(
+            base_path, '../test_data/ilastik/ilastik-multiim-1.2.ilp')
+        c = IlastikConnector(img_path, lbl_path)
+
+        expected = [c.label_count_for_image(i) for i in range(3)]
+        self.assertEqual(c.label_count_for_all_images(workers=2), expected)
+
+    def test_scan_label_item(self):
+        img_path = os.path.join(
+            base_path, '../test_data/ilastik/pixels_ilastik-multiim-1.2')
+        lbl_path = os.path.join(
+            base_path, '../test_data/ilastik/ilastik-multiim-1.2.ilp')
+        c = IlastikConnector(img_path, lbl_path)
+
+        # the project is opened once, tasks get item indices only
+        with mock.patch('pyilastik.read_project',
+                        wraps=pyilastik.read_project) as m:
+            ilastik_connector._open_worker_project(lbl_path)
+            counts = [ilastik_connector._scan_label_item(c._ilp_item(i))
+                      for i in range(c.image_count())]
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(counts, [c._original_label_count(i)
+                                  for i in range(c.image_count())])
+
     def test_constructor(self):
         img_path = os.path.join(
             base_path, '../test_data/ilastik/pixels_ilastik-multiim-1.2')
@@ -155,6 +244,36 @@ class TestIlastikConnector(TestCase):
 
 
 
+    def test_label_tiles(self):
+        img_path = os.path.join(
+            base_path, '../test_data/ilastik/pixels_ilastik-multiim-1.2')
+        lbl_path = os.path.join(
+            base_path, '../test_data/ilastik/ilastik-multiim-1.2.ilp')
+        c = IlastikConnector(img_path, lbl_path)
+
+        tiles = c.label_tiles(0, (0, 0, 0), (1, 19, 17), [2, 1])
+        self.assertEqual(tiles.shape, (2, 1, 19, 17))
+        assert_array_equal(tiles[0],
+                           c.label_tile(0, (0, 0, 0), (1, 19, 17), 2))
+        assert_array_equal(tiles[1],
+                           c.label_tile(0, (0, 0, 0), (1, 19, 17), 1))
+
+    def test_label_cache(self):
+        img_path = os.path.join(
+            base_path, '../test_data/ilastik/pixels_ilastik-multiim-1.2')
+        lbl_path = os.path.join(
+            base_path, '../test_data/ilastik/ilastik-multiim-1.2.ilp')
+        c = IlastikConnector(img_path, lbl_path)
+        c_cached = IlastikConnector(img_path, lbl_path,
+                                    label_cache_bytes=10**6)
+
+        for image_nr in range(c.image_count()):
+            size_zxy = c.image_dimensions(image_nr)[1:]
+            assert_array_equal(
+                c_cached.label_tiles(image_nr, (0, 0, 0), size_zxy, [1, 2]),
+                c.label_tiles(image_nr, (0, 0, 0), size_zxy, [1, 2]))
+        self.assertEqual(len(c_cached.label_cache), c.image_count())
+
     def test_label_tile_purkinjedata(self):
 
         p = os.path.join(base_path, '../test_data/ilastik/purkinjetest')
@@ -165,7 +284,7 @@ class TestIlastikConnector(TestCase):
         print(c.filenames)
         print(c.image_count)
 
-        image_id = 0  # 769_cerebellum_5M41_subset_1.tif
+        image_id = 3  # 769_cerebellum_5M41_subset_1.tif
         pos_zxy = (0, 309, 212)
         size_zxy = (1, 4, 5)
 
@@ -183,6 +302,100 @@ class TestIlastikConnector(TestCase):
         lbl = c.label_tile(image_id, pos_zxy, size_zxy, 4)
         assert_array_equal(lbl, val)
 
+    def test_label_tile_reads_intersecting_blocks(self):
+        p = os.path.join(base_path, '../test_data/ilastik/purkinjetest')
+        img_path = os.path.join(p, 'images')
+        lbl_path = os.path.join(p, 'ilastik-1.2.2post1mac.ilp')
+        c = IlastikConnector(img_path, lbl_path)
+
+        boxes, blocks = c._label_blocks(0)
+        assert_array_equal(boxes, [[[0, 1], [130, 216], [650, 718]],
+                                   [[0, 1], [334, 382], [650, 698]]])
+        self.assertEqual(len(blocks), 2)
+
+        # no block is read for tiles without labels
+        with mock.patch.object(c, '_label_block') as m:
+            tile = c.label_tile(0, (0, 0, 0), (1, 100, 100), 1)
+            self.assertEqual(tile.shape, (1, 100, 100))
+            self.assertFalse(tile.any())
+        m.assert_not_called()
+
+        with mock.patch.object(c, '_label_block',
+                               wraps=c._label_block) as m:
+            c.label_tiles(0, (0, 300, 600), (1, 100, 100), [1, 2])
+        m.assert_called_once_with(0, 1)
+
+    def test_label_tile_dtype(self):
+        p = os.path.join(base_path, '../test_data/ilastik/purkinjetest')
+        img_path = os.path.join(p, 'images')
+        lbl_path = os.path.join(p, 'ilastik-1.2.2post1mac.ilp')
+        c = IlastikConnector(img_path, lbl_path)
+
+        _, blocks = c._label_blocks(0)
+        lbl = c._read_label_tile(0, (0, 300, 600), (1, 100, 100))
+        self.assertEqual(lbl.dtype, blocks[1].dtype)
+        self.assertEqual(lbl.dtype, np.uint8)
+
+    def test_project_label_blocks_public_api(self):
+        # pyilastik without the private block api: labels are read with
+        # ilp.tile as one dense block
+        p = os.path.join(base_path, '../test_data/ilastik/purkinjetest')
+        img_path = os.path.join(p, 'images')
+        lbl_path = os.path.join(p, 'ilastik-1.2.2post1mac.ilp')
+        c = IlastikConnector(img_path, lbl_path)
+        c_public = IlastikConnector(img_path, lbl_path)
+        c_public.ilp = mock.Mock(
+            wraps=c.ilp, spec=['tile', 'original_dimension_order',
+                               'shape_of_labelmatrix'])
+
+        item = c._ilp_item(0)
+        slices, blocks = ilastik_connector._project_label_blocks(
+            c_public.ilp, item)
+        self.assertEqual(len(blocks), 1)
+        # dimension order yxc, the block covers all labels of the image
+        assert_array_equal(slices, [[[0, 718], [0, 382], [0, 1]]])
+
+        self.assertEqual(
+            ilastik_connector._label_value_counts(c_public.ilp, item),
+            ilastik_connector._label_value_counts(c.ilp, item))
+        for pos_zxy in [(0, 0, 0), (0, 120, 640), (0, 300, 600)]:
+            assert_array_equal(
+                c_public.label_tiles(0, pos_zxy, (1, 100, 100), [1, 2]),
+                c.label_tiles(0, pos_zxy, (1, 100, 100), [1, 2]))
+
+    def test_label_index_to_coordinate(self):
+        p = os.path.join(base_path, '../test_data/ilastik/purkinjetest')
+        img_path = os.path.join(p, 'images')
+        lbl_path = os.path.join(p, 'ilastik-1.2.2post1mac.ilp')
+        c = IlastikConnector(img_path, lbl_path)
+        self.assertTrue(c.has_label_coordinates())
+
+        size_zxy = c.image_dimensions(2)[1:]
+        for label_value, n in c.label_count_for_image(2).items():
+            lbl = c.label_tile(2, (0, 0, 0), size_zxy, label_value)
+            coordinates = np.array([
+                c.label_index_to_coordinate(2, label_value, i)
+                for i in range(n)])
+            self.assertEqual(len(np.unique(coordinates, axis=0)), n)
+            self.assertTrue(np.all(coordinates[:, 0] == 0))
+            self.assertTrue(lbl[tuple(coordinates[:, 1:].T)].all())
+
+            with self.assertRaises(IndexError):
+                c.label_index_to_coordinate(2, label_value, n)
+
+        with self.assertRaises(ValueError):
+            c.label_index_to_coordinate(1, 1, 0)  # image without labels
+
+    def test_block_to_zxy(self):
+        zxy = np.arange(24).reshape((2, 3, 4))
+        zyx = np.transpose(zxy, (0, 2, 1))
+
+        assert_array_equal(_block_to_zxy(zyx[..., np.newaxis], 'zyxc'), zxy)
+        assert_array_equal(_block_to_zxy(zyx[:, np.newaxis], 'zcyx'), zxy)
+        assert_array_equal(_block_to_zxy(zyx[0, ..., np.newaxis], 'yxc'),
+                           zxy[:1])
+        assert_array_equal(_block_to_zxy(zyx[:1], 'cyx'), zxy[:1])
+
     def test_labeltile_dimensions_purkinjedata(self):
 
         p = os.path.join(base_path, '../test_data/ilastik/purkinjetest')
@@ -284,3 +497,15 @@ class TestIlastikConnector(TestCase):
 
         assert_array_equal(c1.image_count() + c2.image_count(),
                            c.image_count())
+
+        # subsets read the labels of their own images from the project
+        for sub in (c1, c2):
+            self.assertIs(sub.ilp, c.ilp)
+            for i, pair in enumerate(sub.filenames):
+                image_nr = c.filenames.index(pair)
+                size_zxy = c.image_dimensions(image_nr)[1:]
+                assert_array_equal(
+                    sub.label_tiles(i, (0, 0, 0), size_zxy, [1, 2]),
+                    c.label_tiles(image_nr, (0, 0, 0), size_zxy, [1, 2]))
+                self.assertEqual(sub.label_count_for_image(i),
+                                 c.label_count_for_image(image_nr))
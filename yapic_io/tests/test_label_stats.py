@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from yapic_io.label_stats import LabelStatsIndex
+
+base_path = os.path.dirname(__file__)
+
+
+class TestLabelStatsIndex(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.index_path = os.path.join(self.tmpdir.name, 'label_stats.json')
+        self.lbl_path = os.path.join(self.tmpdir.name, 'labels.tif')
+
+        src = os.path.join(base_path,
+                           '../test_data/tiffconnector_1/labels/',
+                           '6width4height3slices_rgb.tif')
+        shutil.copy(src, self.lbl_path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_put_get(self):
+        index = LabelStatsIndex(self.index_path)
+        self.assertIsNone(index.get(self.lbl_path))
+
+        index.put(self.lbl_path, [{109: 11, 150: 3}, {}])
+        self.assertEqual(index.get(self.lbl_path), [{109: 11, 150: 3}, {}])
+
+    def test_save_and_load(self):
+        index = LabelStatsIndex(self.index_path)
+        index.put(self.lbl_path, [{109: 11, 150: 3}])
+        index.save()
+
+        index = LabelStatsIndex(self.index_path)
+        self.assertEqual(index.get(self.lbl_path), [{109: 11, 150: 3}])
+
+    def test_items(self):
+        index = LabelStatsIndex(self.index_path)
+        index.put(self.lbl_path, [{1: 3}], item='a')
+        index.put(self.lbl_path, [{2: 4}], item='b')
+
+        self.assertEqual(index.get(self.lbl_path, item='a'), [{1: 3}])
+        self.assertEqual(index.get(self.lbl_path, item='b'), [{2: 4}])
+        self.assertIsNone(index.get(self.lbl_path))
+
+    def test_modified_file_is_stale(self):
+        index = LabelStatsIndex(self.index_path)
+        index.put(self.lbl_path, [{109: 11, 150: 3}])
+
+        with open(self.lbl_path, 'ab') as f:
+            f.write(b'\0')
+
+        self.assertIsNone(index.get(self.lbl_path))
+
+    def test_broken_index_file(self):
+        with open(self.index_path, 'w') as f:
+            f.write('{broken')
+
+        index = LabelStatsIndex(self.index_path)
+        self.assertIsNone(index.get(self.lbl_path))
@@ -349,6 +349,80 @@ class TestPredictionBatch(TestCase):
                 item.put_probmap_data(mock_classifier_result)
 
 
+    def test_prediction_loop_write_buffer(self):
+        pixel_image_dir = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_image_dir = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+
+        results = []
+        for write_buffer_bytes in [None, 10**6]:
+            with tempfile.TemporaryDirectory() as savepath:
+                c = TiffConnector(pixel_image_dir, label_image_dir,
+                                  savepath=savepath,
+                                  write_buffer_bytes=write_buffer_bytes)
+                p = PredictionBatch(Dataset(c), 3, (1, 5, 4))
+                for counter, item in enumerate(p):
+                    n_tiles = len(item.current_tile_positions)
+                    item.put_probmap_data(
+                        np.ones((n_tiles, 3, 1, 5, 4)) * counter)
+
+                # the last batch flushes the buffer
+                results.append(
+                    [np.array(s) for fname in sorted(os.listdir(savepath))
+                     for s in Tiff.memmap_tcz(
+                         os.path.join(savepath, fname)).flat])
+
+        self.assertEqual(len(results[0]), len(results[1]))
+        for plane, plane_buffered in zip(*results):
+            assert_array_equal(plane, plane_buffered)
+
+    def test_prediction_loop_flushes_on_exit(self):
+        pixel_image_dir = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_image_dir = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+
+        with tempfile.TemporaryDirectory() as savepath:
+            c = TiffConnector(pixel_image_dir, label_image_dir,
+                              savepath=savepath, write_buffer_bytes=10**6)
+            p = PredictionBatch(Dataset(c), 3, (1, 5, 4))
+            for item in p:
+                n_tiles = len(item.current_tile_positions)
+                item.put_probmap_data(np.ones((n_tiles, 3, 1, 5, 4)))
+                # leave the loop before the last batch
+                break
+
+            # the partially written slice z=0 is written on exit
+            self.assertEqual(len(c.write_buffer), 0)
+            probmap = c._open_probability_map_file(0, 1)
+            self.assertEqual(np.array(probmap[0, 0, 0]).sum(), 3 * 5 * 4)
+
+    def test_prediction_loop_multichannel_probmap(self):
+        pixel_image_dir = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_image_dir = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+
+        with tempfile.TemporaryDirectory() as savepath:
+            c = TiffConnector(pixel_image_dir, label_image_dir,
+                              savepath=savepath,
+                              probmap_layout='multichannel')
+            p = PredictionBatch(Dataset(c), 2, (1, 5, 4))
+            for item in p:
+                n_tiles = len(item.current_tile_positions)
+                probmap = np.ones((n_tiles, 3, 1, 5, 4))
+                probmap *= np.array(sorted(p.labels))[:, None, None, None]
+                item.put_probmap_data(probmap)
+
+            path = os.path.join(savepath,
+                                '40width26height3slices_rgb_classes.tif')
+            slices = Tiff.memmap_tcz(path)
+            self.assertEqual(slices.shape, (1, 3, 3))
+            for c in range(3):
+                for z in range(3):
+                    assert_array_equal(slices[0, c, z], c + 1)
+
     def test_pixel_dimensions(self):
 
         img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/*')
@@ -366,3 +440,23 @@ class TestPredictionBatch(TestCase):
 
         p.set_pixel_dimension_order('bzxyc')
         self.assertEqual((2, 1, 5, 4, 3), p.pixels().shape)
+
+    def test_multiscale_pixels(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/*')
+        c = io_connector(img_path, '')
+        d = Dataset(c)
+
+        p = PredictionBatch(d, 2, (1, 5, 4), padding_zxy=(0, 1, 1))[1]
+        p.set_pixel_levels((1, 2))
+        pixels = p.multiscale_pixels()
+
+        self.assertEqual(len(pixels), 3)
+        assert_array_equal(pixels[0], p.pixels())
+        for level, level_pixels in zip((1, 2), pixels[1:]):
+            self.assertEqual(level_pixels.shape, (2, 3, 1, 7, 6))
+            for tile, (im_nr, pos_zxy) in zip(level_pixels,
+                                              p.current_tile_positions):
+                val = d.multichannel_pixel_tile(im_nr, pos_zxy, (1, 5, 4),
+                                                p.channels, (0, 1, 1),
+                                                level=level)
+                assert_array_almost_equal(tile, val)
@@ -5,9 +5,12 @@ import numpy as np
 from numpy.testing import assert_array_equal
 from yapic_io.tiff_connector import TiffConnector
 import yapic_io.tiff_connector as tc
+import yapic_io.transformations as tf
 import logging
 import tempfile
+from unittest import mock
 from pathlib import Path
+from bigtiff import Tiff, PlaceHolder
 logger = logging.getLogger(os.path.basename(__file__))
 
 base_path = os.path.dirname(__file__)
@@ -130,6 +133,35 @@ class TestTiffConnector(TestCase):
         self.assertEqual(c1.labelvalue_mapping, c.labelvalue_mapping)
         self.assertEqual(c2.labelvalue_mapping, c.labelvalue_mapping)
 
+    def test_split_shares_files_and_label_stats(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        lbl_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+        c = TiffConnector(img_path, lbl_path, write_buffer_bytes=2**20)
+
+        with mock.patch.object(TiffConnector, '_open_tcz') as open_tcz, \
+                mock.patch.object(TiffConnector, '_read_header') as shape:
+            c1, c2 = c.split(0.5)
+            counts = [c1.label_count_for_image(i)
+                      for i in range(c1.image_count())]
+            dims = [c1.image_dimensions(i) for i in range(c1.image_count())]
+            open_tcz.assert_not_called()
+            shape.assert_not_called()
+
+        self.assertIs(c1.handle_pool, c.handle_pool)
+        self.assertIs(c1.tile_cache, c.tile_cache)
+        self.assertIsNot(c1.write_buffer, c.write_buffer)
+
+        for (img, lbl), count, dim in zip(c1.filenames, counts, dims):
+            image_nr = c.filenames.index((img, lbl))
+            self.assertEqual(count, c.label_count_for_image(image_nr))
+            assert_array_equal(dim, c.image_dimensions(image_nr))
+            assert_array_equal(
+                c1.label_tile(c1.filenames.index((img, lbl)),
+                              (0, 0, 0), (1, 4, 4), 2),
+                c.label_tile(image_nr, (0, 0, 0), (1, 4, 4), 2))
+
     def test_load_filenames_emptyfolder(self):
         img_path = os.path.join(base_path, '../test_data/empty_folder/')
 
@@ -192,6 +224,73 @@ class TestTiffConnector(TestCase):
             v = c * 2 ** 3 + z * 2 ** 2 + y * 2 ** 1 + x * 2 ** 0
             np.testing.assert_array_equal(tile, [[[[v]]]])
 
+    def test_get_tile_out(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/c2z2y2x2.tif')
+        conn = TiffConnector(img_path, 'path/to/nowhere/')
+
+        pos = (0, 0, 0, 0)
+        size = (2, 2, 2, 2)
+        expected = conn.get_tile(image_nr=0, pos=pos, size=size)
+
+        out = np.zeros(size, dtype=np.float32)
+        tile = conn.get_tile(image_nr=0, pos=pos, size=size, out=out)
+        self.assertIs(tile, out)
+        np.testing.assert_array_equal(out, expected)
+
+        # write into a strided view of a larger buffer
+        out = np.zeros((2, 2, 4, 4), dtype=np.uint8)
+        conn.get_tile(image_nr=0, pos=pos, size=size, out=out[:, :, ::2, 1:3])
+        np.testing.assert_array_equal(out[:, :, ::2, 1:3], expected)
+        self.assertEqual(out.sum(), expected.sum())
+
+    def test_handle_pool(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        lbl_path = os.path.join(base_path,
+                                '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, lbl_path, max_open_files=2)
+        c.handle_pool.clear()
+
+        a = c._open_image_file(0)
+        self.assertIs(c._open_image_file(0), a)
+        self.assertEqual(c.handle_pool.hits, 1)
+
+        c._open_image_file(1)
+        c._open_label_file(0)
+        self.assertEqual(len(c.handle_pool), 2)
+        self.assertNotIn(('image', c.img_path / c.filenames[0].img),
+                         c.handle_pool)
+
+        # only the most recent file is kept if the byte budget is tiny
+        c = TiffConnector(img_path, lbl_path, max_mapped_bytes=1)
+        c._open_image_file(0)
+        c._open_image_file(1)
+        self.assertEqual(len(c.handle_pool), 1)
+
+    def test_tiled_tiff(self):
+        c = TiffConnector(
+            os.path.join(base_path, '../test_data/tiffconnector_1/im/'),
+            os.path.join(base_path, '../test_data/tiffconnector_1/labels/'))
+        c_tiled = TiffConnector(
+            os.path.join(base_path, '../test_data/tiffconnector_tiled/im/'),
+            os.path.join(base_path,
+                         '../test_data/tiffconnector_tiled/labels/'),
+            tile_cache_bytes=10**5)
+
+        assert_array_equal(c_tiled.image_dimensions(0),
+                           c.image_dimensions(0))
+        self.assertEqual(c_tiled.labelvalue_mapping, c.labelvalue_mapping)
+        self.assertEqual(c_tiled.label_count_for_image(0),
+                         c.label_count_for_image(0))
+
+        pos = (1, 0, 13, 5)
+        size = (2, 3, 20, 17)
+        assert_array_equal(c_tiled.get_tile(0, pos, size),
+                           c.get_tile(0, pos, size))
+        assert_array_equal(c_tiled.label_tile(0, pos[1:], size[1:], 3),
+                           c.label_tile(0, pos[1:], size[1:], 3))
+        self.assertGreater(len(c_tiled.tile_cache), 0)
+
     def test_load_label_filenames(self):
         img_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/im/*.tif')
@@ -246,6 +345,54 @@ class TestTiffConnector(TestCase):
               [True,  True,  False, False]]])
         assert_array_equal(val_z1, tile_z1)
 
+    def test_label_tiles(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/labels_multichannel/*.tif')
+        c = TiffConnector(img_path, label_path)
+
+        pos_zxy = (0, 0, 0)
+        size_zxy = (3, 6, 4)
+        label_values = sorted(c.labelvalue_mapping[0].values()) + \
+            sorted(c.labelvalue_mapping[1].values())
+
+        tiles = c.label_tiles(2, pos_zxy, size_zxy, label_values)
+        self.assertEqual(tiles.shape, (len(label_values), 3, 6, 4))
+        for tile, label_value in zip(tiles, label_values):
+            assert_array_equal(
+                tile, c.label_tile(2, pos_zxy, size_zxy, label_value))
+
+    def test_label_cache(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/labels_multichannel/*.tif')
+        c = TiffConnector(img_path, label_path)
+        c_cached = TiffConnector(img_path, label_path,
+                                 label_cache_bytes=10**6)
+
+        label_values = sorted(c.labelvalue_mapping[0].values()) + \
+            sorted(c.labelvalue_mapping[1].values())
+        for image_nr in range(c.image_count()):
+            size_zxy = c.image_dimensions(image_nr)[1:] - (0, 1, 1)
+            assert_array_equal(
+                c_cached.label_tiles(image_nr, (0, 1, 1), size_zxy,
+                                     label_values),
+                c.label_tiles(image_nr, (0, 1, 1), size_zxy, label_values))
+
+        ranks, values = c_cached._compact_labels(2)
+        self.assertEqual(ranks.dtype, np.uint8)
+        self.assertEqual(ranks.shape[:2], (2, 3))
+
+        # only the most recently used label image exceeding the budget is kept
+        c_cached = TiffConnector(img_path, label_path, label_cache_bytes=1)
+        c_cached.label_tile(1, (0, 0, 0), (1, 1, 1), 1)
+        c_cached.label_tile(2, (0, 0, 0), (1, 1, 1), 1)
+        self.assertEqual(len(c_cached.label_cache), 1)
+
     def test_check_label_matrix_dimensions(self):
         img_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/im/*.tif')
@@ -268,6 +415,73 @@ class TestTiffConnector(TestCase):
                                                     img_path,
                                                     label_path))
 
+    def test_lazy_validation(self):
+        img_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/labels_multichannel_not_valid/')
+
+        c = TiffConnector(img_path, label_path, lazy_validation=True)
+
+        c.get_tile(0, (0, 0, 0, 0), (1, 1, 2, 2))
+        c.get_tile(1, (0, 0, 0, 0), (1, 1, 2, 2))
+        # label channels differ from the label channels of image 0
+        with self.assertRaises(AssertionError):
+            c.get_tile(2, (0, 0, 0, 0), (1, 1, 2, 2))
+
+    def test_image_dimensions_from_headers(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+
+        c = TiffConnector(img_path, label_path)
+
+        # image files are not opened for validation
+        self.assertFalse(any(kind == 'image'
+                             for kind, _ in c.handle_pool.keys()))
+
+        for image_nr in range(c.image_count()):
+            img = c._open_image_file(image_nr)
+            Y, X = img[0, 0, 0].shape
+            assert_array_equal(c.image_dimensions(image_nr),
+                               img.shape[1:] + (X, Y))
+
+            if c.filenames[image_nr].lbl is not None:
+                lbl = c._open_label_file(image_nr)
+                assert_array_equal(c.label_matrix_dimensions(image_nr),
+                                   lbl.shape[1:] + (X, Y))
+
+    def test_compact_label_channels(self):
+        channels = [np.array([[[0, 7], [3, 3]], [[300, 0], [7, 7]]]),
+                    np.array([[[0, 0], [0, 1]], [[0, 0], [0, 0]]])]
+        ranks, values = tc._compact_label_channels(channels)
+
+        self.assertEqual(ranks.dtype, np.uint8)
+        self.assertEqual(ranks.shape, (2, 2, 2, 2))
+        assert_array_equal(values[0], [0, 3, 7, 300])
+        assert_array_equal(values[1], [0, 1])
+        for rank, channel_values, channel in zip(ranks, values, channels):
+            assert_array_equal(channel_values[rank], channel)
+
+    def test_read_header(self):
+        path = os.path.join(base_path,
+                            '../test_data/tiffconnector_tiled/im/'
+                            '40width26height3slices_rgb.tif')
+        self.assertEqual(TiffConnector._read_header(path),
+                         ((3, 3, 26, 40), np.uint8))
+
+    def test_read_header_tiled_without_imagej_metadata(self):
+        path = os.path.join(base_path,
+                            '../test_data/tiffconnector_tiled/plain/'
+                            '40width26height3slices_rgb.tif')
+        with mock.patch('yapic_io.tiled_tiff.TiledTiff._decode_tile') as m:
+            self.assertEqual(TiffConnector._read_header(path)[0],
+                             (3, 3, 26, 40))
+        m.assert_not_called()
+
     def test_label_count_for_image(self):
         img_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/im/*.tif')
@@ -281,6 +495,52 @@ class TestTiffConnector(TestCase):
 
         self.assertEqual(count, {2: 11, 3: 3})
 
+    def test_label_value_counts(self):
+        for dtype in (np.uint8, np.uint16, np.int32, np.float32):
+            planes = [np.array([[0, 3, 3], [1, 0, 3]], dtype=dtype),
+                      np.array([[1, 1, 0], [0, 0, 300 % 256]], dtype=dtype)]
+            slices = np.empty((1, 2, 2), dtype=object)
+            slices[0, 0, 0], slices[0, 0, 1] = planes
+            slices[0, 1, 0] = slices[0, 1, 1] = np.zeros((2, 3), dtype)
+
+            counts = tc._label_value_counts(slices)
+            self.assertEqual(counts, [{1: 3, 3: 3, 44: 1}, {}])
+
+    def test_label_index(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+        tmpdir = tempfile.TemporaryDirectory()
+        index_path = os.path.join(tmpdir.name, 'label_stats.json')
+
+        c = TiffConnector(img_path, label_path, label_index_path=index_path)
+        self.assertTrue(os.path.exists(index_path))
+
+        # label files are not scanned again if the index is up to date
+        with mock.patch('yapic_io.tiff_connector._label_value_counts') as m:
+            c2 = TiffConnector(img_path, label_path,
+                               label_index_path=index_path)
+            self.assertEqual(c2.label_count_for_image(2), {2: 11, 3: 3})
+            self.assertEqual(c2.labelvalue_mapping, c.labelvalue_mapping)
+        m.assert_not_called()
+
+    def test_workers(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/labels_multichannel/*.tif')
+
+        c = TiffConnector(img_path, label_path)
+        c2 = TiffConnector(img_path, label_path, workers=2)
+
+        self.assertEqual(c.labelvalue_mapping, c2.labelvalue_mapping)
+        self.assertEqual(c.label_count_for_all_images(),
+                         c2.label_count_for_all_images())
+        self.assertEqual(c.label_count_for_all_images(),
+                         c.label_count_for_all_images(workers=2))
+
     def test_put_tile_1(self):
         img_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/im/*.tif')
@@ -333,6 +593,142 @@ class TestTiffConnector(TestCase):
         except FileNotFoundError:
             pass
 
+    def test_put_tile_write_buffer(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+        savepath = tempfile.TemporaryDirectory()
+        savepath_buffered = tempfile.TemporaryDirectory()
+
+        c = TiffConnector(img_path, label_path, savepath=savepath.name)
+        c_buffered = TiffConnector(img_path, label_path,
+                                   savepath=savepath_buffered.name,
+                                   write_buffer_bytes=10**6)
+
+        # image 2 has shape zxy (3, 6, 4)
+        np.random.seed(42)
+        for pos_zxy in [(0, 0, 0), (0, 3, 0), (0, 0, 2), (0, 3, 2),
+                        (1, 1, 1)]:
+            pixels = np.random.rand(2, 3, 2).astype(np.float32)
+            c.put_tile(pixels, pos_zxy, image_nr=2, label_value=2)
+            c_buffered.put_tile(pixels, pos_zxy, image_nr=2, label_value=2)
+
+        # slices z=0 and z=1 were complete and written, the last tile
+        # covers z=1 and z=2 partially
+        self.assertEqual(len(c_buffered.write_buffer), 2)
+        c_buffered.flush()
+        self.assertEqual(len(c_buffered.write_buffer), 0)
+
+        slices = c._open_probability_map_file(2, 2)
+        slices_buffered = c_buffered._open_probability_map_file(2, 2)
+        for z in range(3):
+            assert_array_equal(slices_buffered[0, 0, z], slices[0, 0, z])
+
+    def test_put_tile_write_buffer_row_bands(self):
+        # sparse image with a 1000x1000 plane, larger than the budget
+        img_dir = tempfile.TemporaryDirectory()
+        Tiff.write([PlaceHolder((1000, 1000, 1), 'uint8')],
+                   io=os.path.join(img_dir.name, 'large.tif'),
+                   imagej_shape=(1, 1, 1))
+
+        np.random.seed(42)
+        tiles = [np.random.rand(1, 50, 50).astype(np.float32)
+                 for _ in range(400)]
+
+        probmaps = {}
+        n_writes = {}
+        for write_buffer_bytes in (None, 10**6):
+            savepath = tempfile.TemporaryDirectory()
+            c = TiffConnector(img_dir.name, 'path/to/nowhere/',
+                              savepath=savepath.name,
+                              write_buffer_bytes=write_buffer_bytes)
+            with mock.patch.object(c, '_probability_map_plane',
+                                   wraps=c._probability_map_plane) as m:
+                for i, pixels in enumerate(tiles):
+                    pos_zxy = (0, (i % 20) * 50, (i // 20) * 50)
+                    c.put_tile(pixels, pos_zxy, image_nr=0, label_value=1)
+                if c.write_buffer is not None:
+                    # all bands of rows were complete and written
+                    self.assertEqual(len(c.write_buffer), 0)
+                c.close()
+            n_writes[write_buffer_bytes] = m.call_count
+            probmaps[write_buffer_bytes] = np.array(
+                c._open_probability_map_file(0, 1)[0, 0, 0])
+
+        assert_array_equal(probmaps[10**6], probmaps[None])
+        self.assertEqual(probmaps[None][50:100, 100:150].T.tolist(),
+                         tiles[22][0].tolist())
+        # one write per tile vs. one write per band of 100 rows
+        self.assertEqual(n_writes[None], 400)
+        self.assertEqual(n_writes[10**6], 10)
+
+    def test_close(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        savepath = tempfile.TemporaryDirectory()
+
+        with TiffConnector(img_path, 'path/to/nowhere/',
+                           savepath=savepath.name,
+                           write_buffer_bytes=10**6) as c:
+            c.put_tile(np.ones((1, 2, 2)), (0, 0, 0), image_nr=0,
+                       label_value=1)
+            self.assertEqual(len(c.write_buffer), 1)
+
+        self.assertEqual(len(c.write_buffer), 0)
+        self.assertEqual(len(c.handle_pool), 0)
+        probmap = c._open_probability_map_file(0, 1)
+        self.assertEqual(np.array(probmap[0, 0, 0]).sum(), 4)
+
+    def test_put_tiles_multichannel(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+        savepath = tempfile.TemporaryDirectory()
+
+        c = TiffConnector(img_path, label_path, savepath=savepath.name,
+                          probmap_layout='multichannel')
+
+        pixels = np.random.rand(3, 2, 3, 2).astype(np.float32)
+        c.put_tiles(pixels, (1, 2, 1), image_nr=2, label_values=[3, 1, 2])
+
+        self.assertEqual(os.listdir(savepath.name),
+                         ['6width4height3slices_rgb_classes.tif'])
+
+        slices = c._open_multichannel_probability_map_file(2)
+        self.assertEqual(slices.shape, (1, 3, 3))
+        probmap = np.array([[s.T for s in channel] for channel in slices[0]])
+        assert_array_equal(probmap[[2, 0, 1], 1:3, 2:5, 1:3], pixels)
+        self.assertEqual(probmap.sum(), pixels.sum())
+
+        with self.assertRaises(ValueError):
+            c.put_tile(pixels[0], (1, 2, 1), image_nr=2, label_value=4)
+
+    def test_put_tile_probmap_dtype(self):
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/*.tif')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/*.tif')
+        pixels = np.array([[[.1, .2, .3],
+                            [.4, .5, 1.]]])
+
+        for dtype, val in [('float16', pixels.astype(np.float16)),
+                           ('uint8', [[[26, 51, 76], [102, 128, 255]]])]:
+            savepath = tempfile.TemporaryDirectory()
+            c = TiffConnector(img_path, label_path, savepath=savepath.name,
+                              probmap_dtype=dtype)
+            c.put_tile(pixels, pos_zxy=(0, 1, 1), image_nr=2, label_value=3)
+
+            path = os.path.join(
+                savepath.name, '6width4height3slices_rgb_class_3.tif')
+            plane = Tiff.memmap_tcz(path)[0, 0, 0]
+            self.assertEqual(plane.dtype, np.dtype(dtype))
+            assert_array_equal(plane[1:4, 1:3].T[np.newaxis], val)
+
+        with self.assertRaises(ValueError):
+            TiffConnector(img_path, label_path, probmap_dtype='int8')
+
     def test_put_tile_2(self):
         img_path = os.path.join(
             base_path, '../test_data/tiffconnector_1/im/*.tif')
@@ -469,3 +865,120 @@ class TestTiffConnector(TestCase):
         original_labels = c.original_label_values_for_all_images()
         c.calc_label_values_mapping(original_labels)
         self.assertEqual(c.labelvalue_mapping, [{109: 1, 150: 2}])
+
+    def test_get_tile_level(self):
+        img_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/im/40width26height3slices_rgb.tif')
+        c = TiffConnector(img_path, 'path/to/nowhere/')
+
+        assert_array_equal(c.image_dimensions(0, level=1), (3, 3, 20, 13))
+        assert_array_equal(c.image_dimensions(0, level=2), (3, 3, 10, 7))
+
+        full = c.get_tile(0, (0, 0, 0, 0), (3, 3, 40, 26)).astype('uint8')
+        level_1 = tf.downsample_2d(full)
+        level_2 = tf.downsample_2d(level_1)
+
+        tile = c.get_tile(0, (1, 0, 3, 2), (2, 3, 10, 8), level=1)
+        assert_array_equal(tile, level_1[1:3, :, 3:13, 2:10])
+        tile = c.get_tile(0, (0, 0, 0, 0), (3, 3, 10, 7), level=2)
+        assert_array_equal(tile, level_2)
+
+    def test_get_tile_level_embedded(self):
+        # level 1 is read from the pyramid embedded in the tiff file
+        pyramid_path = tempfile.TemporaryDirectory()
+        img_path = os.path.join(
+            base_path, '../test_data/tiffconnector_pyramid/im/*.tif')
+        c = TiffConnector(img_path, 'path/to/nowhere/',
+                          pyramid_path=pyramid_path.name)
+        slices = c._open_image_file(0, level=1)
+        self.assertEqual(type(slices[0, 0, 0]).__name__, 'TiledPlane')
+
+        img_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/im/40width26height3slices_rgb.tif')
+        c_generated = TiffConnector(img_path, 'path/to/nowhere/')
+
+        assert_array_equal(c.image_dimensions(0, level=1),
+                           c_generated.image_dimensions(0, level=1))
+        assert_array_equal(
+            c.get_tile(0, (0, 1, 4, 2), (3, 2, 16, 11), level=1),
+            c_generated.get_tile(0, (0, 1, 4, 2), (3, 2, 16, 11), level=1))
+
+        # level 2 is generated from level 1
+        c.get_tile(0, (0, 0, 0, 0), (3, 3, 10, 7), level=2)
+        self.assertEqual(os.listdir(pyramid_path.name),
+                         ['40width26height3slices_rgb.tif_level2.tif'])
+
+    def test_get_tile_level_pyramid_path(self):
+        pyramid_path = tempfile.TemporaryDirectory()
+        img_path = os.path.join(
+            base_path,
+            '../test_data/tiffconnector_1/im/40width26height3slices_rgb.tif')
+        c = TiffConnector(img_path, 'path/to/nowhere/',
+                          pyramid_path=pyramid_path.name)
+        val = c.get_tile(0, (0, 0, 0, 0), (3, 3, 10, 7), level=2)
+        self.assertEqual(sorted(os.listdir(pyramid_path.name)),
+                         ['40width26height3slices_rgb.tif_level1.tif',
+                          '40width26height3slices_rgb.tif_level2.tif'])
+
+        # generated levels are reused
+        c = TiffConnector(img_path, 'path/to/nowhere/',
+                          pyramid_path=pyramid_path.name)
+        with mock.patch.object(tc, '_downsample_tcz') as downsample:
+            tile = c.get_tile(0, (0, 0, 0, 0), (3, 3, 10, 7), level=2)
+        downsample.assert_not_called()
+        assert_array_equal(tile, val)
+
+    def test_label_index_to_coordinate(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path, label_coordinates=True)
+        c_workers = TiffConnector(img_path, label_path,
+                                  label_coordinates=True, workers=2)
+        self.assertTrue(c.has_label_coordinates())
+        self.assertFalse(TiffConnector(img_path,
+                                       label_path).has_label_coordinates())
+
+        for image_nr in range(c.image_count()):
+            counts = c.label_count_for_image(image_nr) or {}
+            self.assertEqual(counts,
+                             c_workers.label_count_for_image(image_nr) or {})
+
+            shape_zxy = c.image_dimensions(image_nr)[1:]
+            for label_value, count in counts.items():
+                label_channel, _ = c._mapped_label_value_to_original(
+                    label_value)
+                tile = c.label_tile(image_nr, (0, 0, 0), shape_zxy,
+                                    label_value)
+                coordinates = [c.label_index_to_coordinate(image_nr,
+                                                           label_value, i)
+                               for i in range(count)]
+
+                # all labels are indexed in zxy order
+                val = np.transpose(np.nonzero(tile))
+                assert_array_equal([zxy for _, *zxy in coordinates], val)
+                for label_c, *_ in coordinates:
+                    self.assertEqual(label_c, label_channel)
+
+        count = c.label_count_for_image(0)[2]
+        with self.assertRaises(IndexError):
+            c.label_index_to_coordinate(0, 2, count)
+
+    def test_label_coordinates_with_label_index(self):
+        img_path = os.path.join(base_path, '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/labels/')
+        tmp = tempfile.TemporaryDirectory()
+        index_path = os.path.join(tmp.name, 'label_stats.json')
+        TiffConnector(img_path, label_path, label_index_path=index_path)
+
+        # label counts are known, coordinates are indexed on first access
+        c = TiffConnector(img_path, label_path, label_index_path=index_path,
+                          label_coordinates=True)
+        self.assertEqual(c._label_coordinates, {})
+        tile = c.label_tile(0, (0, 0, 0), c.image_dimensions(0)[1:], 2)
+        assert_array_equal(c.label_index_to_coordinate(0, 2, 0)[1:],
+                           np.transpose(np.nonzero(tile))[0])
+        self.assertEqual(len(c._label_coordinates), 1)
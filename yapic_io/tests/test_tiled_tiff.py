@@ -0,0 +1,91 @@
+from unittest import TestCase, mock
+import os
+import numpy as np
+from numpy.testing import assert_array_equal
+from bigtiff import Tiff
+import yapic_io.tiled_tiff as tiled_tiff
+import yapic_io.transformations as tf
+from yapic_io.cache import LRUCache
+
+base_path = os.path.dirname(__file__)
+
+
+class TestTiledTiff(TestCase):
+
+    def setUp(self):
+        # same pixels, tiled (16x16, deflate) and untiled
+        self.tiled_path = os.path.join(
+            base_path, '../test_data/tiffconnector_tiled/im/'
+                       '40width26height3slices_rgb.tif')
+        self.untiled_path = os.path.join(
+            base_path, '../test_data/tiffconnector_1/im/'
+                       '40width26height3slices_rgb.tif')
+
+    def test_is_tiled(self):
+        self.assertTrue(tiled_tiff.is_tiled(self.tiled_path))
+        self.assertFalse(tiled_tiff.is_tiled(self.untiled_path))
+
+    def test_open_tcz(self):
+        tiled = tiled_tiff.open_tcz(self.tiled_path)
+        untiled = Tiff.memmap_tcz(self.untiled_path)
+
+        self.assertEqual(tiled.shape, untiled.shape)
+        for idx in np.ndindex(tiled.shape):
+            self.assertEqual(tiled[idx].shape, untiled[idx].shape)
+            self.assertEqual(tiled[idx].dtype, untiled[idx].dtype)
+            assert_array_equal(np.asarray(tiled[idx]), untiled[idx])
+
+    def test_open_reads_no_tiles(self):
+        cache = LRUCache()
+        slices = tiled_tiff.open_tcz(self.tiled_path, cache=cache)
+        self.assertEqual(slices.shape, (1, 3, 3))
+        self.assertEqual(cache.misses, 0)
+        self.assertEqual(len(cache), 0)
+
+    def test_slicing(self):
+        cache = LRUCache()
+        plane = tiled_tiff.open_tcz(self.tiled_path, cache=cache)[0, 1, 2]
+        val = Tiff.memmap_tcz(self.untiled_path)[0, 1, 2]
+
+        # tiles are 16x16, plane is 26x40
+        assert_array_equal(plane[3:10, 5:12], val[3:10, 5:12])
+        self.assertEqual(cache.misses, 1)
+
+        assert_array_equal(plane[10:20, 14:35], val[10:20, 14:35])
+        self.assertEqual(cache.misses, 6)
+        self.assertEqual(cache.hits, 1)
+
+        assert_array_equal(plane[:, 30:], val[:, 30:])
+        assert_array_equal(plane.T, val.T)
+        self.assertEqual(plane[5:5, :].shape, (0, 40))
+
+    def test_read_without_pread(self):
+        # e.g. on windows, tiles are read with seek and read
+        val = Tiff.memmap_tcz(self.untiled_path)[0, 1, 2]
+        with mock.patch.object(tiled_tiff, 'HAS_PREAD', False), \
+                mock.patch.object(tiled_tiff.os, 'pread',
+                                  create=True) as pread:
+            plane = tiled_tiff.open_tcz(self.tiled_path)[0, 1, 2]
+            assert_array_equal(plane[10:20, 14:35], val[10:20, 14:35])
+        pread.assert_not_called()
+
+    def test_pyramid_levels(self):
+        # level 1 is embedded as 2x2 block means of the full resolution
+        for layout in ('im', 'subifds'):
+            path = os.path.join(base_path,
+                                '../test_data/tiffconnector_pyramid', layout,
+                                '40width26height3slices_rgb.tif')
+            self.assertTrue(tiled_tiff.has_level(path, 1))
+            self.assertFalse(tiled_tiff.has_level(path, 2))
+
+            full = tiled_tiff.open_tcz(path)
+            level = tiled_tiff.open_tcz(path, level=1)
+            self.assertEqual(level.shape, full.shape)
+            for idx in np.ndindex(level.shape):
+                self.assertEqual(level[idx].shape, (13, 20))
+                assert_array_equal(np.asarray(level[idx]),
+                                   tf.downsample_2d(full[idx]))
+
+        self.assertFalse(tiled_tiff.has_level(self.tiled_path, 1))
+        with self.assertRaises(ValueError):
+            tiled_tiff.open_tcz(self.tiled_path, level=1)
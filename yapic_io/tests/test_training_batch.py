@@ -1,5 +1,6 @@
 from unittest import TestCase
 import os
+import random
 from yapic_io.tiff_connector import TiffConnector
 from yapic_io.ilastik_connector import IlastikConnector
 from yapic_io.dataset import Dataset
@@ -88,6 +89,56 @@ class TestTrainingBatch(TestCase):
         p = mini._pixels
         self.assertTrue(np.issubdtype(p.dtype, np.float))
 
+    def test_native_dtype(self):
+        img_path = os.path.join(base_path,
+                                '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(base_path,
+                                  '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+
+        size = (1, 3, 3)
+        pad = (0, 2, 2)
+        batches = []
+        for native_dtype in (False, True):
+            d = Dataset(c, native_dtype=native_dtype)
+            m = TrainingBatch(d, size, padding_zxy=pad)
+            m.augment_by_rotation(True)
+
+            np.random.seed(42)
+            random.seed(42)
+            batches.append(next(m))
+            batches[-1].pixel_values = batches[-1].pixels()
+
+        float_batch, native_batch = batches
+        self.assertEqual(float_batch._pixels.dtype, np.float64)
+        self.assertEqual(native_batch._pixels.dtype, np.uint8)
+        self.assertEqual(native_batch.pixel_values.dtype, np.float32)
+        assert_array_equal(float_batch.pixel_values,
+                           native_batch.pixel_values)
+        np.random.seed(None)
+        random.seed(None)
+
+    def test_multiscale_pixels(self):
+        img_path = os.path.join(base_path,
+                                '../test_data/tiffconnector_1/im/')
+        label_path = os.path.join(base_path,
+                                  '../test_data/tiffconnector_1/labels/')
+        c = TiffConnector(img_path, label_path)
+        d = Dataset(c)
+
+        m = TrainingBatch(d, (1, 3, 3), padding_zxy=(0, 2, 2))
+        m.set_pixel_levels((1, 2))
+        mini = next(m)
+
+        pixels = mini.multiscale_pixels()
+        self.assertEqual(len(pixels), 3)
+        assert_array_equal(pixels[0], mini.pixels())
+        for level_pixels in pixels[1:]:
+            self.assertEqual(level_pixels.shape, mini.pixels().shape)
+
+        m.set_pixel_dimension_order('bzxyc')
+        self.assertEqual(mini.multiscale_pixels()[2].shape, (3, 1, 7, 7, 3))
+
     def test_random_tile(self):
 
         img_path = os.path.join(base_path,
@@ -1,3 +1,4 @@
+import itertools
 from unittest import TestCase
 import numpy as np
 import yapic_io.transformations as tf
@@ -197,3 +198,30 @@ class TestTransformations(TestCase):
         assert_array_equal(lr, lr_val)
         assert_array_equal(udlr, udlr_val)
         assert_array_equal(rot90, rot90val)
+
+    def test_flip_image_2d_stack_inverse(self):
+        im = np.arange(2 * 3 * 4 * 4).reshape((2, 3, 4, 4))
+
+        for fliplr, flipud, rot90 in itertools.product([True, False],
+                                                       [True, False],
+                                                       range(4)):
+            flipped = tf.flip_image_2d_stack(im, fliplr=fliplr,
+                                             flipud=flipud, rot90=rot90)
+            restored = tf.flip_image_2d_stack(flipped, fliplr=fliplr,
+                                              flipud=flipud, rot90=rot90,
+                                              inverse=True)
+            assert_array_equal(restored, im)
+
+    def test_downsample_2d(self):
+        image = np.array([[[0, 2, 4],
+                           [2, 4, 5],
+                           [1, 1, 9]]], dtype='uint8')
+
+        val = np.array([[[2, 5],
+                         [1, 9]]], dtype='uint8')
+        res = tf.downsample_2d(image)
+        assert_array_equal(res, val)
+        self.assertEqual(res.dtype, np.uint8)
+
+        res = tf.downsample_2d(image.astype(float))
+        assert_array_equal(res, [[[2., 4.5], [1., 9.]]])
@@ -2,6 +2,7 @@ from unittest import TestCase
 import yapic_io.utils as ut
 import numpy as np
 from numpy.testing import assert_array_equal
+from unittest import mock
 
 class TestUtils(TestCase):
 
@@ -191,3 +192,62 @@ class TestUtils(TestCase):
 
         pairs = ut.find_best_matching_pairs(a, b)
         self.assertEqual(pairs, val)
+
+    def test_find_best_matching_pairs_fast(self):
+        a = ['img_{}_ch0.tif'.format(i) for i in range(5000)] + ['x.tif']
+        b = ['lbl_{}_ch0.tif'.format(i) for i in range(4999, -1, -1)]
+        b = b + ['dir/x.tif']
+
+        with mock.patch('yapic_io.utils._hungarian_matches') as hungarian:
+            pairs = ut.find_best_matching_pairs(a, b)
+            hungarian.assert_not_called()
+
+        self.assertEqual(pairs[:2], [['img_0_ch0.tif', 'lbl_0_ch0.tif'],
+                                     ['img_1_ch0.tif', 'lbl_1_ch0.tif']])
+        self.assertEqual(pairs[-1], ['x.tif', 'dir/x.tif'])
+        self.assertTrue(all(p[0][4:] == p[1][-len(p[0]) + 4:]
+                            for p in pairs))
+
+    def test_find_best_matching_pairs_leftovers(self):
+        a = ['a_1.tif', 'a_2.tif', 'katze.tif', 'maus.tif']
+        b = ['b_2.tif', 'mauser.tif', 'b_1.tif', 'kater.tif', 'pferd.tif']
+        val = [['a_1.tif', 'b_1.tif'], ['a_2.tif', 'b_2.tif'],
+               ['katze.tif', 'kater.tif'], ['maus.tif', 'mauser.tif']]
+
+        with mock.patch('yapic_io.utils._hungarian_matches',
+                        wraps=ut._hungarian_matches) as hungarian:
+            pairs = ut.find_best_matching_pairs(a, b)
+            hungarian.assert_called_once_with(
+                ['katze.tif', 'maus.tif'], ['mauser.tif', 'kater.tif',
+                                            'pferd.tif'])
+        self.assertEqual(pairs, val)
+
+    def test_intersecting_chunks(self):
+        a = np.arange(7 * 9).reshape((7, 9))
+        chunks = {(i, j): a[i * 3:(i + 1) * 3, j * 4:(j + 1) * 4]
+                  for i in range(3) for j in range(3)}
+
+        pos = (2, 3)
+        size = (4, 5)
+        out = np.zeros(size, dtype=a.dtype)
+        idx = []
+        for chunk_idx, in_chunk, in_out in ut.intersecting_chunks(
+                pos, size, (3, 4)):
+            idx.append(chunk_idx)
+            out[in_out] = chunks[chunk_idx][in_chunk]
+
+        self.assertEqual(idx, [(0, 0), (0, 1), (1, 0), (1, 1)])
+        assert_array_equal(out, a[2:6, 3:8])
+
+    def test_quantize_probabilities(self):
+        p = np.array([[0, 0.2], [0.5, 1.]])
+
+        q = ut.quantize_probabilities(p, np.uint16)
+        self.assertEqual(q.dtype, np.uint16)
+        assert_array_equal(q, [[0, 13107], [32768, 65535]])
+
+        q = ut.quantize_probabilities(p, np.float16)
+        self.assertEqual(q.dtype, np.float16)
+        assert_array_equal(q, p.astype(np.float16))
+
+        self.assertIs(ut.quantize_probabilities(q, np.float16), q)
@@ -1,22 +1,34 @@
 import logging
 import os
 import collections
-from functools import lru_cache
+import copy
+import fnmatch
+from functools import lru_cache, partial
 import yapic_io.utils as ut
 import numpy as np
 import itertools
-import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from itertools import zip_longest
 from pathlib import Path
 from bigtiff import Tiff, PlaceHolder
-from yapic_io.connector import Connector
+import yapic_io.tiled_tiff as tiled_tiff
+import yapic_io.transformations as trafo
+from yapic_io.coordinate_connector import CoordinateConnector
+from yapic_io.cache import LRUCache, WriteBackBuffer
+from yapic_io.label_stats import LabelStatsIndex
 
 logger = logging.getLogger(os.path.basename(__file__))
 
 FilePair = collections.namedtuple('FilePair', ['img', 'lbl'])
 
+# number of threads for reading file headers
+HEADER_THREADS = 16
 
-def _handle_img_filenames(img_filepath):
+# data types supported for writing probability maps
+PROBMAP_DTYPES = ('float32', 'float16', 'uint8', 'uint16')
+
+
+def _handle_img_filenames(img_filepath, filemask='*.tif'):
     '''
     - checks if list of image filepaths, a single wildcard filepath
       or a single filepath without a wildcard is given.
@@ -26,33 +38,37 @@ def _handle_img_filenames(img_filepath):
 
     if type(img_filepath) in (str, Path):
         img_filepath = Path(img_filepath).expanduser()
-        img_filemask = '*.tif' if img_filepath.is_dir() else img_filepath.name
+        img_filemask = filemask if img_filepath.is_dir() \
+            else img_filepath.name
 
         folder = img_filepath if img_filepath.is_dir() else img_filepath.parent
-        filenames = [fname.name for fname in sorted(folder.glob(img_filemask))]
+        # a single directory scan, also for very large folders
+        names = os.listdir(str(folder)) if folder.is_dir() else []
+        filenames = sorted(name for name in fnmatch.filter(names, img_filemask)
+                           if not name.startswith('.'))
 
     elif type(img_filepath) in (list, tuple):
 
-        img_filenames = img_filepath
-        img_filenames = [Path(p).expanduser().resolve()
-                         if p is not None else None
+        img_filenames = [Path(p).expanduser() if p is not None else None
                          for p in img_filepath]
 
         assert len(img_filenames) > 0, 'list of image filenames is empty'
 
-        for e in img_filenames:
-            if e is not None:
-                assert e.exists(), 'file {} not found'.format(e)
-
         folders = {fname.parent
                    for fname in img_filenames if fname is not None}
+        folders = {folder.resolve() for folder in folders}
         assert len(folders) == 1, 'image filenames are not in the same folder'
         folder = next(iter(folders))
-        folder = folder.expanduser().resolve()
         filenames = [fname.name
                      if fname is not None else None
                      for fname in img_filenames]
 
+        # check existence with a single directory scan
+        existing = set(os.listdir(str(folder))) if folder.is_dir() else set()
+        for e in filenames:
+            if e is not None:
+                assert e in existing, 'file {} not found'.format(folder / e)
+
     else:
         raise NotImplementedError(
             'could not import images from {}'.format(img_filepath))
@@ -61,7 +77,203 @@ def _handle_img_filenames(img_filepath):
     return folder, filenames
 
 
-class TiffConnector(Connector):
+def _label_value_counts(slices):
+    '''
+    Count label values of a memmapped label image for each label channel.
+    Unlabeled pixels (value 0) are not counted.
+
+    Each z-slice is read exactly once and accumulated into a histogram,
+    thus memory is bounded to one slice also for large 3D label images.
+    '''
+    T = 0
+    C = slices.shape[1]
+    return [_label_value_counts_for_channel(slices[T, c, :])
+            for c in range(C)]
+
+
+def _label_value_counts_for_channel(planes):
+    hist = np.zeros(0, dtype=np.int64)
+    other_counts = collections.Counter()
+
+    for s in planes:
+        s = np.asarray(s)
+        if s.dtype.kind in 'ub' and s.dtype.itemsize <= 2:
+            # small unsigned types: histogram over the whole value range
+            h = np.bincount(s.ravel())
+            if len(h) > len(hist):
+                hist, h = h, hist
+            hist[:len(h)] += h
+        else:
+            values, counts = np.unique(s, return_counts=True)
+            other_counts.update(dict(zip(values.tolist(), counts.tolist())))
+
+    other_counts.update({l: count for l, count in enumerate(hist.tolist())
+                         if count > 0})
+
+    return {int(l): int(count) for l, count in other_counts.items()
+            if l > 0 and count > 0}
+
+
+def _mapped_nbytes(slices):
+    '''
+    Total size of all memmapped planes of a tcz array of planes.
+    '''
+    return sum(s.nbytes for s in slices.flat if isinstance(s, np.ndarray))
+
+
+def _open_tcz(path, tile_cache=None):
+    '''
+    Open a tiff file as tcz array of 2d planes. Strip based files are
+    memmapped, tiled files are read tile by tile on access.
+    '''
+    if tiled_tiff.is_tiled(path):
+        return tiled_tiff.open_tcz(path, cache=tile_cache)
+    return Tiff.memmap_tcz(path)
+
+
+def _open_level_tcz(path, level, tile_cache=None):
+    '''
+    Open an embedded pyramid level of a tiff file as tcz array of 2d
+    planes. Returns None if the file holds no such level (only tiled
+    files can hold pyramid levels).
+    '''
+    if tiled_tiff.is_tiled(path) and tiled_tiff.has_level(path, level):
+        return tiled_tiff.open_tcz(path, cache=tile_cache, level=level)
+    return None
+
+
+def _downsample_tcz(slices):
+    '''
+    Downsample all planes of a tcz array by a factor of 2 in x and y.
+    '''
+    downsampled = np.empty(slices.shape, dtype=object)
+    for idx, plane in np.ndenumerate(slices):
+        downsampled[idx] = trafo.downsample_2d(plane)
+    return downsampled
+
+
+def _read_tiff_header(path):
+    '''
+    Read shape (C, Z, Y, X) and data type of a tiff file from the header
+    of its first image. Shapes of tiled files are taken from the layout
+    of their image file directories, other files without ImageJ metadata
+    are memmapped.
+    '''
+    with open(str(path), 'rb') as f:
+        first_image = next(iter(Tiff.from_fd(f)))
+        description = first_image.tags.get('image_description')
+        if description is not None and 'ImageJ=' in description[0].string:
+            axes = first_image.axes
+            shape = (axes.get('C', 1), axes.get('Z', 1), axes['Y'],
+                     axes['X'])
+            return shape, first_image.dtype
+
+    if tiled_tiff.is_tiled(path):
+        return tiled_tiff.read_header(path)
+
+    slices = Tiff.memmap_tcz(path)
+    return slices.shape[1:] + slices[0, 0, 0].shape, slices[0, 0, 0].dtype
+
+
+def _label_value_coordinates(slices):
+    '''
+    Index the coordinates of all labels of a memmapped label image for
+    each label channel. Unlabeled pixels (value 0) are not indexed.
+
+    Each z-slice is read exactly once. Coordinates are stored as sorted
+    flat offsets into the (Z, X, Y) label volume (int32 if possible).
+
+    Returns
+    -------
+    list
+        List of dicts, one per label channel, mapping original label
+        values to arrays of flat offsets.
+    '''
+    T = 0
+    _, C, Z = slices.shape
+    Y, X = slices[T, 0, 0].shape
+    dtype = np.int32 if Z * X * Y < 2**31 else np.int64
+
+    index = []
+    for c in range(C):
+        offsets = collections.defaultdict(list)
+        for z, s in enumerate(slices[T, c, :]):
+            s = np.asarray(s).T.ravel()
+            idx = np.flatnonzero(s)
+            if len(idx) == 0:
+                continue
+
+            # group offsets by label value, keeping them sorted
+            order = np.argsort(s[idx], kind='mergesort')
+            values, starts = np.unique(s[idx][order], return_index=True)
+            for value, o in zip(values.tolist(),
+                                np.split(idx[order], starts[1:])):
+                offsets[value].append((o + z * X * Y).astype(dtype))
+
+        index.append({int(l): np.concatenate(o)
+                      for l, o in offsets.items() if l > 0})
+
+    return index
+
+
+def _coordinate_counts(index):
+    '''
+    Label value counts of a label coordinate index.
+    '''
+    return [{l: len(offsets) for l, offsets in channel.items()}
+            for channel in index]
+
+
+def _compact_label_channels(channels):
+    '''
+    Encode label channels of shape (Z, X, Y) compactly.
+
+    Each voxel holds the index of its label value in the sorted label
+    values of its channel, stored in the smallest sufficient unsigned
+    integer dtype (usually uint8).
+
+    Returns
+    -------
+    ranks, values
+        Array of label value indices with shape (C, Z, X, Y) and list of
+        sorted label values per channel.
+    '''
+    # label values and ranks are computed plane by plane, thus no
+    # temporary array of the size of the label volume is allocated
+    values = []
+    for channel in channels:
+        channel_values = np.unique(channel[0])
+        for plane in channel[1:]:
+            channel_values = np.union1d(channel_values, np.unique(plane))
+        values.append(channel_values)
+
+    n_max = max(len(v) for v in values)
+    dtype = np.min_scalar_type(n_max - 1)
+
+    ranks = np.empty((len(channels),) + channels[0].shape, dtype=dtype)
+    for rank, channel, channel_values in zip(ranks, channels, values):
+        for rank_plane, plane in zip(rank, channel):
+            rank_plane[...] = np.searchsorted(channel_values, plane)
+
+    return ranks, values
+
+
+def _scan_label_file(connector_class, path, coordinates=False):
+    '''
+    Count label values of a label file opened by a connector class (used
+    by worker processes). Returns the label coordinate index instead if
+    `coordinates` is True.
+    '''
+    slices = connector_class._open_tcz(path)
+    try:
+        if coordinates:
+            return _label_value_coordinates(slices)
+        return _label_value_counts(slices)
+    finally:
+        connector_class._close_tcz(slices)
+
+
+class TiffConnector(CoordinateConnector):
     '''
     Implementation of Connector for tiff images up to 4 dimensions and
     corresponding label masks up to 4 dimensions in tiff format.
@@ -77,6 +289,65 @@ class TiffConnector(Connector):
     savepath : str, optional
         Directory to save pixel classifiaction results as probability
         images.
+    label_index_path : str, optional
+        Path to a json file for persisting label statistics (see
+        yapic_io.label_stats.LabelStatsIndex). Label files that did not
+        change since the last run are not scanned again at startup.
+    workers : int, optional
+        Number of worker processes for scanning label files. By default
+        label files are scanned sequentially.
+    max_open_files : int, optional
+        Maximum number of memmapped image, label and probability map
+        files kept open at the same time.
+    max_mapped_bytes : int, optional
+        Maximum total size of all memmapped files kept open. Unlimited
+        by default.
+    label_cache_bytes : int, optional
+        Memory budget for keeping decoded label images in RAM. Labels
+        are stored compactly as uint8 indices of label values (for less
+        than 256 label values per channel), thus label tiles are sliced
+        from memory instead of being read from disk. Least recently used
+        label images are dropped if the budget is exceeded.
+        Disabled by default.
+    tile_cache_bytes : int, optional
+        Memory budget for decoded tiles of tiled tiff files (256 MB by
+        default). Tiled tiff files cannot be memmapped, instead only the
+        tiles intersecting with a requested region are read and decoded.
+    write_buffer_bytes : int, optional
+        Memory budget for buffering probability map tiles written with
+        put_tile. Tiles are assembled to complete z-slices in RAM, which
+        are written at once. Z-slices larger than the budget are
+        assembled in bands of rows instead. Partial slices are written
+        when the budget is exceeded and on ``flush()`` or ``close()``.
+        By default all tiles are written to disk immediately.
+    probmap_layout : {'per_label', 'multichannel'}, optional
+        'per_label' writes probability maps to one file per image and
+        label (``<image>_class_<label>.tif``). 'multichannel' writes
+        all labels of an image to one hyperstack (``<image>_classes.tif``)
+        with the probability map of label value `l` in channel `l - 1`.
+    probmap_dtype : {'float32', 'float16', 'uint8', 'uint16'}, optional
+        Data type of probability maps. For uint8 and uint16,
+        probabilities are scaled from [0, 1] to the full integer range
+        (e.g. 255 corresponds to probability 1 for uint8).
+    lazy_validation : bool, optional
+        If True, label matrix dimensions of an image are checked on
+        first access of the image instead of checking all images at
+        construction. Label file headers are then read on demand only.
+    label_coordinates : bool, optional
+        If True, the coordinates of all labels are indexed while
+        scanning label files, as sorted flat offsets per image and label
+        value. Dataset then samples training tiles by label coordinates
+        (see label_index_to_coordinate) instead of random polling,
+        which hits sparse labels in large images on the first try.
+        Images with label counts taken from the label stats index are
+        indexed on first access.
+    pyramid_path : str, optional
+        Directory for storing generated resolution levels of images
+        (see get_tile). Levels are read from embedded pyramids of tiled
+        tiff files if present, otherwise they are generated once by
+        downsampling and stored as tiff files in this directory, to be
+        reused by later runs. By default generated levels are kept in
+        RAM (in the pool of open files).
 
     Notes
     -----
@@ -108,9 +379,21 @@ class TiffConnector(Connector):
     yapic_io.ilastik_connector.IlastikConnector
     '''
 
-    def __init__(self, img_filepath, label_filepath, savepath=None):
-
-        self.img_path, img_filenames = _handle_img_filenames(img_filepath)
+    # file mask for images and labels in directories
+    filemask = '*.tif'
+    # file extension of probability maps
+    probmap_extension = '.tif'
+
+    def __init__(self, img_filepath, label_filepath, savepath=None,
+                 label_index_path=None, workers=None, max_open_files=30,
+                 max_mapped_bytes=None, label_cache_bytes=None,
+                 tile_cache_bytes=2**28, write_buffer_bytes=None,
+                 probmap_layout='per_label', probmap_dtype='float32',
+                 lazy_validation=False, label_coordinates=False,
+                 pyramid_path=None):
+
+        self.img_path, img_filenames = _handle_img_filenames(
+            img_filepath, filemask=self.filemask)
         self.label_path, lbl_filenames = self._handle_lbl_filenames(
             label_filepath)
 
@@ -130,15 +413,63 @@ class TiffConnector(Connector):
                               for pair in self.filenames))
 
         self.savepath = Path(savepath) if savepath is not None else None
+        self.pyramid_path = Path(pyramid_path) \
+            if pyramid_path is not None else None
+        self.workers = workers
+
+        if probmap_layout not in ('per_label', 'multichannel'):
+            raise ValueError(
+                'Unknown probability map layout {}'.format(probmap_layout))
+        self.probmap_layout = probmap_layout
+
+        self.probmap_dtype = np.dtype(probmap_dtype)
+        if self.probmap_dtype.name not in PROBMAP_DTYPES:
+            raise ValueError(
+                'Unsupported probability map dtype {}'.format(probmap_dtype))
+
+        # memmapping is slow, thus memmapped image, label and probability
+        # map files are kept open in a pool shared by all kinds of files
+        self.handle_pool = LRUCache(max_items=max_open_files,
+                                    max_bytes=max_mapped_bytes,
+                                    on_evict=self._close_tcz)
+        self.label_cache = LRUCache(max_bytes=label_cache_bytes) \
+            if label_cache_bytes else None
+        self.tile_cache = LRUCache(max_bytes=tile_cache_bytes)
+        self.write_buffer = WriteBackBuffer(
+            self._write_probability_map_plane, max_bytes=write_buffer_bytes) \
+            if write_buffer_bytes else None
+
+        # shapes (C, Z, X, Y) and dtypes of image and label files read
+        # from headers
+        self._shapes = {}
+        self._dtypes = {}
+        self._read_shapes(self.img_path / img for img, _ in self.filenames)
+
+        # indices of images with checked label matrix dimensions
+        self._validated = set()
+        self._n_label_channels = None
+        self.lazy_validation = lazy_validation
+
+        # original label value counts per label file
+        self._label_stats = {}
+        # label coordinate indices per label file
+        self.label_coordinates = label_coordinates
+        self._label_coordinates = {}
+        self.label_index = LabelStatsIndex(label_index_path) \
+            if label_index_path is not None else None
 
         original_labels = self.original_label_values_for_all_images()
         self.labelvalue_mapping = self.calc_label_values_mapping(
                                             original_labels)
 
-        self.check_label_matrix_dimensions()
+        if self.label_index is not None:
+            self.label_index.save()
+
+        if not lazy_validation:
+            self.check_label_matrix_dimensions()
 
     def _handle_lbl_filenames(self, label_filepath):
-        return _handle_img_filenames(label_filepath)
+        return _handle_img_filenames(label_filepath, filemask=self.filemask)
 
     def __repr__(self):
 
@@ -153,54 +484,51 @@ class TiffConnector(Connector):
                                             self.labelvalue_mapping)
         return infostring
 
-    def filter_labeled(self):
+    def _subset(self, image_nrs):
         '''
-        Removes images without labels.
+        Connector for a subset of the images (a view).
+
+        The subset shares open files, label statistics, file shapes and
+        caches with this connector, thus no files are opened or scanned.
+        The labelvalue mapping is kept.
+
+        Parameters
+        ----------
+        image_nrs : list of int
+            Indices of the images of the subset.
 
         Returns
         -------
         TiffConnector
-            Connector object containing only images with labels.
+            Connector of the same type containing the selected images.
         '''
-        img_fnames = [self.img_path / img for img, lbl in self.filenames
-                      if lbl is not None]
-
-        lbl_fnames = [self.label_path / lbl
-                      for img, lbl in self.filenames
-                      if lbl is not None]
-
-        return TiffConnector(img_fnames, lbl_fnames, savepath=self.savepath)
-
-    def _split_img_fnames(self, fraction, random_seed=42):
-        # i took this out from the split method to be used in split method
-        # of child methods (e.g. IlasikConnector)
-        N = len(self.filenames)
+        subset = copy.copy(self)
+        subset.filenames = [self.filenames[i] for i in image_nrs]
+        subset._validated = {i for i, image_nr in enumerate(image_nrs)
+                             if image_nr in self._validated}
 
-        state = np.random.get_state()
-        np.random.seed(random_seed)
-        mask = np.random.choice([True, False], size=N, p=[
-                                1 - fraction, fraction])
-        np.random.set_state(state)
+        # buffered planes are keyed by image index
+        if self.write_buffer is not None:
+            subset.write_buffer = WriteBackBuffer(
+                subset._write_probability_map_plane,
+                max_bytes=self.write_buffer.max_bytes)
 
-        img_fnames1 = [self.img_path / img
-                       for img, lbl in itertools.compress(self.filenames,
-                                                          mask)]
+        return subset
 
-        img_fnames2 = [self.img_path / img
-                       for img, lbl in itertools.compress(self.filenames,
-                                                          ~mask)]
-
-        if len(img_fnames1) == 0:
-            msg = ('TiffConnector.split({}): ' +
-                   'First connector is empty!').format(fraction)
-            warnings.warn(msg)
+    def filter_labeled(self):
+        '''
+        Removes images without labels.
 
-        if len(img_fnames2) == 0:
-            msg = ('TiffConnector.split({}): ' +
-                   'Second connector is empty!').format(fraction)
-            warnings.warn(msg)
+        The returned connector is a view sharing open files and caches
+        with this connector.
 
-        return img_fnames1, img_fnames2, mask
+        Returns
+        -------
+        TiffConnector
+            Connector object containing only images with labels.
+        '''
+        return self._subset([i for i, (img, lbl) in enumerate(self.filenames)
+                             if lbl is not None])
 
     def split(self, fraction, random_seed=42):
         '''
@@ -209,6 +537,10 @@ class TiffConnector(Connector):
         The first of size `(1-fraction)*N_images`, the other of size
         `fraction*N_images`
 
+        Both connectors are views sharing open files, label statistics
+        and caches with this connector, thus splitting does not read
+        any files. Both keep the labelvalue mapping of this connector.
+
         Parameters
         ----------
         fraction : float
@@ -218,74 +550,268 @@ class TiffConnector(Connector):
         -------
         connector_1, connector_2
         '''
+        image_nrs1, image_nrs2 = ut.split_image_nrs(
+            self.image_count(), fraction, random_seed=random_seed)
+
+        return self._subset(image_nrs1), self._subset(image_nrs2)
+
+    def image_count(self):
+        return len(self.filenames)
+
+    def _memmap(self, kind, path, create=None):
+        '''
+        Get the planes of a tiff file from the handle pool.
+        '''
+        def load():
+            if create is not None and not path.exists():
+                create()
+            logger.debug('Opening %s', path)
+            return self._open_tcz(path, tile_cache=self.tile_cache,
+                                  writable=kind == 'probability_map')
 
-        img_fnames1, img_fnames2, mask = self._split_img_fnames(
-                                                fraction,
-                                                random_seed=random_seed)
+        return self.handle_pool.get((kind, path), load, _mapped_nbytes)
 
-        lbl_fnames1 = [self.label_path / lbl if lbl is not None else None
-                       for img, lbl in itertools.compress(self.filenames,
-                                                          mask)]
-        lbl_fnames2 = [self.label_path / lbl if lbl is not None else None
-                       for img, lbl in itertools.compress(self.filenames,
-                                                          ~mask)]
+    @classmethod
+    def _open_tcz(cls, path, tile_cache=None, writable=False):
+        '''
+        Open an image, label or probability map file as tcz array of 2d
+        planes.
 
-        conn1 = TiffConnector(img_fnames1, lbl_fnames1, savepath=self.savepath)
-        conn2 = TiffConnector(img_fnames2, lbl_fnames2, savepath=self.savepath)
+        Connectors for other file formats overload this method together
+        with _open_level_tcz, _read_header and _close_tcz.
+        '''
+        return _open_tcz(path, tile_cache=tile_cache)
 
-        # ensures that both resulting tiff_connectors have the same
-        # labelvalue mapping (issue #1)
-        conn1.labelvalue_mapping = self.labelvalue_mapping
-        conn2.labelvalue_mapping = self.labelvalue_mapping
+    @classmethod
+    def _open_level_tcz(cls, path, level, tile_cache=None):
+        '''
+        Open an embedded pyramid level of an image file as tcz array of
+        2d planes. Returns None if the file holds no such level.
+        '''
+        return _open_level_tcz(path, level, tile_cache=tile_cache)
 
-        # np.random.seed(None)
-        return conn1, conn2
+    @classmethod
+    def _read_header(cls, path):
+        '''
+        Read shape (C, Z, Y, X) and data type of an image or label file
+        from file headers only, without opening or memmapping the image
+        data.
+        '''
+        return _read_tiff_header(path)
 
-    def image_count(self):
-        return len(self.filenames)
+    @classmethod
+    def _close_tcz(cls, slices):
+        '''
+        Release a tcz array of planes opened by _open_tcz when it is
+        dropped from the pool of open files. Memmaps are closed by
+        garbage collection.
+        '''
+        pass
+
+    def _create_probability_map_file(self, path, image_nr, n_channels):
+        '''
+        Create an empty probability map file with `n_channels` channels
+        for an image. Placeholder planes are written as holes, thus the
+        file is sparse.
+        '''
+        T = 1
+        _, Z, X, Y = self.image_dimensions(image_nr)
+        images = [PlaceHolder((Y, X, 1), self.probmap_dtype)] * \
+            (n_channels * Z)
+        Tiff.write(images, io=str(path), imagej_shape=(T, n_channels, Z))
 
-    @lru_cache(maxsize=10)
     def _open_probability_map_file(self, image_nr, label_value):
-        # memmap is slow, so we must cache it to be fast!
         fname = self.filenames[image_nr].img
-        fname = Path('{}_class_{}.tif'.format(fname.stem, label_value))
+        fname = Path('{}_class_{}{}'.format(
+            fname.stem, label_value, self.probmap_extension))
 
         path = self.savepath / fname
 
-        if not path.exists():
-            T = 1
-            C = 1
-            _, Z, X, Y = self.image_dimensions(image_nr)
-            images = [PlaceHolder((Y, X, 1), 'float32')] * Z
-            Tiff.write(images, io=str(path), imagej_shape=(T, C, Z))
+        def create():
+            self._create_probability_map_file(path, image_nr, 1)
+
+        return self._memmap('probability_map', path, create=create)
+
+    def _open_multichannel_probability_map_file(self, image_nr,
+                                                n_channels=1):
+        fname = self.filenames[image_nr].img
+        fname = Path('{}_classes{}'.format(fname.stem,
+                                           self.probmap_extension))
 
-        return Tiff.memmap_tcz(path)
+        path = self.savepath / fname
+
+        def create():
+            # one channel per label
+            C = max(n_channels, sum(len(m) for m in self.labelvalue_mapping))
+            self._create_probability_map_file(path, image_nr, C)
+
+        return self._memmap('probability_map', path, create=create)
+
+    def _probability_map_plane(self, image_nr, label_value, z):
+        '''
+        Get the memmapped z-slice of the probability map of a label.
+        '''
+        if self.probmap_layout == 'per_label':
+            return self._open_probability_map_file(image_nr, label_value)[
+                        0, 0, z]
+
+        slices = self._open_multichannel_probability_map_file(
+                    image_nr, n_channels=label_value)
+        C = label_value - 1
+        if C >= slices.shape[1]:
+            msg = 'Probability map of image {} has no channel for label {}'
+            raise ValueError(msg.format(image_nr, label_value))
+        return slices[0, C, z]
 
     def put_tile(self, pixels, pos_zxy, image_nr, label_value):
         assert self.savepath is not None
         np.testing.assert_equal(len(pos_zxy), 3)
         np.testing.assert_equal(len(pixels.shape), 3)
-        pixels = np.array(pixels, dtype=np.float32)
+        pixels = ut.quantize_probabilities(pixels, self.probmap_dtype)
 
-        slices = self._open_probability_map_file(image_nr, label_value)
-
-        T = C = 0
         Z, X, Y = pos_zxy
         ZZ, XX, YY = np.array(pos_zxy) + pixels.shape
+
+        _, _, size_x, size_y = self.image_dimensions(image_nr)
+        rows = 0 if self.write_buffer is None else \
+            self.write_buffer.band_rows((size_y, size_x), self.probmap_dtype)
+        if rows > 0:
+            # buffer the tile in bands of rows starting at multiples of rows
+            for start in range(Y - Y % rows, YY, rows):
+                stop = min(start + rows, size_y)
+                Y0, Y1 = max(Y, start), min(YY, stop)
+                for z in range(Z, ZZ):
+                    self.write_buffer.put(
+                        (image_nr, label_value, z, start),
+                        (stop - start, size_x),
+                        (slice(Y0 - start, Y1 - start), slice(X, XX)),
+                        pixels[z - Z, :, Y0 - Y:Y1 - Y].T,
+                        dtype=self.probmap_dtype)
+            return
+
         for z in range(Z, ZZ):
-            slices[T, C, z][Y:YY, X:XX] = pixels[z - Z, ...].T
+            plane = self._probability_map_plane(image_nr, label_value, z)
+            plane[Y:YY, X:XX] = pixels[z - Z, ...].T
+
+    def put_tiles(self, pixels, pos_zxy, image_nr, label_values):
+        assert self.savepath is not None
+        np.testing.assert_equal(len(pixels), len(label_values))
+        pixels = ut.quantize_probabilities(pixels, self.probmap_dtype)
+
+        if self.probmap_layout == 'multichannel':
+            # create the file with channels for all labels at once
+            self._open_multichannel_probability_map_file(
+                image_nr, n_channels=max(label_values))
+
+        for label_pixels, label_value in zip(pixels, label_values):
+            self.put_tile(label_pixels, pos_zxy, image_nr, label_value)
+
+    def _write_probability_map_plane(self, key, plane, mask):
+        '''
+        Write a band of rows of a probability map z-slice from the write
+        buffer.
+        '''
+        image_nr, label_value, z, start = key
+        target = self._probability_map_plane(image_nr, label_value, z)
+        rows = slice(start, start + plane.shape[0])
+        if mask is None:
+            target[rows, :] = plane
+        elif isinstance(target, np.ndarray):
+            np.copyto(target[rows], plane, where=mask)
+        else:
+            target[rows, :] = np.where(mask, plane, target[rows, :])
 
-    @lru_cache(maxsize=10)
-    def _open_image_file(self, image_nr):
-        # memmap is slow, so we must cache it to be fast!
+    def flush(self):
+        '''
+        Write all buffered probability map tiles to disk.
+        '''
+        if self.write_buffer is not None:
+            self.write_buffer.flush()
+
+    def close(self):
+        '''
+        Write all buffered probability map tiles and close all open files.
+        '''
+        self.flush()
+        self.handle_pool.clear()
+
+    def _open_image_file(self, image_nr, level=0):
         path = self.img_path / self.filenames[image_nr].img
-        return Tiff.memmap_tcz(path)
+        if level == 0:
+            return self._memmap('image', path)
+
+        def load():
+            slices = self._open_level_tcz(path, level,
+                                          tile_cache=self.tile_cache)
+            if slices is None:
+                slices = self._generate_level(image_nr, level)
+            return slices
 
-    def image_dimensions(self, image_nr):
+        return self.handle_pool.get(('image_level_{}'.format(level), path),
+                                    load, _mapped_nbytes)
 
-        img = self._open_image_file(image_nr)
-        Y, X = img[0, 0, 0].shape
-        return np.hstack([img.shape[1:], (X, Y)])
+    def _generate_level(self, image_nr, level):
+        '''
+        Downsample the next higher resolution level of an image. The
+        result is stored in pyramid_path if given.
+        '''
+        if self.pyramid_path is None:
+            return _downsample_tcz(self._open_image_file(image_nr, level - 1))
+
+        name = '{}_level{}.tif'.format(self.filenames[image_nr].img.name,
+                                       level)
+        path = self.pyramid_path / name
+        if not path.exists():
+            logger.info('Generating resolution level %s of %s', level,
+                        self.filenames[image_nr].img)
+            slices = _downsample_tcz(self._open_image_file(image_nr,
+                                                           level - 1))
+            _, C, Z = slices.shape
+
+            # the file is written to a temporary path first to never
+            # leave an incomplete level
+            tmp_path = path.with_name('{}.{}.tmp'.format(name, os.getpid()))
+            Tiff.write([slices[0, c, z][..., np.newaxis]
+                        for z in range(Z) for c in range(C)],
+                       io=str(tmp_path), imagej_shape=(1, C, Z))
+            os.replace(str(tmp_path), str(path))
+
+        return _open_tcz(path, tile_cache=self.tile_cache)
+
+    def _read_shapes(self, paths):
+        '''
+        Read shapes of several files from their headers in parallel
+        threads (file headers are usually read from network storage).
+        '''
+        paths = [p for p in paths if p not in self._shapes]
+        if len(paths) == 0:
+            return
+
+        with ThreadPoolExecutor(max_workers=HEADER_THREADS) as executor:
+            for path, ((C, Z, Y, X), dtype) in zip(
+                    paths, executor.map(self._read_header, paths)):
+                self._shapes[path] = (C, Z, X, Y)
+                self._dtypes[path] = np.dtype(dtype).newbyteorder('=')
+
+    def _shape(self, path):
+        if path not in self._shapes:
+            self._read_shapes([path])
+        return self._shapes[path]
+
+    def image_dimensions(self, image_nr, level=0):
+        if level > 0:
+            slices = self._open_image_file(image_nr, level)
+            Y, X = slices[0, 0, 0].shape
+            return np.array(slices.shape[1:] + (X, Y))
+
+        path = self.img_path / self.filenames[image_nr].img
+        return np.array(self._shape(path))
+
+    def pixel_dtype(self, image_nr):
+        path = self.img_path / self.filenames[image_nr].img
+        if path not in self._dtypes:
+            self._read_shapes([path])
+        return self._dtypes[path]
 
     def label_matrix_dimensions(self, image_nr):
         '''
@@ -302,12 +828,11 @@ class TiffConnector(Connector):
         (nr_channels, nr_zslices, nr_x, nr_y)
             Labelmatrix shape.
         '''
-        lbl = self._open_label_file(image_nr)
-        if lbl is None:
+        label_filename = self.filenames[image_nr].lbl
+        if label_filename is None:
             return
 
-        Y, X = lbl[0, 0, 0].shape
-        return np.hstack([lbl.shape[1:], (X, Y)])
+        return np.array(self._shape(self.label_path / label_filename))
 
     def check_label_matrix_dimensions(self):
         '''
@@ -319,30 +844,42 @@ class TiffConnector(Connector):
         AssertionError
             If label matrix dimensions don't fit to image dimensions.
         '''
-        N_channels = None
+        self._read_shapes(self.label_path / lbl
+                          for _, lbl in self.filenames if lbl is not None)
+
+        for image_nr in range(self.image_count()):
+            self._check_label_matrix_dimensions(image_nr)
 
-        for i, (img_fname, lbl_fname) in enumerate(self.filenames):
-            img_dim = self.image_dimensions(i)
-            lbl_dim = self.label_matrix_dimensions(i)
+    def _check_label_matrix_dimensions(self, image_nr):
+        '''
+        Check label matrix dimensions of one image (see
+        check_label_matrix_dimensions).
+        '''
+        if image_nr in self._validated:
+            return
 
-            msg = 'Dimensions for image #{}: img.shape={}, lbl.shape={}'
-            logger.debug(msg.format(i, img_dim, lbl_dim))
+        img_fname, lbl_fname = self.filenames[image_nr]
+        img_dim = self.image_dimensions(image_nr)
+        lbl_dim = self.label_matrix_dimensions(image_nr)
 
-            if lbl_dim is None:
-                continue
+        msg = 'Dimensions for image #{}: img.shape={}, lbl.shape={}'
+        logger.debug(msg.format(image_nr, img_dim, lbl_dim))
 
+        if lbl_dim is not None:
             _,  *img_dim = img_dim
             ch, *lbl_dim = lbl_dim
 
-            if N_channels is None:
-                N_channels = ch
+            if self._n_label_channels is None:
+                self._n_label_channels = ch
 
             msg = 'Label channels inconsistent for {}'.format(lbl_fname)
-            np.testing.assert_equal(N_channels, ch, msg)
+            np.testing.assert_equal(self._n_label_channels, ch, msg)
             msg = 'Invalid image dims for {} and {}'.format(img_fname,
                                                             lbl_fname)
             np.testing.assert_array_equal(lbl_dim, img_dim, msg)
 
+        self._validated.add(image_nr)
+
     def _mapped_label_value_to_original(self, label_value):
         '''
         self.labelvalue_mapping in reverse
@@ -356,41 +893,115 @@ class TiffConnector(Connector):
         msg = 'Should not be reached! (mapped_label_value={}, mapping={})'
         raise Exception(msg.format(label_value, self.labelvalue_mapping))
 
-    def get_tile(self, image_nr, pos, size):
+    def get_tile(self, image_nr, pos, size, out=None, level=0):
         T = 0
         C, Z, X, Y = pos
         CC, ZZ, XX, YY = np.array(pos) + size
 
-        slices = self._open_image_file(image_nr)
-        tile = [[s[Y:YY, X:XX] for s in c[Z:ZZ]] for c in slices[T, C:CC, :]]
-        tile = np.stack(tile)
-        tile = np.moveaxis(tile, (0, 1, 2, 3), (0, 1, 3, 2))
+        if out is None:
+            out = np.empty(size, dtype='float')
+        np.testing.assert_array_equal(out.shape, size)
+        self._check_label_matrix_dimensions(image_nr)
 
-        return tile.astype('float')
+        # slices are stored in yx order, they are copied (and converted)
+        # directly into the output buffer
+        slices = self._open_image_file(image_nr, level)
+        for out_c, c in zip(out, slices[T, C:CC, :]):
+            for out_z, s in zip(out_c, c[Z:ZZ]):
+                out_z[...] = s[Y:YY, X:XX].T
+
+        return out
 
     def label_tile(self, image_nr, pos_zxy, size_zxy, label_value):
+        return self.label_tiles(image_nr, pos_zxy, size_zxy, [label_value])[0]
+
+    def label_tiles(self, image_nr, pos_zxy, size_zxy, label_values):
+        '''
+        Get boolean masks of several labels. Each label channel is read
+        only once, regardless of the number of requested labels.
+
+        dimension order: (label, z, x, y)
+        '''
+        self._check_label_matrix_dimensions(image_nr)
+
+        if self.label_cache is not None:
+            return self._cached_label_tiles(image_nr, pos_zxy, size_zxy,
+                                            label_values)
 
         T = 0
         Z, X, Y = pos_zxy
         ZZ, XX, YY = np.array(pos_zxy) + size_zxy
-        C, original_label_value = self._mapped_label_value_to_original(
-                                        label_value)
+
+        tiles = np.zeros((len(label_values),) + tuple(size_zxy), dtype=bool)
 
         slices = self._open_label_file(image_nr)
         if slices is None:
             # return tile with False values
-            return np.zeros(size_zxy) != 0
-        tile = [s[Y:YY, X:XX] for s in slices[T, C, Z:ZZ]]
-        tile = np.stack(tile)
-        tile = np.moveaxis(tile, (0, 1, 2), (0, 2, 1))
+            return tiles
+
+        originals = [self._mapped_label_value_to_original(label_value)
+                     for label_value in label_values]
+
+        for C in sorted({c for c, _ in originals}):
+            tile = [s[Y:YY, X:XX] for s in slices[T, C, Z:ZZ]]
+            tile = np.stack(tile)
+            tile = np.moveaxis(tile, (0, 1, 2), (0, 2, 1))
+
+            for tile_out, (c, original_label_value) in zip(tiles, originals):
+                if c == C:
+                    np.equal(tile, original_label_value, out=tile_out)
+
+        return tiles
+
+    def _cached_label_tiles(self, image_nr, pos_zxy, size_zxy, label_values):
+        '''
+        label_tiles sliced from the compact label cache.
+        '''
+        Z, X, Y = pos_zxy
+        ZZ, XX, YY = np.array(pos_zxy) + size_zxy
+
+        tiles = np.zeros((len(label_values),) + tuple(size_zxy), dtype=bool)
+
+        compact = self._compact_labels(image_nr)
+        if compact is None:
+            return tiles
+        ranks, values = compact
+
+        for tile_out, label_value in zip(tiles, label_values):
+            C, original_label_value = self._mapped_label_value_to_original(
+                                             label_value)
+            i = np.searchsorted(values[C], original_label_value)
+            if i < len(values[C]) and values[C][i] == original_label_value:
+                np.equal(ranks[C, Z:ZZ, X:XX, Y:YY], i, out=tile_out)
+
+        return tiles
+
+    def _compact_labels(self, image_nr):
+        '''
+        Get the label image from the label cache in compact encoding
+        (see _compact_label_channels). None for unlabeled images.
+        '''
+        label_filename = self.filenames[image_nr].lbl
+        if label_filename is None:
+            return None
 
-        tile = (tile == original_label_value)
-        return tile
+        def load():
+            logger.debug('Caching labels of image %s', image_nr)
+            return _compact_label_channels(self._label_channels(image_nr))
+
+        return self.label_cache.get((self.label_path, label_filename), load,
+                                    lambda compact: compact[0].nbytes)
+
+    def _label_channels(self, image_nr):
+        '''
+        Read the full label image as list of (Z, X, Y) arrays, one per
+        label channel.
+        '''
+        slices = self._open_label_file(image_nr)
+        return [np.stack([s.T for s in slices[0, c, :]])
+                for c in range(slices.shape[1])]
 
-    @lru_cache(maxsize=10)
     def _open_label_file(self, image_nr):
-        # memmap is slow, so we must cache it to be fast!
-        path = self.img_path / self.filenames[image_nr].img
         label_filename = self.filenames[image_nr].lbl
 
         if label_filename is None:
@@ -399,9 +1010,7 @@ class TiffConnector(Connector):
             return None
 
         path = self.label_path / label_filename
-        logger.debug('Trying to load labelmat %s', path)
-
-        return Tiff.memmap_tcz(path)
+        return self._memmap('label', path)
 
     @staticmethod
     def calc_label_values_mapping(original_labels):
@@ -456,18 +1065,15 @@ class TiffConnector(Connector):
         '''
         labels_per_channel = []
 
+        if self.workers is not None and self.workers > 1:
+            self._scan_label_files(self.workers)
+
         for image_nr in range(self.image_count()):
-            slices = self._open_label_file(image_nr)
-            if slices is None:
+            counts = self._original_label_count(image_nr)
+            if counts is None:
                 continue
 
-            T = 0
-            C = slices.shape[1]
-            labels = [np.unique(np.concatenate([np.unique(s)
-                                                for s in slices[T, c, :]]))
-                      for c in range(C)]
-            labels = [set(labels) - {0} for labels in labels]
-
+            labels = [set(c.keys()) for c in counts]
             labels_per_channel = [l1.union(l2)
                                   for l1, l2 in zip_longest(labels_per_channel,
                                                             labels,
@@ -475,7 +1081,139 @@ class TiffConnector(Connector):
 
         return labels_per_channel
 
-    @lru_cache(maxsize=1500)
+    def _original_label_count(self, image_nr):
+        '''
+        Get counts of original label values per label channel. Counts are
+        taken from the label stats index if the label file is unchanged,
+        otherwise the label file is scanned.
+
+        Returns
+        -------
+        list or None
+            List of dicts, one per label channel, mapping original label
+            values to counts. None if the image has no label file.
+        '''
+        label_filename = self.filenames[image_nr].lbl
+        if label_filename is None:
+            return None
+
+        path = self.label_path / label_filename
+        counts = self._known_label_count(path)
+
+        if counts is None:
+            logger.debug('Scanning label values of %s', path)
+            if self.label_coordinates:
+                counts = _coordinate_counts(
+                    self._label_coordinate_index(image_nr))
+            else:
+                counts = _label_value_counts(self._open_label_file(image_nr))
+            self._store_label_count(path, counts)
+
+        return counts
+
+    def _label_coordinate_index(self, image_nr):
+        '''
+        Get the label coordinate index of an image (see
+        _label_value_coordinates). None for unlabeled images.
+        '''
+        label_filename = self.filenames[image_nr].lbl
+        if label_filename is None:
+            return None
+
+        path = self.label_path / label_filename
+        index = self._label_coordinates.get(path)
+        if index is None:
+            logger.debug('Indexing label coordinates of %s', path)
+            index = _label_value_coordinates(self._open_label_file(image_nr))
+            self._label_coordinates[path] = index
+        return index
+
+    def has_label_coordinates(self):
+        return self.label_coordinates
+
+    def label_index_to_coordinate(self, image_nr, label_value, label_index):
+        '''
+        Get image coordinate for specific label.
+
+        Parameters
+        ----------
+        image_nr : int
+            Index of image.
+        label_value : int
+            Id of the label (mapped label value).
+        label_index: int
+            Value between 0 and count[label_value] (see
+            label_count_for_image).
+
+        Returns
+        -------
+        numpy.ndarray
+            czxy coordinate of the label, c is the label channel.
+        '''
+        index = self._label_coordinate_index(image_nr)
+        if index is None:
+            raise ValueError('Image {} has no labels'.format(image_nr))
+
+        c, original_label_value = self._mapped_label_value_to_original(
+                                                    label_value)
+        offsets = index[c].get(original_label_value)
+        if offsets is None:
+            raise ValueError('Label {} not found in image {}'.format(
+                label_value, image_nr))
+
+        _, Z, X, Y = self.image_dimensions(image_nr)
+        zxy = np.unravel_index(offsets[label_index], (Z, X, Y))
+        return np.array((c,) + zxy)
+
+    def _known_label_count(self, path, item=None):
+        '''
+        Label value counts of a label file (or of label image `item`
+        inside the label file) from memory or from the label stats index.
+        None if the file has to be scanned.
+        '''
+        key = path if item is None else (path, item)
+        counts = self._label_stats.get(key)
+        if counts is None and self.label_index is not None:
+            counts = self.label_index.get(path, item=item)
+            if counts is not None:
+                self._label_stats[key] = counts
+        return counts
+
+    def _store_label_count(self, path, counts, item=None):
+        key = path if item is None else (path, item)
+        self._label_stats[key] = counts
+        if self.label_index is not None:
+            self.label_index.put(path, counts, item=item)
+
+    def _scan_label_files(self, workers):
+        '''
+        Scan all label files that are not known yet with a pool of
+        worker processes.
+        '''
+        paths = [self.label_path / lbl for _, lbl in self.filenames
+                 if lbl is not None]
+        paths = [p for p in paths if self._known_label_count(p) is None]
+        if len(paths) == 0:
+            return
+
+        logger.info('Scanning %s label files with %s workers',
+                    len(paths), workers)
+        scan = partial(_scan_label_file, type(self),
+                       coordinates=self.label_coordinates)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for path, counts in zip(paths, executor.map(scan, paths)):
+                if self.label_coordinates:
+                    self._label_coordinates[path] = counts
+                    counts = _coordinate_counts(counts)
+                self._store_label_count(path, counts)
+
+    def label_count_for_all_images(self, workers=None):
+        workers = workers or self.workers
+        if workers is not None and workers > 1:
+            self._scan_label_files(workers)
+
+        return super().label_count_for_all_images()
+
     def label_count_for_image(self, image_nr):
         '''
         Get number of labels per labelvalue for an image.
@@ -489,21 +1227,17 @@ class TiffConnector(Connector):
         -------
         dict
         '''
-        slices = self._open_label_file(image_nr)
-        if slices is None:
+        original_label_count = self._original_label_count(image_nr)
+        if original_label_count is None:
             return None
 
-        T = 0
-        C = slices.shape[1]
-        labels = [np.unique(np.concatenate([np.unique(s)
-                                            for s in slices[T, c, :]]))
-                  for c in range(C)]
-
-        original_label_count = [{l: sum(np.count_nonzero(s == l)
-                                        for s in slices[T, c, :])
-                                 for l in labels[c] if l > 0}
-                                for c in range(C)]
-        label_count = {self.labelvalue_mapping[c][l]: count
-                       for c, orig in enumerate(original_label_count)
-                       for l, count in orig.items()}
-        return label_count
+        return self._map_label_count(original_label_count)
+
+    def _map_label_count(self, original_label_count):
+        '''
+        Convert per channel counts of original label values to counts of
+        mapped label values.
+        '''
+        return {self.labelvalue_mapping[c][l]: count
+                for c, orig in enumerate(original_label_count)
+                for l, count in orig.items()}
@@ -0,0 +1,398 @@
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+import numpy as np
+from bigtiff import Tiff
+from bigtiff.image2d import Image2d
+import yapic_io.utils as ut
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+# tiff compression schemes supported for tiled images
+COMPRESSION_NONE = 1
+COMPRESSION_DEFLATE = (8, 32946)
+
+# positional reads without moving the file offset (not on windows)
+HAS_PREAD = hasattr(os, 'pread')
+
+
+def _read_images(f):
+    '''
+    Parse all image file directories of an opened tiff file.
+    '''
+    return list(Tiff.from_fd(f))
+
+
+def _is_reduced(image):
+    '''
+    Check if an image is a reduced resolution version of another image.
+    '''
+    return bool(image.tags.get('new_subfile_type', [0])[0] & 1)
+
+
+def _parse_ifd(ifd, offset):
+    '''
+    Parse the image file directory at `offset` of the file that `ifd`
+    was parsed from.
+
+    bigtiff only parses the chain of IFDs linked by their next IFD
+    offsets. For other IFDs the kaitai struct internals of its parser
+    are used: the stream (``_io``) and the root object (``_root``) of
+    a parsed IFD. The stream position is restored afterwards.
+    '''
+    stream = ifd._io
+    pos = stream.pos()
+    try:
+        stream.seek(offset)
+        return Image2d(ifd._root.Ifd(stream, ifd, ifd._root))
+    finally:
+        stream.seek(pos)
+
+
+def _sub_images(image):
+    '''
+    Parse the images referenced by the SubIFDs tag of an image.
+    '''
+    return [_parse_ifd(image.ifd, offset)
+            for offset in image.tags.get('sub_if_ds', [])]
+
+
+def level_shapes(shape, level):
+    '''
+    Valid (height, width) of a pyramid level, i.e. `shape` downsampled
+    by ``2**level`` and rounded down or up.
+    '''
+    f = 2**level
+    H, W = shape
+    return {(h, w) for h in (H // f, -(-H // f))
+            for w in (W // f, -(-W // f))}
+
+
+def _level_images(images, level):
+    '''
+    Select the images of a pyramid level from all images of a file.
+
+    Reduced resolution images are either stored in the main chain of
+    image file directories (flagged by the NewSubfileType tag) or
+    referenced by the SubIFDs tag of the full resolution images.
+    '''
+    full = [img for img in images if not _is_reduced(img)]
+    if level == 0:
+        return full
+
+    shapes = level_shapes((full[0].height, full[0].width), level)
+    candidates = [sub for img in full for sub in _sub_images(img)] + \
+        [img for img in images if _is_reduced(img)]
+    selected = [img for img in candidates
+                if (img.height, img.width) in shapes]
+
+    if len(selected) != len(full):
+        return None
+    return selected
+
+
+def is_tiled(path):
+    '''
+    Check if a tiff file stores its images in tiles (instead of strips).
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to tiff file.
+
+    Returns
+    -------
+    bool
+        True for tiled tiff files.
+    '''
+    with open(str(path), 'rb') as f:
+        first_image = next(iter(Tiff.from_fd(f)))
+        return 'tile_offsets' in first_image.tags
+
+
+def has_level(path, level):
+    '''
+    Check if a tiled tiff file holds an embedded pyramid level, i.e.
+    a reduced resolution image downsampled by ``2**level`` for each
+    full resolution image.
+    '''
+    with open(str(path), 'rb') as f:
+        return _level_images(_read_images(f), level) is not None
+
+
+def read_header(path):
+    '''
+    Read shape (C, Z, Y, X) and data type of a tiled tiff file from its
+    image file directories, without reading any tiles.
+    '''
+    tiff = TiledTiff(path)
+    return tiff.shape(), tiff.dtype
+
+
+def open_tcz(path, cache=None, level=0):
+    '''
+    Open a tiled tiff file as (T, C, Z) array of lazy 2d (Y, X) planes,
+    analogous to bigtiff.Tiff.memmap_tcz for untiled files.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to tiled tiff file.
+    cache : yapic_io.cache.LRUCache, optional
+        Cache for decoded tiles. Tiles are decoded on every access if
+        not given.
+    level : int, optional
+        Pyramid level to open (see has_level).
+
+    Returns
+    -------
+    numpy.ndarray
+        Object array of shape (T, C, Z) holding TiledPlane objects.
+    '''
+    return TiledTiff(path, cache=cache, level=level).tcz()
+
+
+class TiledTiff(object):
+    '''
+    Reader for tiff files with tiled image layout.
+
+    Only tiles intersecting with a requested region are read from disk
+    and decoded. Decoded tiles can be kept in an LRU cache shared by
+    several files.
+
+    Uncompressed and deflate compressed tiles (with or without
+    horizontal differencing predictor) are supported. Reduced resolution
+    images (pyramid levels) are read instead of the full resolution
+    images if a level is given.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to tiled tiff file.
+    cache : yapic_io.cache.LRUCache, optional
+        Cache for decoded tiles.
+    level : int, optional
+        Pyramid level, the image is downsampled by ``2**level``.
+    '''
+
+    def __init__(self, path, cache=None, level=0):
+        self.path = path
+        self.cache = cache
+        self.level = level
+        self._file = open(str(path), 'rb')
+        # serializes seek and read of tiles if there is no os.pread
+        self._lock = threading.Lock()
+
+        images = _read_images(self._file)
+        # axes are described by the first full resolution image only
+        self._first_image = images[0]
+        self.images = _level_images(images, level)
+        if self.images is None:
+            raise ValueError('No pyramid level {} in {}'.format(level, path))
+        self.layouts = [self._layout(img) for img in self.images]
+
+    def __repr__(self):
+        return 'TiledTiff ({} images): {}'.format(len(self.images),
+                                                  self.path)
+
+    def __del__(self):
+        self._file.close()
+
+    @staticmethod
+    def _layout(image):
+        tags = image.tags
+        if 'tile_offsets' not in tags:
+            raise NotImplementedError(
+                'Cannot read tiled and untiled images from the same file')
+
+        layout = {
+            'shape': (image.height, image.width),
+            'tile_shape': (tags['tile_length'][0], tags['tile_width'][0]),
+            'samples': tags['samples_per_pixel'][0],
+            'planar': tags.get('planar_configuration', [1])[0],
+            'dtype': image.dtype,
+            'compression': tags['compression'][0],
+            'predictor': tags.get('predictor', [1])[0],
+            'offsets': tags['tile_offsets'],
+            'byte_counts': tags['tile_byte_counts'],
+        }
+
+        compression = layout['compression']
+        if compression != COMPRESSION_NONE and \
+                compression not in COMPRESSION_DEFLATE:
+            raise NotImplementedError(
+                'Tile compression {} is not supported'.format(compression))
+        if layout['predictor'] not in (1, 2):
+            raise NotImplementedError(
+                'Predictor {} is not supported'.format(layout['predictor']))
+
+        return layout
+
+    def tcz(self):
+        '''
+        Arrange all planes in an object array of shape (T, C, Z).
+        '''
+        samples = self.layouts[0]['samples']
+        planes = [TiledPlane(self, i, j)
+                  for i in range(len(self.images)) for j in range(samples)]
+
+        axes = self._axes()
+        ax_keys = list(axes.keys())
+
+        # assign planes one by one, assigning a sequence would convert
+        # each plane to an array and thus read all tiles
+        slices = np.empty(len(planes), dtype=object)
+        for i, plane in enumerate(planes):
+            slices[i] = plane
+        slices = np.reshape(slices, list(axes.values())[:-2], order='F')
+
+        for x in 'ZCT':
+            if x not in ax_keys:
+                ax_keys = [x] + ax_keys
+
+        T = ax_keys.index('T')
+        C = ax_keys.index('C')
+        Z = ax_keys.index('Z')
+
+        while slices.ndim < 3:
+            slices = np.expand_dims(slices, 0)
+
+        return np.moveaxis(slices, (T, C, Z), (0, 1, 2))
+
+    @property
+    def dtype(self):
+        return self.layouts[0]['dtype'].newbyteorder('=')
+
+    def shape(self):
+        '''
+        Shape (C, Z, Y, X) of the image.
+        '''
+        axes = self._axes()
+        return (axes.get('C', 1), axes.get('Z', 1), axes['Y'], axes['X'])
+
+    def _axes(self):
+        first_image = self._first_image
+        description = first_image.tags.get('image_description')
+        if description is not None and 'ImageJ=' in description[0].string:
+            return first_image.axes
+
+        # no imagej metadata: samples are channels, images are z-slices
+        H, W = self.layouts[0]['shape']
+        return OrderedDict([('C', self.layouts[0]['samples']),
+                            ('Z', len(self.images)),
+                            ('Y', H),
+                            ('X', W)])
+
+    def tile(self, image_nr, tile_nr):
+        '''
+        Get a decoded tile (cached if a cache was given).
+
+        Returns
+        -------
+        numpy.ndarray
+            Tile of shape (tile_length, tile_width, samples) for chunky
+            and (tile_length, tile_width) for planar sample layout.
+        '''
+        if self.cache is None:
+            return self._decode_tile(image_nr, tile_nr)
+
+        return self.cache.get((self.path, self.level, image_nr, tile_nr),
+                              lambda: self._decode_tile(image_nr, tile_nr),
+                              lambda tile: tile.nbytes)
+
+    def _decode_tile(self, image_nr, tile_nr):
+        layout = self.layouts[image_nr]
+        offset = layout['offsets'][tile_nr]
+        byte_count = layout['byte_counts'][tile_nr]
+
+        buf = self._read(offset, byte_count)
+        if layout['compression'] in COMPRESSION_DEFLATE:
+            buf = zlib.decompress(buf)
+
+        shape = layout['tile_shape']
+        if layout['planar'] == 1:
+            shape = shape + (layout['samples'],)
+
+        dtype = layout['dtype']
+        tile = np.frombuffer(buf, dtype=dtype).reshape(shape)
+        tile = tile.astype(dtype.newbyteorder('='))
+
+        if layout['predictor'] == 2:
+            # undo horizontal differencing
+            np.cumsum(tile, axis=1, dtype=tile.dtype, out=tile)
+
+        return tile
+
+    def _read(self, offset, byte_count):
+        '''
+        Read bytes from the file, safe for concurrent calls by several
+        threads.
+        '''
+        if HAS_PREAD:
+            return os.pread(self._file.fileno(), byte_count, offset)
+
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(byte_count)
+
+
+class TiledPlane(object):
+    '''
+    Lazy 2d plane of a tiled tiff file in dimension order (Y, X).
+
+    Behaves like a read-only numpy array for slicing with ranges,
+    e.g. ``plane[Y:YY, X:XX]``, which reads only the intersecting tiles.
+    '''
+    ndim = 2
+
+    def __init__(self, tiff, image_nr, sample):
+        self.tiff = tiff
+        self.image_nr = image_nr
+        self.sample = sample
+
+        layout = tiff.layouts[image_nr]
+        self.shape = layout['shape']
+        self.dtype = layout['dtype'].newbyteorder('=')
+        self.tile_shape = layout['tile_shape']
+
+    def __repr__(self):
+        return 'TiledPlane {} of image {} in {}'.format(
+            self.shape, self.image_nr, self.tiff.path)
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    @property
+    def T(self):
+        return np.asarray(self).T
+
+    def __array__(self, dtype=None):
+        tile = self[:, :]
+        return tile if dtype is None else tile.astype(dtype)
+
+    def __getitem__(self, key):
+        pos, size = ut.slices_to_region(key, self.shape)
+
+        out = np.empty(size, dtype=self.dtype)
+        if 0 in size:
+            return out
+
+        layout = self.tiff.layouts[self.image_nr]
+        n_tiles_x = -(-self.shape[1] // self.tile_shape[1])
+        n_tiles = len(layout['offsets'])
+
+        for (ty, tx), in_tile, in_out in ut.intersecting_chunks(
+                pos, size, self.tile_shape):
+            tile_nr = ty * n_tiles_x + tx
+            if layout['planar'] == 1:
+                tile = self.tiff.tile(self.image_nr, tile_nr)
+                out[in_out] = tile[in_tile + (self.sample,)]
+            else:
+                tile_nr += self.sample * n_tiles // layout['samples']
+                tile = self.tiff.tile(self.image_nr, tile_nr)
+                out[in_out] = tile[in_tile]
+
+        return out
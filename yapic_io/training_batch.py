@@ -95,6 +95,7 @@ class TrainingBatch(Minibatch):
         self.rotation_range = None
         self.shear_range = None
         self._pixels = None
+        self._level_pixels = []
         self._weights = None
 
         self.tile_pos_for_label = {key: self.tile_positions(sliding=True)
@@ -111,18 +112,28 @@ class TrainingBatch(Minibatch):
         return self
 
     def __next__(self):
-        pixels = []
         weights = []
         augmentations = []
 
-        for label in self.labels:
-            tile_data = self._random_tile(for_label=label)
+        # the whole batch of pixels is assembled in one preallocated array
+        size_padded = np.array(self.tile_size_zxy) + \
+            2 * np.array(self.padding_zxy)
+        shape = np.hstack([len(self.labels), len(self.channels),
+                           size_padded])
+        pixels = np.empty(shape, dtype=self.dataset.pixel_dtype())
+        level_pixels = [np.empty(shape, dtype=self.dataset.pixel_dtype())
+                        for _ in self.pixel_levels]
+
+        for i, label in enumerate(self.labels):
+            tile_data = self._random_tile(
+                for_label=label, out=pixels[i],
+                level_out=[p[i] for p in level_pixels])
 
-            pixels.append(tile_data.pixels)
             weights.append(tile_data.weights)
             augmentations.append(tile_data.augmentation)
 
-        self._pixels = np.array(pixels)
+        self._pixels = pixels
+        self._level_pixels = level_pixels
         self._weights = np.array(weights, self.float_data_type)
         self.augmentations = augmentations
 
@@ -179,7 +190,18 @@ class TrainingBatch(Minibatch):
             self.augmentation.discard('shear')
 
     def pixels(self):
-        pix = self._normalize(self._pixels).astype(self.float_data_type)
+        return self._format_pixels(self._pixels)
+
+    def multiscale_pixels(self):
+        '''
+        Pixels of all resolution levels: ``self.pixels()`` followed by
+        the pixels of each level set with ``set_pixel_levels``.
+        '''
+        return [self.pixels()] + [self._format_pixels(p)
+                                  for p in self._level_pixels]
+
+    def _format_pixels(self, pixels):
+        pix = self._normalize(pixels).astype(self.float_data_type)
 
         return np.moveaxis(pix, [0, 1, 2, 3, 4],
                            self.pixel_dimension_order)
@@ -369,14 +391,17 @@ class TrainingBatch(Minibatch):
         out.augmentation = self.augmentation
         out.rotation_range = self.rotation_range
         out.shear_range = self.shear_range
+        out.pixel_levels = self.pixel_levels
 
         out.tile_pos_for_label = tile_pos_for_label_out
 
         return out
 
-    def _random_tile(self, for_label):
+    def _random_tile(self, for_label, out=None, level_out=()):
         '''
         Pick random tile in image regions where label data is present.
+        If given, the pixel tile is written to out and the pixel tiles
+        of self.pixel_levels are written to level_out.
         '''
 
         # random pollng loop
@@ -403,7 +428,8 @@ class TrainingBatch(Minibatch):
                                     channels,
                                     labels,
                                     pixel_padding=self.padding_zxy,
-                                    augment_params=self._augment_params())
+                                    augment_params=self._augment_params(),
+                                    out=out)
 
             if _are_weights_in_tile(tile_data, for_label):
                 msg = ('Needed {} trials to fetch random tile containing ' +
@@ -411,6 +437,7 @@ class TrainingBatch(Minibatch):
                                                for_label)
                 logger.info(msg)
 
+                self._level_tiles(image_nr, pos_zxy, tile_data, level_out)
                 return tile_data
 
             else:
@@ -421,8 +448,21 @@ class TrainingBatch(Minibatch):
                'within {} trials').format(for_label, counter)
         logger.warning(msg)
 
+        self._level_tiles(image_nr, pos_zxy, tile_data, level_out)
         return tile_data
 
+    def _level_tiles(self, image_nr, pos_zxy, tile_data, level_out):
+        '''
+        Fetch the pixel tiles of self.pixel_levels for the location of
+        a training tile, augmented like the training tile.
+        '''
+        for level, out in zip(self.pixel_levels, level_out):
+            self.dataset.multichannel_pixel_tile(
+                image_nr, pos_zxy, self.tile_size_zxy, tile_data.channels,
+                pixel_padding=self.padding_zxy,
+                augment_params=tile_data.augmentation,
+                out=out, level=level)
+
 
 def _are_weights_in_tile(tile_data, for_label):
     '''
@@ -105,7 +105,8 @@ def warp_image_2d_stack(image, rotation_angle, shear_angle):
     raise ValueError(msg)
 
 
-def flip_image_2d_stack(image, fliplr=False, flipud=False, rot90=0):
+def flip_image_2d_stack(image, fliplr=False, flipud=False, rot90=0,
+                        inverse=False):
     '''
     Flips and rotates a zxy stack in xy with fast numpy operations.
 
@@ -119,13 +120,24 @@ def flip_image_2d_stack(image, fliplr=False, flipud=False, rot90=0):
         If True, image is flipped upside down.
     rot90 : integer
         Number of times the array is rotated by 90 degrees.
+    inverse : bool, optional
+        If True, the inverse transformation is applied.
 
     Returns
     -------
     numpy.ndarray
-        transformed image
+        transformed image (a view of the input image)
     '''
     image = image.T
+    if inverse:
+        if rot90 > 0:
+            image = np.rot90(image, k=-rot90)
+        if flipud:
+            image = np.flipud(image)
+        if fliplr:
+            image = np.fliplr(image)
+        return image.T
+
     if fliplr:
         image = np.fliplr(image)
     if flipud:
@@ -133,3 +145,35 @@ def flip_image_2d_stack(image, fliplr=False, flipud=False, rot90=0):
     if rot90 > 0:
         image = np.rot90(image, k=rot90)
     return image.T
+
+
+def downsample_2d(image):
+    '''
+    Halves the size of the last two dimensions by averaging 2x2 blocks.
+
+    Odd sizes are rounded up, the last row/column is averaged with
+    itself (edge mode). Integer images are rounded (half up) and keep
+    their data type.
+
+    Parameters
+    ----------
+    image : array_like
+        must be at least 2D
+
+    Returns
+    -------
+    numpy.ndarray
+        downsampled image of shape ``(..., ceil(n/2), ceil(m/2))``
+    '''
+    image = np.asarray(image)
+    n, m = image.shape[-2:]
+    nn, mm = -(-n // 2), -(-m // 2)
+
+    pad = [(0, 0)] * (image.ndim - 2) + [(0, 2 * nn - n), (0, 2 * mm - m)]
+    blocks = np.pad(image, pad, mode='edge').reshape(
+        image.shape[:-2] + (nn, 2, mm, 2))
+    mean = blocks.mean(axis=(-3, -1))
+
+    if image.dtype.kind in 'iub':
+        mean = np.floor(mean + 0.5)
+    return mean.astype(image.dtype)
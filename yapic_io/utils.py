@@ -1,7 +1,10 @@
 import numpy as np
 import logging
 import os
+import re
+import collections
 import itertools
+import warnings
 from difflib import SequenceMatcher
 from munkres import Munkres
 
@@ -138,6 +141,135 @@ def find_overlapping_tiles(a, pos, shape):
     return np.stack(is_overlap).all(axis=0)
 
 
+def intersecting_chunks(pos, size, chunk_shape):
+    '''
+    Find all chunks of a regularly chunked n-dimensional array that
+    intersect with a requested subset.
+
+    Parameters
+    ----------
+    pos : tuple
+        Upper left position of the subset in n dimensions.
+    size : tuple
+        Size of the subset.
+    chunk_shape : tuple
+        Shape of one chunk.
+
+    Yields
+    ------
+    chunk_idx, chunk_slices, out_slices
+        N-dimensional index of the chunk, the part of the chunk inside
+        the subset and the corresponding part of the subset.
+
+    Examples
+    --------
+    >>> from yapic_io.utils import intersecting_chunks
+    >>> for idx, in_chunk, in_out in intersecting_chunks((3,), (4,), (4,)):
+    ...     print(idx, in_chunk, in_out)
+    (0,) (slice(3, 4, None),) (slice(0, 1, None),)
+    (1,) (slice(0, 3, None),) (slice(1, 4, None),)
+    '''
+    ranges = [range(p // c, -(-(p + s) // c))
+              for p, s, c in zip(pos, size, chunk_shape)]
+
+    for chunk_idx in itertools.product(*ranges):
+        chunk_slices = []
+        out_slices = []
+        for i, p, s, c in zip(chunk_idx, pos, size, chunk_shape):
+            start = max(p, i * c)
+            stop = min(p + s, (i + 1) * c)
+            chunk_slices.append(slice(start - i * c, stop - i * c))
+            out_slices.append(slice(start - p, stop - p))
+        yield chunk_idx, tuple(chunk_slices), tuple(out_slices)
+
+
+def slices_to_region(key, shape):
+    '''
+    Convert an index of slices (as used for numpy arrays) to upper left
+    position and size of the selected region. Only slices with step 1
+    and Ellipsis are supported.
+
+    Examples
+    --------
+    >>> from yapic_io.utils import slices_to_region
+    >>> slices_to_region((slice(2, 5), slice(None)), (10, 20))
+    ((2, 0), (3, 20))
+    >>> slices_to_region(Ellipsis, (10, 20))
+    ((0, 0), (10, 20))
+    '''
+    if key is Ellipsis:
+        key = ()
+    if not isinstance(key, tuple):
+        key = (key,)
+    key = key + (slice(None),) * (len(shape) - len(key))
+
+    pos = []
+    size = []
+    for k, n in zip(key, shape):
+        if not isinstance(k, slice):
+            raise IndexError('Only slices are supported')
+        start, stop, step = k.indices(n)
+        if step != 1:
+            raise IndexError('Only slices with step 1 are supported')
+        pos.append(start)
+        size.append(max(0, stop - start))
+
+    return tuple(pos), tuple(size)
+
+
+def region_to_slices(pos, size):
+    '''
+    Convert upper left position and size of a region to an index of
+    slices (inverse of slices_to_region).
+
+    Examples
+    --------
+    >>> from yapic_io.utils import region_to_slices
+    >>> region_to_slices((2, 0), (3, 20))
+    (slice(2, 5, None), slice(0, 20, None))
+    '''
+    return tuple(slice(p, p + s) for p, s in zip(pos, size))
+
+
+def quantize_probabilities(probabilities, dtype):
+    '''
+    Convert probabilities to a (smaller) output data type.
+
+    Floating point types are converted directly. For unsigned integer
+    types, probabilities are clipped to [0, 1] and scaled to the full
+    range of the type, e.g. 1.0 corresponds to 255 for uint8.
+
+    Parameters
+    ----------
+    probabilities : array_like
+        Probability values.
+    dtype : numpy.dtype
+        Output data type, floating point or unsigned integer.
+
+    Returns
+    -------
+    numpy.ndarray
+        Probabilities with data type `dtype`.
+
+    Examples
+    --------
+    >>> from yapic_io.utils import quantize_probabilities
+    >>> quantize_probabilities([0, 0.5, 1, 1.2], 'uint8')
+    array([  0, 128, 255, 255], dtype=uint8)
+    '''
+    dtype = np.dtype(dtype)
+    probabilities = np.asarray(probabilities)
+    if probabilities.dtype == dtype:
+        return probabilities
+
+    if dtype.kind == 'f':
+        return probabilities.astype(dtype)
+
+    scaled = np.clip(probabilities, 0, 1) * np.iinfo(dtype).max
+    np.rint(scaled, out=scaled)
+    return scaled.astype(dtype)
+
+
 def segregate_tile_pos(pos, shape, choices):
     '''
     splits a vector of positions in two vectors and removes all overlapping
@@ -155,6 +287,36 @@ def segregate_tile_pos(pos, shape, choices):
     return [tuple(e) for e in p1], [tuple(e) for e in p2]
 
 
+def split_image_nrs(n_images, fraction, random_seed=42):
+    '''
+    Split image indices pseudo-randomly into two subsets, the first of
+    size `(1-fraction)*n_images`, the other of size `fraction*n_images`.
+    The global random state is not changed.
+
+    Returns
+    -------
+    image_nrs1, image_nrs2 : list of int
+    '''
+    state = np.random.get_state()
+    np.random.seed(random_seed)
+    mask = np.random.choice([True, False], size=n_images, p=[
+                            1 - fraction, fraction])
+    np.random.set_state(state)
+
+    image_nrs1 = np.flatnonzero(mask).tolist()
+    image_nrs2 = np.flatnonzero(~mask).tolist()
+
+    if len(image_nrs1) == 0:
+        msg = 'split({}): First connector is empty!'.format(fraction)
+        warnings.warn(msg)
+
+    if len(image_nrs2) == 0:
+        msg = 'split({}): Second connector is empty!'.format(fraction)
+        warnings.warn(msg)
+
+    return image_nrs1, image_nrs2
+
+
 def _compute_str_dist_matrix(s1, s2):
     '''
     - compute matrix of string distances for two lists of strings
@@ -171,10 +333,90 @@ def _compute_str_dist_matrix(s1, s2):
     return mat, s1, s2
 
 
-def find_best_matching_pairs(s1, s2):
+def _stem(s):
+    '''
+    File name without folder and extension.
+    '''
+    return os.path.splitext(os.path.basename(s))[0]
+
+
+def _tokens(s):
+    return [t for t in re.split('[^0-9a-z]+', _stem(s).lower()) if t]
+
+
+def _token_keys(s1, s2):
+    '''
+    Normalized token keys of two lists of file names: lower case
+    alphanumeric tokens of the file stems without tokens marking the
+    kind of file, i.e. tokens occurring in all names of a list or in
+    several names of one list but not in the other list (such as
+    prefixes like "img" and "lbl").
+    '''
+    tokens1 = [_tokens(s) for s in s1]
+    tokens2 = [_tokens(s) for s in s2]
+
+    counts1 = collections.Counter(t for tok in tokens1 for t in set(tok))
+    counts2 = collections.Counter(t for tok in tokens2 for t in set(tok))
+
+    def keys(tokens, counts, other_counts):
+        ignore = {t for t, count in counts.items()
+                  if count == len(tokens) or
+                  (count > 1 and t not in other_counts)}
+        return [tuple(sorted(t for t in tok if t not in ignore))
+                for tok in tokens]
+
+    return keys(tokens1, counts1, counts2), keys(tokens2, counts2, counts1)
+
+
+def _match_unique_keys(s1, s2, matches, keys):
+    '''
+    Match unassigned strings of s1 and s2 with identical keys, where
+    `keys` computes the keys of two lists of strings. Only keys that
+    occur exactly once in both lists are matched. `matches` maps
+    indices of s1 to indices of s2 and is updated in place.
+    '''
+    left1 = [i for i in range(len(s1)) if i not in matches]
+    left2 = sorted(set(range(len(s2))) - set(matches.values()))
+    if len(left1) == 0 or len(left2) == 0:
+        return
+
+    keys1, keys2 = keys([s1[i] for i in left1], [s2[j] for j in left2])
+
+    counts1 = collections.Counter(keys1)
+    counts2 = collections.Counter(keys2)
+    index2 = {key: j for j, key in enumerate(keys2) if counts2[key] == 1}
+
+    for i, key in enumerate(keys1):
+        if counts1[key] == 1 and key in index2:
+            matches[left1[i]] = left2[index2[key]]
+
+
+def _hungarian_matches(s1, s2):
     '''
     Find global minimum for pairwise assignment of strings
-    by using the munkres (hungarian) algorithmself.
+    by using the munkres (hungarian) algorithm.
+
+    Returns
+    -------
+    list
+        Pairs of indices (i, j) of assigned strings s1[i] and s2[j].
+    '''
+    mat, _, _ = _compute_str_dist_matrix(s1, s2)
+
+    # find assignment combination with lowest global cost
+    m = Munkres()
+    return [(i, j) for i, j in m.compute(mat)
+            if i < len(s1) and j < len(s2)]
+
+
+def find_best_matching_pairs(s1, s2):
+    '''
+    Find pairwise assignment of strings (file names).
+
+    Strings are first paired by identical file stems, then by identical
+    normalized tokens (see _token_keys), both in linear time. Only the
+    remaining strings are assigned by finding the global minimum of
+    string distances with the munkres (hungarian) algorithm.
 
     Parameters
     ----------
@@ -183,6 +425,12 @@ def find_best_matching_pairs(s1, s2):
     s2 : array_like
        List of strings.
 
+    Returns
+    -------
+    list
+        Pairs ``[a, b]`` for each non-empty string `a` of s1 in order,
+        `b` is None if `a` was not assigned.
+
     Notes
     -----
     Counts of non-empty elements must be equal for s1 and s2.
@@ -196,19 +444,20 @@ def find_best_matching_pairs(s1, s2):
         assert len(s2) == 0
         return []
 
-    mat, s1norm, s2norm = _compute_str_dist_matrix(s1, s2)
-
-    # find assignment combination with lowest global cost
-    m = Munkres()
-    indexes = m.compute(mat)
-
-    pairs = [[s1norm[i], s2norm[j]] for i, j in indexes]
-
-    # change empty strings to None
-    for pair in pairs:
-        if pair[0] == '':
-            pair[0] = None
-        elif pair[1] == '':
-            pair[1] = None
-
-    return [pair for pair in pairs if pair[0] is not None]
+    matches = {}
+    _match_unique_keys(s1, s2, matches,
+                       lambda a, b: ([_stem(s) for s in a],
+                                     [_stem(s) for s in b]))
+    _match_unique_keys(s1, s2, matches, _token_keys)
+
+    left1 = [i for i in range(len(s1)) if i not in matches]
+    left2 = sorted(set(range(len(s2))) - set(matches.values()))
+    if len(left1) > 0 and len(left2) > 0:
+        logger.info('Assigning %s of %s files by string distance',
+                    len(left1), len(s1))
+        for i, j in _hungarian_matches([s1[i] for i in left1],
+                                       [s2[j] for j in left2]):
+            matches[left1[i]] = left2[j]
+
+    return [[a, s2[matches[i]] if i in matches else None]
+            for i, a in enumerate(s1)]